@@ -1,9 +1,10 @@
-from database import engine
-import models
+import migrations
 import utils
 import streamlit as st
+import instrumentation
 
-models.Base.metadata.create_all(bind=engine)
+#Creates and migrates the tables once per process, not on every rerun.
+migrations.initialize()
 
 #Checks if the user is logged in. If not it prompts log-in.
 if "current_user" not in st.session_state:
@@ -57,4 +58,7 @@ else:
         "Your spending will now be visualized, allowing you to keep track of your spending habits in the :blue['Expenditure Visualization'] section.  \n"
         "5. :red[Extra Note]: If you are using file upload and have multiple texts that belongs to a certain category, use the :blue['Identify Category by Text'] tab in :blue['Categories Setup'].  \n"
         "For instance if you have the category 'Subscriptions' where you want Netflix and HBO to be automatically categorized, simply add :green[**Netflix**] and :green[**HBO**] individually in this tab."
-    )
\ No newline at end of file
+    )
+
+#Shows where the rerun spent its time, if the instrumentation is enabled.
+instrumentation.timing_panel()
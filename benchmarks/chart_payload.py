@@ -0,0 +1,78 @@
+"""
+Measures the size of the figure JSON sent to the browser and the time to build and serialize it,
+with and without the high volume mode of utils.visual, for synthetic histories of different lengths.
+
+Render time in the browser is not measured, but grows with the amount of points and the size of the payload.
+
+Usage:
+    python benchmarks/chart_payload.py [--years 5 20 50] [--categories 10]
+"""
+import argparse
+import tempfile
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("db_url", f"sqlite:///{tempfile.mkdtemp()}/benchmark.db")
+
+import pandas as pd
+import numpy as np
+from utils import visual
+from utils.analytics import build_analytics
+
+
+def rollups(years: int, categories: int) -> pd.DataFrame:
+    #Random monthly rollups in the shape returned by database.get_monthly_rollups.
+    generator = np.random.default_rng(0)
+    months = pd.date_range("2000-01-01", periods=years * 12, freq="MS")
+    index = pd.MultiIndex.from_product([months, [f"Category {number}" for number in range(categories)]], names=["month", "Kategori"])
+
+    frame = index.to_frame(index=False)
+    frame["Typ"] = "Kostnad"
+    frame["Belopp"] = -generator.uniform(100, 5000, len(frame)).round(2)
+    frame["Occurances"] = generator.integers(1, 30, len(frame))
+    frame["Saldo"] = generator.normal(50000, 10000, len(frame)).round(2)
+    frame["last_date"] = frame["month"] + pd.to_timedelta(generator.integers(0, 28, len(frame)), unit="D")
+
+    return frame
+
+
+def run(years: int, categories: int, high_volume: bool) -> list:
+    #Builds and serializes the line charts the same way st.plotly_chart does.
+    analytics = build_analytics(rollups(years, categories))
+    charts = {
+        "monthly_balance": lambda: visual.monthly_balance(analytics, high_volume=high_volume),
+        "line_plot": lambda: visual.line_plot(analytics, analytics.cost_categories, high_volume=high_volume),
+    }
+
+    results = []
+    for name, chart in charts.items():
+        started = time.perf_counter()
+        figure = chart()
+        payload = figure.to_json()
+        seconds = time.perf_counter() - started
+
+        results.append({
+            "chart": name,
+            "years": years,
+            "high_volume": high_volume,
+            "points": sum(len(trace.x) for trace in figure.data),
+            "trace": figure.data[0].type if figure.data else None,
+            "payload_kb": round(len(payload) / 1024, 1),
+            "build_ms": round(seconds * 1000, 1),
+        })
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--years", type=int, nargs="+", default=[5, 20, 50])
+    parser.add_argument("--categories", type=int, default=10)
+    arguments = parser.parse_args()
+
+    results = pd.DataFrame([result for years in arguments.years for high_volume in (False, True)
+                            for result in run(years, arguments.categories, high_volume)])
+
+    print(results.sort_values(by=["chart", "years", "high_volume"]).to_string(index=False))
@@ -0,0 +1,153 @@
+"""
+Measures the cold start of every page: the time a new process takes to import what the page uses and,
+for Home, to initialize the database. Checks the results against an import-time budget.
+
+Every measurement runs in a new interpreter, like the first rerun after a deploy.
+The framework (streamlit, pandas and sqlalchemy) is measured on its own, since every page needs it,
+and the budget of a page is the time it may take on top of the framework. The framework and the pages are measured
+in rounds and the median of the differences within a round is reported, so a machine slowing down affects both alike.
+A page also fails the budget if it imports a module it must not need, e.g. plotly.express on the login screen.
+
+Usage:
+    python benchmarks/import_time.py [--repeat 7] [--db-url URL] [--scale 1.0] [--save NAME] [--compare NAME] [--tolerance 0.25]
+
+Runs against a temporary SQLite database unless --db-url is given. --scale multiplies every budget, for slower machines.
+The budgets were measured on a development machine. On other machines, --save stores the results as
+benchmarks/baselines/import_time-NAME.json, and --compare uses such a baseline as the budgets instead:
+a page may then take at most the tolerance more than in the baseline, plus NOISE_MS.
+Exits with status 1 if any page is over its budget.
+"""
+from datetime import datetime
+from typing import Dict, List
+import statistics
+import subprocess
+import argparse
+import platform
+import tempfile
+import json
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_DIRECTORY = os.path.join(ROOT, "benchmarks", "baselines")
+
+#Milliseconds a page may exceed its baseline by on top of the tolerance, since the import times vary between runs.
+NOISE_MS = 50
+
+#What the framework and every page import when a process serves them for the first time.
+FRAMEWORK = "import streamlit, pandas, sqlalchemy"
+
+PAGES = {
+    "Home": "import migrations, utils, streamlit, instrumentation; migrations.initialize()",
+    "Home (login)": "import migrations, utils, streamlit, instrumentation; migrations.initialize(); utils.login",
+    "Expenditure Visualization": "import streamlit, instrumentation, utils, database, migrations, pandas; migrations.initialize(); "
+                                 "utils.get_analytics; utils.get_chart",
+    "Upload Data": "import streamlit, instrumentation, pandas, ingest, utils, database, migrations; migrations.initialize(); "
+                   "utils.get_category_catalog",
+    "Categories Setup": "import streamlit, instrumentation, database, migrations, utils; migrations.initialize(); utils.get_category_catalog",
+}
+
+#Milliseconds every page may take on top of the framework, measured with --repeat 7 on a development machine.
+BUDGET_MS = {
+    "Home": 450,
+    "Home (login)": 550,
+    "Expenditure Visualization": 750,
+    "Upload Data": 600,
+    "Categories Setup": 600,
+}
+
+#Modules a page must not import, because they are only needed after the user has done something on it.
+FORBIDDEN = {
+    "Home": ["plotly.express", "passlib", "regex", "lxml"],
+    "Home (login)": ["plotly.express"],
+    "Upload Data": ["plotly.express"],
+    "Categories Setup": ["plotly.express"],
+}
+
+#Runs in the new interpreter: times the statement and reports which modules it imported.
+MEASURE = '''
+import time, sys, json
+started = time.perf_counter()
+{statement}
+print(json.dumps({{"ms": (time.perf_counter() - started) * 1000, "modules": sorted(sys.modules)}}))
+'''
+
+
+def measure(statement: str, db_url: str) -> Dict[str, object]:
+    #Runs the statement in a new interpreter and returns the time it took and the modules it imported.
+    output = subprocess.run([sys.executable, "-c", MEASURE.format(statement=statement)], cwd=ROOT, env=dict(os.environ, db_url=db_url),
+                            capture_output=True, text=True, check=True).stdout
+
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure_pages(repeat: int, db_url: str) -> Dict[str, Dict[str, object]]:
+    #Measures the framework and every page in 'repeat' rounds. Returns the median time of every page,
+    #the median of its differences with the framework of the same round and the modules it imported.
+    runs: Dict[str, List[dict]] = {page: [] for page in ["framework", *PAGES]}
+
+    for _ in range(repeat):
+        framework = measure(FRAMEWORK, db_url)
+        runs["framework"].append(dict(framework, extra=0.0))
+
+        for page, statement in PAGES.items():
+            result = measure(statement, db_url)
+            runs[page].append(dict(result, extra=result["ms"] - framework["ms"]))
+
+    return {page: {"ms": statistics.median(run["ms"] for run in page_runs),
+                   "extra": statistics.median(run["extra"] for run in page_runs),
+                   "modules": set(page_runs[-1]["modules"])}
+            for page, page_runs in runs.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--db-url", default=f"sqlite:///{tempfile.mkdtemp()}/import_time.db")
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--save", metavar="NAME")
+    parser.add_argument("--compare", metavar="NAME")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    budgets = {page: budget * args.scale for page, budget in BUDGET_MS.items()}
+    if args.compare:
+        with open(os.path.join(BASELINE_DIRECTORY, f"import_time-{args.compare}.json")) as file:
+            baseline = json.load(file)["extra_ms"]
+
+        budgets.update({page: extra * (1 + args.tolerance) + NOISE_MS for page, extra in baseline.items() if page in PAGES})
+
+    results = measure_pages(args.repeat, args.db_url)
+    print(f"{'framework':<28}{results['framework']['ms']:>9.0f} ms")
+
+    over_budget = False
+    for page in PAGES:
+        result = results[page]
+        extra = result["extra"]
+        budget = budgets[page]
+        imported = [module for module in FORBIDDEN.get(page, []) if module in result["modules"]]
+
+        verdict = "ok" if extra <= budget and not imported else "over budget"
+        over_budget |= verdict != "ok"
+
+        print(f"{page:<28}{result['ms']:>9.0f} ms  +{extra:.0f} ms of {budget:.0f} ms  {verdict}"
+              + (f"  imports {', '.join(imported)}" if imported else ""))
+
+    if args.save:
+        os.makedirs(BASELINE_DIRECTORY, exist_ok=True)
+        path = os.path.join(BASELINE_DIRECTORY, f"import_time-{args.save}.json")
+
+        with open(path, "w") as file:
+            json.dump({
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "repeat": args.repeat,
+                "framework_ms": results["framework"]["ms"],
+                "extra_ms": {page: results[page]["extra"] for page in PAGES},
+            }, file, indent=2)
+
+        print(f"\nSaved the baseline to {path}")
+
+    if over_budget:
+        sys.exit(1)
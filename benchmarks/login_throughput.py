@@ -0,0 +1,64 @@
+"""
+Measures login throughput for different bcrypt cost factors under concurrent logins.
+
+Every login verifies one password on the bounded hashing pool in utils.auth, the same way utils.login does.
+The cost factors are tried on a context of their own, so the hashing policy of utils.auth is left as configured.
+Use the result to choose bcrypt_rounds and bcrypt_workers for the amount of logins the container has to handle.
+
+Usage:
+    python benchmarks/login_throughput.py [--rounds 10 11 12] [--concurrency 1 4 16] [--logins 64]
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import tempfile
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("db_url", f"sqlite:///{tempfile.mkdtemp()}/benchmark.db")
+
+from passlib.context import CryptContext
+import pandas as pd
+import numpy as np
+from utils import auth
+
+
+def run(rounds: int, concurrency: int, logins: int) -> dict:
+    #Simulates 'concurrency' sessions logging in at the same time until 'logins' logins are done.
+    #The policy is set to the same cost factor, so no login rehashes the password.
+    bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+    hashed_password = bcrypt_context.hash("benchmark")
+    latencies = []
+
+    def login(_) -> None:
+        started = time.perf_counter()
+        auth.hashing_pool.submit(bcrypt_context.verify_and_update, "benchmark", hashed_password).result()
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as sessions:
+        list(sessions.map(login, range(logins)))
+    seconds = time.perf_counter() - started
+
+    return {
+        "rounds": rounds,
+        "concurrency": concurrency,
+        "logins_per_second": round(logins / seconds, 1),
+        "p50_ms": round(np.percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(np.percentile(latencies, 95) * 1000, 1),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, nargs="+", default=[10, 11, 12])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--logins", type=int, default=64)
+    arguments = parser.parse_args()
+
+    results = pd.DataFrame([run(rounds, concurrency, arguments.logins)
+                            for rounds in arguments.rounds for concurrency in arguments.concurrency])
+
+    print(f"bcrypt_workers: {auth.BCRYPT_WORKERS}")
+    print(results.to_string(index=False))
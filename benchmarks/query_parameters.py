@@ -0,0 +1,117 @@
+"""
+Compares literal (f-string) SQL against the bound-parameter statements in database.py under concurrent sessions.
+
+Every literal query has a unique statement text, so SQLAlchemy compiles it again and the database parses and
+plans it again. The bound statements are compiled once and reuse the same text for every user, which the
+'statements' column shows as the amount of distinct statement texts sent to the database.
+
+The statements in database.py are text() constructs with bound parameters rather than Core select() expressions:
+the SQL stays as it was written, and a text() statement is cached by its text like a Core statement is.
+
+Usage:
+    python benchmarks/query_parameters.py [--users 50] [--rows 2000] [--threads 8] [--queries 2000]
+
+Runs against the database in the db_url environment variable, or a temporary SQLite database if it is not set.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import argparse
+import tempfile
+import random
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("db_url", f"sqlite:///{tempfile.mkdtemp()}/benchmark.db")
+
+from sqlalchemy import event, text
+import pandas as pd
+import database
+import models
+
+
+START_MONTH = datetime(2020, 1, 1)
+
+
+def seed(users: int, rows: int) -> None:
+    #Creates the users and random transactions the queries are run against.
+    models.Base.metadata.create_all(bind=database.engine)
+
+    with database.engine.begin() as db_connection:
+        db_connection.execute(text("DELETE FROM expenditures"))
+        db_connection.execute(text("DELETE FROM users"))
+        db_connection.execute(models.Users.__table__.insert(),
+                              [{"user_id": user_id, "username": f"user{user_id}", "email": f"user{user_id}@mail.com"}
+                               for user_id in range(1, users + 1)])
+
+    dates = pd.date_range("2020-01-01", "2023-12-31", freq="D")
+    frame = pd.DataFrame({
+        "Transaktionsdatum": [random.choice(dates) for _ in range(users * rows)],
+        "Text": [f"Store {random.randint(1, 300)}" for _ in range(users * rows)],
+        "Belopp": [round(random.uniform(-2000, 500), 2) for _ in range(users * rows)],
+        "Typ": "Kostnad",
+        "Kategori": "Other",
+        "user_id": [user_id for user_id in range(1, users + 1) for _ in range(rows)],
+    })
+    database.bulk_insert_expenditures(frame)
+
+
+def literal_query(user_id: int) -> int:
+    #The query as it was written before, with the values formatted into the statement text.
+    with database.engine.connect() as db_connection:
+        query = f'''
+        SELECT * FROM expenditures
+        WHERE "Transaktionsdatum" >= '{START_MONTH}' AND user_id = {user_id}
+        '''
+        return len(db_connection.execute(text(query)).fetchall())
+
+
+def bound_query(user_id: int) -> int:
+    with database.engine.connect() as db_connection:
+        return len(db_connection.execute(database.CASH_DATA_QUERY, {"user_id": user_id, "start_month": START_MONTH}).fetchall())
+
+
+def run(query, users: int, threads: int, queries: int) -> dict:
+    #Runs the query for random users from several threads at once, like concurrent Streamlit sessions.
+    database.engine.clear_compiled_cache()
+    user_ids = [random.randint(1, users) for _ in range(queries)]
+
+    #Collects the statement texts sent to the database.
+    statements = set()
+    collect = lambda connection, cursor, statement, *args: statements.add(statement)
+    event.listen(database.engine, "before_cursor_execute", collect)
+
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(query, user_ids))
+        seconds = time.perf_counter() - started
+    finally:
+        event.remove(database.engine, "before_cursor_execute", collect)
+
+    return {
+        "query": query.__name__,
+        "seconds": round(seconds, 3),
+        "queries_per_second": round(queries / seconds, 1),
+        "statements": len(statements),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--queries", type=int, default=2000)
+    arguments = parser.parse_args()
+
+    seed(arguments.users, arguments.rows)
+
+    #Warms up the database so both variants read from the same page cache.
+    run(bound_query, arguments.users, arguments.threads, arguments.users)
+
+    results = pd.DataFrame([run(query, arguments.users, arguments.threads, arguments.queries)
+                            for query in (literal_query, bound_query)])
+    print(f"Database: {database.engine.dialect.name}, {arguments.threads} threads, {arguments.queries} queries")
+    print(results.to_string(index=False))
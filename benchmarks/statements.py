@@ -0,0 +1,114 @@
+"""
+Generates synthetic Handelsbanken statements for the benchmarks.
+
+A statement is an HTML document with a .xls extension. The transactions are in the fourth table,
+which is what pd.read_html(file)[3] and utils.parsing.read_statement_chunks expect.
+
+Usage:
+    python benchmarks/statements.py statement.xls [--rows 20000] [--categories 30] [--seed 0]
+"""
+from typing import List, Tuple
+from html import escape
+import argparse
+import random
+import sys
+import os
+
+import pandas as pd
+
+
+COLUMNS = ["Reskontradatum", "Transaktionsdatum", "Text", "Belopp", "Saldo"]
+
+#Texts that none of the generated rules identify, which end up in 'Other'.
+UNCATEGORIZED_SHARE = 0.2
+
+
+def format_amount(amount: float) -> str:
+    #Formats an amount the way the bank does, e.g. -1 234,50
+    return f"{amount:,.2f}".replace(",", " ").replace(".", ",")
+
+
+def category_rules(categories: int, texts_per_category: int = 3) -> List[Tuple[str, str]]:
+    """
+    Returns the (category, identifying text) pairs matching the texts of the generated statements.
+
+    --------
+    Parameters
+    categories: int
+        Amount of categories.
+    texts_per_category: int default 3
+        Amount of identifying texts per category.
+
+    --------
+    Returns
+    list of tuple
+        Containing (category, identifying text) pairs.
+    """
+
+    return [(f"Category {category}", f"MERCHANT {category}-{text}")
+            for category in range(categories) for text in range(texts_per_category)]
+
+
+def _table(rows: List[List[str]]) -> str:
+    return "<table>" + "".join("<tr>" + "".join(f"<td>{escape(str(cell))}</td>" for cell in row) + "</tr>" for row in rows) + "</table>"
+
+
+def generate_statement(rows: int = 20000, categories: int = 30, start: str = "2020-01-01", seed: int = 0) -> bytes:
+    """
+    Generates a synthetic statement with random costs, a monthly salary and a running balance.
+
+    --------
+    Parameters
+    rows: int default 20000
+        Amount of transactions.
+    categories: int default 30
+        Amount of categories the texts are drawn from, see category_rules.
+    start: str default '2020-01-01'
+        Date of the first transaction. Roughly 15 transactions are generated per day.
+    seed: int default 0
+        Seed of the random generator, so that the same arguments always give the same statement.
+
+    --------
+    Returns
+    bytes
+        The statement file.
+    """
+
+    generator = random.Random(seed)
+    rules = category_rules(categories)
+    dates = pd.date_range(start, periods=max(rows // 15, 1), freq="D").strftime("%Y-%m-%d")
+
+    transactions, balance = [], 50000.0
+    for number in range(rows):
+        date = dates[number * len(dates) // rows]
+
+        if number % 500 == 0:
+            text, amount = "LÖN", round(generator.uniform(25000, 35000), 2)
+        elif generator.random() < UNCATEGORIZED_SHARE:
+            text, amount = f"UNKNOWN STORE {generator.randint(1, 500)}", -round(generator.uniform(10, 2000), 2)
+        else:
+            #The identifying text is part of a longer text, the way the bank writes it.
+            text, amount = f"{generator.choice(rules)[1]} STOCKHOLM", -round(generator.uniform(10, 2000), 2)
+
+        balance += amount
+        transactions.append([date, date, text, format_amount(amount), format_amount(balance)])
+
+    #The first three tables hold account information in the real statements.
+    document = ("<html><head><meta charset=\"utf-8\"></head><body>" + _table([["Kontoutdrag"]]) + _table([["Konto", "123 456 789"]])
+                + _table([["Period", f"{dates[0]} - {dates[-1]}"]]) + _table([COLUMNS] + transactions) + "</body></html>")
+
+    return document.encode("utf-8")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--categories", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+
+    with open(arguments.path, "wb") as file:
+        file.write(generate_statement(rows=arguments.rows, categories=arguments.categories, seed=arguments.seed))
+
+    print(f"Wrote {arguments.rows} transactions to {os.path.abspath(arguments.path)}", file=sys.stderr)
@@ -0,0 +1,204 @@
+"""
+Benchmarks the paths the application relies on against a synthetic statement and stores the results as JSON baselines.
+
+Measured: reading and categorizing a statement, categorization, categories_dict, the bulk insert of an upload,
+get_cash_data and building the analytics frame and every chart in utils.visual.
+Every benchmark is repeated and the median is reported. The query cache is cleared before every repetition,
+so the database is hit every time.
+
+Usage:
+    python benchmarks/suite.py [--rows 20000] [--categories 30] [--repeat 5] [--db-url URL]
+                               [--save NAME] [--compare NAME] [--tolerance 0.2]
+
+Runs against a temporary SQLite database unless --db-url (e.g. a local PostgreSQL database) is given.
+The database must not be used by the application, since the benchmark users are deleted and created again.
+
+--save stores the results as benchmarks/baselines/NAME-<dialect>.json, --compare compares them with such a baseline
+and exits with status 1 if any benchmark is slower than the baseline by more than the tolerance.
+"""
+from typing import Callable, Dict, List
+from datetime import datetime
+import statistics
+import argparse
+import platform
+import tempfile
+import json
+import time
+import sys
+import io
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BASELINE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+#The user the statement is read and categorized for. Every insert repetition uses a new user after it.
+BENCHMARK_USER = 900000
+
+
+def connect(db_url: str) -> None:
+    #The engine is created when database.py is imported, which is why db_url is set before any import of the application.
+    os.environ["db_url"] = db_url
+
+
+def setup(categories: int, repeat: int) -> None:
+    #Creates the benchmark users and the category rules matching the generated statements.
+    from sqlalchemy import text
+    from statements import category_rules
+    import database
+    import migrations
+    import models
+
+    models.Base.metadata.create_all(bind=database.engine)
+    migrations.migrate(db=database.engine)
+
+    users = list(range(BENCHMARK_USER, BENCHMARK_USER + repeat + 1))
+    with database.engine.begin() as db_connection:
+        for table in ("monthly_rollups", "expenditures", "categories", "users"):
+            db_connection.execute(text(f"DELETE FROM {table} WHERE user_id >= :user_id"), {"user_id": BENCHMARK_USER})
+
+        db_connection.execute(models.Users.__table__.insert(),
+                              [{"user_id": user_id, "username": f"benchmark{user_id}", "email": f"benchmark{user_id}@mail.com"}
+                               for user_id in users])
+        db_connection.execute(models.Categories.__table__.insert(),
+                              [{"name": name, "text": identifying_text, "user_id": BENCHMARK_USER}
+                               for name, identifying_text in category_rules(categories)])
+
+
+def measure(function: Callable, repeat: int, before: Callable = None) -> Dict[str, float]:
+    #Runs the function 'repeat' times and returns the median and the fastest time in milliseconds.
+    import query_cache
+
+    times = []
+    for iteration in range(repeat):
+        query_cache.clear()
+        if before is not None:
+            before(iteration)
+
+        started = time.perf_counter()
+        function(iteration)
+        times.append((time.perf_counter() - started) * 1000)
+
+    return {"median_ms": round(statistics.median(times), 3), "min_ms": round(min(times), 3)}
+
+
+def run(rows: int, categories: int, repeat: int) -> Dict[str, Dict[str, float]]:
+    #Runs every benchmark and returns the timings by name.
+    from statements import generate_statement
+    import pandas as pd
+    import database
+    import utils
+    from utils import visual
+    from utils.analytics import build_analytics
+
+    statement = generate_statement(rows=rows, categories=categories)
+    parsed, _ = utils.parse_statement(pd.read_html(io.BytesIO(statement))[3])
+    start_month = datetime(2000, 1, 1)
+
+    results = {}
+
+    results["read_statement"] = measure(lambda _: utils.read_statement(io.BytesIO(statement), user_id=BENCHMARK_USER), repeat)
+    results["categorization"] = measure(lambda _: utils.categorization(parsed, user_id=BENCHMARK_USER), repeat)
+    results["categories_dict"] = measure(lambda _: utils.categories_dict(user_id=BENCHMARK_USER), repeat)
+
+    #Every repetition uploads the statement for a user without any transactions.
+    frame, _ = utils.read_statement(io.BytesIO(statement), user_id=BENCHMARK_USER)
+
+    def insert(iteration: int) -> None:
+        database.bulk_insert_expenditures(frame.assign(user_id=BENCHMARK_USER + 1 + iteration))
+
+    results["bulk_insert_expenditures"] = measure(insert, repeat)
+
+    #The queries and charts run against the last uploaded user.
+    user_id = BENCHMARK_USER + repeat
+
+    results["get_cash_data"] = measure(lambda _: database.get_cash_data(user_id=user_id, start_month=start_month), repeat)
+    results["get_monthly_rollups"] = measure(lambda _: database.get_monthly_rollups(user_id=user_id, start_month=start_month), repeat)
+
+    rollups = database.get_monthly_rollups(user_id=user_id, start_month=start_month)
+    results["build_analytics"] = measure(lambda _: build_analytics(rollups), repeat)
+
+    analytics = build_analytics(rollups)
+    charts = {
+        "bar_plot": lambda _: visual.bar_plot(analytics),
+        "monthly_balance": lambda _: visual.monthly_balance(analytics),
+        "horizontal_barplot": lambda _: visual.horizontal_barplot(analytics, selected_month=analytics.month_labels()[-1]),
+        "line_plot": lambda _: visual.line_plot(analytics, analytics.cost_categories),
+    }
+    for name, chart in charts.items():
+        results[name] = measure(chart, repeat)
+
+    return results
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], tolerance: float) -> List[dict]:
+    #Compares the medians with the baseline. A ratio above 1 + tolerance is a regression, below 1 - tolerance an improvement.
+    comparison = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+
+        ratio = result["median_ms"] / baseline[name]["median_ms"]
+        if ratio > 1 + tolerance:
+            verdict = "slower"
+        elif ratio < 1 - tolerance:
+            verdict = "faster"
+        else:
+            verdict = "unchanged"
+
+        comparison.append({"benchmark": name, "baseline_ms": baseline[name]["median_ms"], "median_ms": result["median_ms"],
+                           "ratio": round(ratio, 2), "verdict": verdict})
+
+    return comparison
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--categories", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--db-url", default=f"sqlite:///{tempfile.mkdtemp()}/benchmark.db")
+    parser.add_argument("--save", metavar="NAME")
+    parser.add_argument("--compare", metavar="NAME")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    arguments = parser.parse_args()
+
+    connect(arguments.db_url)
+    setup(arguments.categories, arguments.repeat)
+    results = run(arguments.rows, arguments.categories, arguments.repeat)
+
+    import pandas as pd
+    import database
+
+    dialect = database.engine.dialect.name
+    print(pd.DataFrame.from_dict(results, orient="index").rename_axis(f"{dialect}, {arguments.rows} rows").to_string())
+
+    if arguments.save:
+        os.makedirs(BASELINE_DIRECTORY, exist_ok=True)
+        path = os.path.join(BASELINE_DIRECTORY, f"{arguments.save}-{dialect}.json")
+
+        with open(path, "w") as file:
+            json.dump({
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "rows": arguments.rows,
+                "categories": arguments.categories,
+                "repeat": arguments.repeat,
+                "results": results,
+            }, file, indent=2)
+
+        print(f"\nSaved the baseline to {path}")
+
+    if arguments.compare:
+        with open(os.path.join(BASELINE_DIRECTORY, f"{arguments.compare}-{dialect}.json")) as file:
+            baseline = json.load(file)
+
+        if (baseline["rows"], baseline["categories"]) != (arguments.rows, arguments.categories):
+            print(f"\nWarning: the baseline was measured with {baseline['rows']} rows and {baseline['categories']} categories")
+
+        comparison = pd.DataFrame(compare(results, baseline["results"], arguments.tolerance))
+        print("\n" + comparison.to_string(index=False))
+
+        if (comparison["verdict"] == "slower").any():
+            sys.exit(1)
@@ -0,0 +1,25 @@
+"""Settings of the application, read from the enviroment or the .env file"""
+from dotenv import load_dotenv
+import os
+
+
+def connect_db(key: str) -> str:
+    """
+    Returns a setting, e.g. the database url, from the enviroment files.
+    Will work on local as well as cloud solutions
+    
+    --------
+    Parameters
+    key: str
+        The key in the key-value pair of the .env file that you want to return the value for
+
+    --------
+    Returns
+    os.getenv(): str
+        Value of the provided key.
+    
+    """
+
+    load_dotenv()
+
+    return os.getenv(key)
@@ -1,64 +1,515 @@
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event, exc, insert, text
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.declarative import declarative_base
-from dotenv import load_dotenv
 from datetime import datetime
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+import threading
+import inspect
+import queue
 import streamlit as st
 import pandas as pd
 import numpy as np
-import os
+import time
+import io
+from config import connect_db
+from query_cache import cached_query, bump_data_version, share_versions
+from instrumentation import instrumented
 
 
-def connect_db(key: str) -> str:
+def get_db():
     """
-    Returns the database url from the enviroment files.
-    Will work on local as well as cloud solutions
-    
+    Helper function for some of the functions calling the database.
+    Connects to the database and creates a session. Closes the session when the call to the database is done
+    """
+
+    try:
+        db = SessionLocal()
+        yield db
+    finally: 
+        db.close()
+
+
+@contextmanager
+def session_scope() -> Iterator[Session]:
+    """
+    Creates a session for one operation against the database.
+    The session is rolled back if the operation fails and always closed, which returns its connection to the pool.
+    Every Streamlit script run and thread gets its own session this way.
+
+    --------
+    Yields
+    sqlalchemy.orm.Session
+        The session for the operation.
+    """
+
+    db = SessionLocal()
+    try:
+        yield db
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def with_session(function: Callable) -> Callable:
+    """
+    Decorator giving a function taking a 'db' session argument its own session for every call,
+    unless a session is passed explicitly.
+
     --------
     Parameters
-    key: str
-        The key in the key-value pair of the .env file that you want to return the value for
+    function: Callable
+        The function to provide a session for.
 
     --------
     Returns
-    os.getenv(): str
-        Value of the provided key.
-    
+    Callable
+        The decorated function.
     """
 
-    load_dotenv()
+    signature = inspect.signature(function)
 
-    return os.getenv(key)
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        #Binds the arguments to the parameters, so a session passed positionally is found as well.
+        arguments = signature.bind(*args, **kwargs)
+        if arguments.arguments.get("db") is not None:
+            return function(*args, **kwargs)
 
-def get_db():
+        with session_scope() as db:
+            arguments.arguments["db"] = db
+            return function(*arguments.args, **arguments.kwargs)
+
+    return wrapper
+
+
+class PoolMetrics:
     """
-    Helper function for some of the functions calling the database.
-    Connects to the database and creates a session. Closes the session when the call to the database is done
+    The checkout metrics of a connection pool, kept when the pool is recreated.
     """
 
-    try:
-        db = SessionLocal()
-        yield db
-    finally: 
-        db.close()
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.max_checked_out = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.timeouts = 0
+
+    def waited(self, seconds: float) -> None:
+        with self.lock:
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def timed_out(self) -> None:
+        with self.lock:
+            self.timeouts += 1
+
+
+class MeteredQueuePool(QueuePool):
+    """
+    QueuePool keeping track of how many connections are checked out and how long callers wait for them.
+    Checkouts are counted by the pool's 'checkout' event, which only fires for connections handed to a caller.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+        event.listen(self, "checkout", self._count_checkout)
+
+    def _count_checkout(self, dbapi_connection, connection_record, connection_proxy) -> None:
+        with self.metrics.lock:
+            self.metrics.checkouts += 1
+            self.metrics.max_checked_out = max(self.metrics.max_checked_out, self.checkedout())
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            self.metrics.timed_out()
+            raise
+
+        self.metrics.waited(time.perf_counter() - started)
+        return connection
+
+    def recreate(self):
+        #The recreated pool takes over the event listeners of this pool, so it keeps counting into the same metrics.
+        pool = super().recreate()
+        event.remove(pool, "checkout", pool._count_checkout)
+        pool.metrics = self.metrics
+        return pool
+
+
+def pool_options(url: str) -> dict:
+    """
+    Returns the connection pool settings for create_engine, read from the enviroment like db_url.
+
+    db_pool_size (default 5): connections kept open.
+    db_max_overflow (default 10): extra connections opened when the pool is exhausted.
+    db_pool_timeout (default 30): seconds to wait for a connection before failing.
+    db_pool_recycle (default 1800): seconds before a connection is replaced, so the server never closes it first.
+    db_pool_pre_ping (default true): tests each connection before it is used.
+
+    --------
+    Parameters
+    url: str
+        The database url.
+
+    --------
+    Returns
+    dict
+        Keyword arguments for sqlalchemy.create_engine
+    """
+
+    options = {
+        "pool_pre_ping": (connect_db("db_pool_pre_ping") or "true").lower() == "true",
+        "pool_recycle": int(connect_db("db_pool_recycle") or 1800),
+    }
+
+    #In-memory SQLite databases live in a single connection and can not be pooled.
+    if url.startswith("sqlite") and (url.endswith(":memory:") or url.rstrip("/") == "sqlite:"):
+        return options
+
+    options.update({
+        "poolclass": MeteredQueuePool,
+        "pool_size": int(connect_db("db_pool_size") or 5),
+        "max_overflow": int(connect_db("db_max_overflow") or 10),
+        "pool_timeout": float(connect_db("db_pool_timeout") or 30),
+    })
+
+    return options
+
+
+def pool_metrics(db = None) -> Dict[str, Union[int, float]]:
+    """
+    Returns the current state of the connection pool, used to size it for the amount of concurrent users.
+
+    --------
+    Parameters
+    db: sqlalchemy.engine default engine
+        The database for the application
+
+    --------
+    Returns
+    dict
+        Containing the pool 'size', the connections currently 'checked_out', the most that were checked out at once
+        ('max_checked_out') and in 'overflow', the total amount of
+        'checkouts', the total and the maximum 'wait_seconds' for a connection and the amount of 'timeouts'.
+    """
+
+    pool = (db or engine).pool
+    if not isinstance(pool, MeteredQueuePool):
+        return {}
+
+    metrics = pool.metrics
+    with metrics.lock:
+        return {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "max_checked_out": metrics.max_checked_out,
+            "overflow": max(pool.overflow(), 0),
+            "checkouts": metrics.checkouts,
+            "wait_seconds": round(metrics.wait_seconds, 6),
+            "max_wait_seconds": round(metrics.max_wait_seconds, 6),
+            "timeouts": metrics.timeouts,
+        }
+
 
 #Retrieves the database url from the enviroment variables.
 DATABASE_URL = connect_db("db_url")
 
-#Connects to the database
-engine = create_engine(url=DATABASE_URL)
+#Connects to the database with a pool sized from the enviroment variables.
+engine = create_engine(url=DATABASE_URL, **pool_options(DATABASE_URL))
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 #Sets up a boilerplate for the ORM to be used.
 Base = declarative_base()
 
+#The columns of the expenditures table that are written when uploading transactions.
+#Transactions from statement files carry a fingerprint, which the database uses to skip transactions it already has.
+EXPENDITURE_COLUMNS = ["Transaktionsdatum", "Text", "Belopp", "Saldo", "Typ", "Kategori", "user_id", "fingerprint"]
+
+#Amount of rows sent per executemany when COPY is not available.
+INSERT_BATCH_SIZE = 5000
+
+#Dialect specific inserts supporting ON CONFLICT DO NOTHING.
+DIALECT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+#<<<----Shared cache versions>>>----
+#The versions of the query cache are counted in the cache_versions table, so a write in any process,
+#e.g. the ingest worker or another replica, invalidates the cached results of every process.
+def _load_cache_versions(user_id: int) -> Dict[str, int]:
+    with engine.connect() as db_connection:
+        row = db_connection.execute(text("SELECT data, categories FROM cache_versions WHERE user_id = :user_id"),
+                                    {"user_id": user_id}).first()
+
+    return {"data": row.data, "categories": row.categories} if row else {"data": 0, "categories": 0}
+
+
+def _bump_cache_version(user_id: int, kind: str) -> int:
+    with engine.begin() as db_connection:
+        return db_connection.execute(text(f'''
+        INSERT INTO cache_versions (user_id, data, categories)
+        VALUES (:user_id, {int(kind == "data")}, {int(kind == "categories")})
+        ON CONFLICT (user_id) DO UPDATE SET {kind} = cache_versions.{kind} + 1
+        RETURNING {kind}
+        '''), {"user_id": user_id}).scalar()
+
+
+share_versions(load=_load_cache_versions, bump=_bump_cache_version)
+
+
+#<<<----Fetch backend>>>----
+#How the read helpers turn query results into DataFrames, set from the enviroment like db_url.
+#'pandas' uses pandas.read_sql. 'arrow' fetches Arrow record batches through ADBC (adbc_driver_postgresql or
+#adbc_driver_sqlite) and returns Arrow backed DataFrames without building a Python object per row.
+#If no ADBC driver is installed for the database, 'arrow' falls back to read_sql and converts the result to Arrow.
+FETCH_BACKEND = connect_db("db_fetch_backend") or "pandas"
+
+#Dialects used to compile the bound statements into the positional SQL that ADBC expects.
+ADBC_DIALECTS = {"postgresql": postgresql.dialect(paramstyle="numeric_dollar"), "sqlite": sqlite.dialect(paramstyle="qmark")}
+
+#Idle ADBC connections per database url, reused by the reads of every thread. None when no driver is installed.
+_adbc_pools: Dict[object, Optional["queue.LifoQueue"]] = {}
+_adbc_lock = threading.Lock()
+
+
+def _adbc_driver(url):
+    #Returns the ADBC driver for the database url, or None if none is installed for it.
+    try:
+        if url.get_backend_name() == "postgresql":
+            import adbc_driver_postgresql.dbapi as adbc
+            return adbc
+        if url.get_backend_name() == "sqlite":
+            import adbc_driver_sqlite.dbapi as adbc
+            return adbc
+    except ImportError:
+        pass
+
+    return None
+
 
+def _adbc_connect(url):
+    #Every statement is autocommitted, so a read never sees an old snapshot or leaves a transaction open.
+    adbc = _adbc_driver(url)
 
+    if url.get_backend_name() == "postgresql":
+        return adbc.connect(url.set(drivername="postgresql").render_as_string(hide_password=False), autocommit=True)
 
-def check_latest_date(user_id: int, db = engine) -> pd.Series:
+    return adbc.connect(url.database or ":memory:", autocommit=True)
+
+
+@contextmanager
+def _adbc_connection(db):
+    #Lends an ADBC connection to the database of the engine, or None if no driver is installed.
+    #Like the engine's pool, at most db_pool_size idle connections are kept and every connection is
+    #closed after db_pool_recycle seconds. These connections are not part of the engine's pool or pool_metrics.
+    url = db.url
+
+    with _adbc_lock:
+        if url not in _adbc_pools:
+            _adbc_pools[url] = queue.LifoQueue(maxsize=int(connect_db("db_pool_size") or 5)) if _adbc_driver(url) else None
+        pool = _adbc_pools[url]
+
+    if pool is None:
+        yield None
+        return
+
+    recycle = int(connect_db("db_pool_recycle") or 1800)
+
+    try:
+        connection, opened = pool.get_nowait()
+    except queue.Empty:
+        connection, opened = _adbc_connect(url), time.monotonic()
+
+    try:
+        yield connection
+    except Exception:
+        #The connection may be broken, so it is not reused.
+        connection.close()
+        raise
+
+    if time.monotonic() - opened > recycle:
+        connection.close()
+        return
+
+    try:
+        pool.put_nowait((connection, opened))
+    except queue.Full:
+        connection.close()
+
+
+def read_frame(query, db_connection, params: Optional[dict] = None, parse_dates: Optional[List[str]] = None) -> pd.DataFrame:
     """
-    Pulls the latest date from the internal database
+    Runs a bound query and returns the result as a DataFrame, using the configured FETCH_BACKEND.
+    Every read helper in this module goes through this function.
+
+    --------
+    Parameters
+    query: sqlalchemy.TextClause
+        The query to run.
+    db_connection: sqlalchemy.engine.Connection
+        Connection to the database, used by the 'pandas' backend and the fallback of the 'arrow' backend.
+    params: dict default None
+        The values of the bound parameters.
+    parse_dates: list of str default None
+        Columns to parse as dates, since SQLite returns dates as strings.
+
+    --------
+    Returns
+    pandas.DataFrame
+        The result of the query. Arrow backed when the backend is 'arrow'.
+    """
+
+    params = params or {}
+
+    if FETCH_BACKEND != "arrow":
+        return pd.read_sql(sql=query, con=db_connection, params=params, parse_dates=parse_dates)
+
+    import pyarrow as pa
+
+    with _adbc_connection(db_connection.engine) as adbc_connection:
+        if adbc_connection is None:
+            table = None
+        else:
+            backend = db_connection.engine.url.get_backend_name()
+            compiled = query.compile(dialect=ADBC_DIALECTS[backend])
+            values = [params[name] for name in compiled.positiontup]
+
+            #SQLite stores dates as text, so dates are bound as text in the same format SQLAlchemy stores them in.
+            if backend == "sqlite":
+                values = [value.isoformat(sep=" ") if isinstance(value, datetime) else value for value in values]
+
+            with adbc_connection.cursor() as cursor:
+                cursor.execute(str(compiled), values)
+                table = cursor.fetch_arrow_table()
+
+    if table is None:
+        table = pa.Table.from_pandas(pd.read_sql(sql=query, con=db_connection, params=params), preserve_index=False)
+    else:
+        #Without rows the driver can not infer the column types, so the empty result is built by read_sql instead.
+        if table.num_rows == 0:
+            table = pa.Table.from_pandas(pd.read_sql(sql=query, con=db_connection, params=params), preserve_index=False)
+
+    df = table.to_pandas(types_mapper=pd.ArrowDtype)
+
+    for column in parse_dates or []:
+        df[column] = pd.to_datetime(df[column])
+
+    return df
+
+
+#<<<----Queries>>>----
+#All queries are built once with bound parameters. The statement text is the same for every user,
+#so it is compiled once by SQLAlchemy and values can never be injected into the SQL.
+#The double quotation marks around the column names forces them to be case sensitive.
+
+DATE_BOUNDS_QUERY = text('''
+    SELECT MIN("Transaktionsdatum") AS earliest, MAX("Transaktionsdatum") AS latest, COUNT(*) AS row_count
+    FROM expenditures
+    WHERE user_id = :user_id
+    ''')
+
+#Columns that can be requested from get_cash_data.
+CASH_DATA_COLUMNS = ["expenditure_id"] + EXPENDITURE_COLUMNS
+
+#Dtypes of the frames returned by get_cash_data, configurable from the enviroment like db_url.
+#db_amount_dtype can be set to float32 to halve the memory of Belopp and Saldo, at the cost of precision above ~100 000 kr.
+#db_text_dtype can be set to 'string[pyarrow]' if the texts are mostly unique. Typ and Kategori are always categoricals.
+AMOUNT_DTYPE = connect_db("db_amount_dtype") or "float64"
+TEXT_DTYPE = connect_db("db_text_dtype") or "category"
+
+
+@lru_cache(maxsize=None)
+def _cash_data_query(columns: Optional[Tuple[str, ...]], by_category: bool):
+    #Builds the query for every projection and filter once. The columns are validated, since they become part of the SQL.
+    if columns is None:
+        selected = "*"
+    else:
+        unknown = set(columns) - set(CASH_DATA_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown expenditure columns: {sorted(unknown)}")
+        selected = ", ".join(f'"{column}"' for column in columns)
+
+    query = f'''
+    SELECT {selected} FROM expenditures
+    WHERE "Transaktionsdatum" >= :start_month AND user_id = :user_id
+    '''
+
+    if by_category:
+        query += 'AND "Kategori" = :category'
+
+    return text(query)
+
+
+CASH_DATA_QUERY = _cash_data_query(None, False)
+
+
+def _compact_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    #The repeated strings are stored once as categoricals and the amounts as the configured dtype.
+    #Every column gets a fixed dtype, so the frame is the same whichever FETCH_BACKEND read it.
+    dtypes = {"Typ": "category", "Kategori": "category", "Text": TEXT_DTYPE,
+              "Belopp": AMOUNT_DTYPE, "Saldo": AMOUNT_DTYPE, "Transaktionsdatum": "datetime64[ns]",
+              "expenditure_id": "int64", "user_id": "int64"}
+
+    #Arrow strings are turned into Python strings first, with None for the missing ones like pandas.read_sql returns them.
+    for column in df.columns:
+        if pd.api.types.is_string_dtype(df[column].dtype) and df[column].dtype != object:
+            df[column] = df[column].astype(object).where(df[column].notna(), None)
+
+    return df.astype({column: dtype for column, dtype in dtypes.items() if column in df.columns})
+
+
+#Counts all occurances for a given text and summarizes the amount
+UNCATEGORIZED_QUERY = text('''
+    SELECT COUNT(user_id) AS "Occurances", SUM("Belopp") AS "Spent", "Text"
+    FROM expenditures
+    WHERE "Kategori" = 'Other' AND user_id = :user_id
+    GROUP BY "Text"
+    ORDER BY "Occurances" DESC
+    ''')
+
+USER_CATEGORIES_QUERY = text('''
+    SELECT name, text FROM categories
+    WHERE user_id = :user_id
+    ORDER BY category_id
+    ''')
+
+MONTHLY_ROLLUPS_QUERY = text('''
+    SELECT month, "Kategori", "Typ", "Belopp", "Occurances", "Saldo", last_date FROM monthly_rollups
+    WHERE user_id = :user_id AND month >= :start_month
+    ORDER BY month
+    ''')
+
+#Sums the transactions of one category per text in the database, so only the summary leaves it.
+CATEGORY_SUMMARY_QUERY = text('''
+    SELECT "Text", SUM("Belopp") AS "Amount", COUNT("Text") AS "Occurance"
+    FROM expenditures
+    WHERE user_id = :user_id AND "Transaktionsdatum" >= :start_month AND "Kategori" = :category AND "Text" IS NOT NULL
+    GROUP BY "Text"
+    ORDER BY "Amount"
+    ''')
+
+FINGERPRINTS_QUERY = text('''
+    SELECT fingerprint FROM expenditures
+    WHERE user_id = :user_id AND "Transaktionsdatum" >= :start AND "Transaktionsdatum" < :end AND fingerprint IS NOT NULL
+    ''')
+
+
+@instrumented
+@cached_query
+def get_date_bounds(user_id: int, db = engine) -> Dict[str, Union[pd.Timestamp, int, None]]:
+    """
+    Pulls the earliest and latest transactional date and the amount of transactions for the given user.
+    Done in one aggregate query, so the cost does not grow with the user's history.
 
     --------
     Parameters
@@ -66,37 +517,56 @@ def check_latest_date(user_id: int, db = engine) -> pd.Series:
         int of the current user within the application
     db: sqlalchemy.engine
         The database for the application
-    
+
     --------
     Returns
-    pandas.Series 
-        Object containing the latest transactional date for the given user
+    dict
+        Containing the 'earliest' and 'latest' date (None if the user has no transactions) and the amount of 'rows'.
     """
 
     #Establishes connection the postgres database.
     db_connection = db.connect()
 
-    #The double quotation marks around the column name forces it to be case sensitive
-    query = f'''
-    SELECT "Transaktionsdatum" from expenditures
-    WHERE user_id = {user_id}
-    ORDER BY "Transaktionsdatum" DESC
-    '''
+    row = db_connection.execute(DATE_BOUNDS_QUERY, {"user_id": user_id}).one()
 
-    #Reads the latest (newest) date from the database
-    df = pd.read_sql(sql=text(query), con=db_connection)
-    
     #Closes the connection with the database.
     db_connection.close()
 
+    #SQLite returns the dates as strings, which is why they are converted.
+    return {
+        "earliest": pd.to_datetime(row.earliest) if row.earliest is not None else None,
+        "latest": pd.to_datetime(row.latest) if row.latest is not None else None,
+        "rows": int(row.row_count),
+    }
+
+
+def check_latest_date(user_id: int, db = engine) -> pd.Timestamp:
+    """
+    Pulls the latest date from the internal database
+
+    --------
+    Parameters
+    user_id: int
+        int of the current user within the application
+    db: sqlalchemy.engine
+        The database for the application
+    
+    --------
+    Returns
+    pandas.Timestamp 
+        The latest transactional date for the given user, 1970-01-01 if there is no entry in the database.
+    """
+
+    latest = get_date_bounds(user_id=user_id, db=db)["latest"]
+
     #Returns 1970-01-01 if there is no entry in the database.
-    if len(df) == 0:
+    if latest is None:
         return pd.to_datetime(0)
 
-    return df["Transaktionsdatum"].iloc[0]
+    return latest
 
 
-def check_earliest_date(user_id: int, db = engine) -> pd.Series:
+def check_earliest_date(user_id: int, db = engine) -> pd.Timestamp:
     """
     Pulls the earliest date from the internal database
     
@@ -109,33 +579,17 @@ def check_earliest_date(user_id: int, db = engine) -> pd.Series:
     
     -------
     Returns
-    pandas.Series
-        Object containing the earliest transactional date for the given user
+    pandas.Timestamp
+        The earliest transactional date for the given user, None if there is no entry in the database.
     """
 
-    #Establishes connection the postgres database.
-    db_connection = db.connect()
-
-    #The double quotation marks around the column name forces it to be case sensitive
-    query = f'''
-    SELECT "Transaktionsdatum" from expenditures
-    WHERE user_id = {user_id}
-    ORDER BY "Transaktionsdatum" ASC
-    '''
-
-    #Reads the earliest (oldest) date from the database
-    df = pd.read_sql(sql=text(query), con=db_connection)
-
-    if len(df) == 0:
-        return None
-    
-    #Closes the connection with the database.
-    db_connection.close()
-
-    return df["Transaktionsdatum"].iloc[0]
+    return get_date_bounds(user_id=user_id, db=db)["earliest"]
 
 
-def get_cash_data(user_id: int, start_month: datetime, db = engine) -> pd.DataFrame:
+@instrumented
+@cached_query
+def get_cash_data(user_id: int, start_month: datetime, db = engine, category: Optional[str] = None,
+                  columns: Optional[List[str]] = None) -> pd.DataFrame:
     """
     Gets all the transactional data for the given user where the date condition is fulfilled.
 
@@ -147,28 +601,37 @@ def get_cash_data(user_id: int, start_month: datetime, db = engine) -> pd.DataFr
         datetime formated as %Y-%m-%d
     db: sqlalchemy.engine
         The database for the application
+    category: str default None
+        Only gets the transactions within this category. None gets all transactions.
+    columns: list of str default None
+        The columns to get. None gets every column.
 
     -------
     Returns
     pandas.DataFrame
         Containing all transactional data for the given user where the date condition is fulfilled.
+        Typ, Kategori and Text are categoricals and the amounts are of the configured AMOUNT_DTYPE.
     """
 
+    #Validates and builds the query before a connection is taken from the pool.
+    query = _cash_data_query(tuple(columns) if columns is not None else None, category is not None)
+
+    params = {"user_id": user_id, "start_month": start_month}
+    if category is not None:
+        params["category"] = category
+
     #Connects to the database
     db_connection = db.connect()
 
-    query = f'''
-    SELECT * FROM expenditures
-    WHERE "Transaktionsdatum" >= '{start_month}' AND user_id = {user_id}
-    '''
-
-    df = pd.read_sql(sql=text(query), con=db_connection)
+    df = read_frame(query, db_connection, params=params)
 
     db_connection.close()
 
-    return df
+    return _compact_dtypes(df)
 
 
+@instrumented
+@cached_query
 def get_uncategorized(user_id: int, db = engine) -> pd.DataFrame:
     """
     Gets all transactions which could not be categorized. Works for users who are using the File Upload functionality.
@@ -189,25 +652,19 @@ def get_uncategorized(user_id: int, db = engine) -> pd.DataFrame:
 
     db_connection = db.connect()
 
-    #Counts all occurances for a given text and summarizes the amount
-    query = f'''
-    SELECT COUNT(user_id) AS "Occurances", SUM("Belopp") AS "Spent", "Text"
-    FROM expenditures
-    WHERE  "Kategori" = 'Other' AND user_id = {user_id}
-    GROUP BY "Text"
-    ORDER BY "Occurances" DESC
-    '''
-
-    df = pd.read_sql(sql=text(query), con=db_connection)
+    df = read_frame(UNCATEGORIZED_QUERY, db_connection, params={"user_id": user_id})
 
     db_connection.close()
 
     return df
 
 
+@instrumented
+@cached_query(version="categories")
 def get_user_categories(user_id: int, db = engine, usage: str = "cost_categorization") -> pd.DataFrame:
     """
     Retrieves all categories and the corresponding identifying text that a user has.
+    Cached on the user's category version, so uploads do not invalidate it.
     
     ---------
     Parameters
@@ -230,12 +687,7 @@ def get_user_categories(user_id: int, db = engine, usage: str = "cost_categoriza
 
     db_connection = db.connect()
 
-    query = f'''
-    SELECT name, text FROM categories
-    WHERE user_id = {user_id}
-    '''
-
-    df = pd.read_sql(sql=text(query), con=db_connection)
+    df = read_frame(USER_CATEGORIES_QUERY, db_connection, params={"user_id": user_id})
 
     db_connection.close()
 
@@ -249,3 +701,269 @@ def get_user_categories(user_id: int, db = engine, usage: str = "cost_categoriza
         df = df.replace("", np.nan).dropna(subset=["text"])
         return df
 
+
+@instrumented
+def get_fingerprints(user_id: int, start: datetime, end: datetime, db = engine) -> set:
+    """
+    Pulls the fingerprints of the user's transactions within a date range, to tell which transactions
+    of a statement are already in the database before it is uploaded. Not cached, since it must see the latest uploads.
+
+    --------
+    Parameters
+    user_id: int
+        int of the current user within the application
+    start: datetime
+        The first date of the range.
+    end: datetime
+        The date after the last date of the range.
+    db: sqlalchemy.engine
+        The database for the application
+
+    --------
+    Returns
+    set
+        Containing the fingerprints of the transactions in the range.
+    """
+
+    with db.connect() as db_connection:
+        return set(db_connection.execute(FINGERPRINTS_QUERY, {"user_id": user_id, "start": start, "end": end}).scalars())
+
+
+@instrumented
+def bulk_insert_expenditures(df: pd.DataFrame, db = engine, batch_size: int = INSERT_BATCH_SIZE) -> Dict[str, Union[int, float, str]]:
+    """
+    Inserts transactions into the expenditures table in bulk.
+    Uses COPY FROM STDIN when the database is PostgreSQL and batched executemany for every other dialect.
+    Transactions with a fingerprint the user already has are skipped by the database (ON CONFLICT DO NOTHING),
+    so overlapping statements can be uploaded again safely.
+
+    --------
+    Parameters
+    df: pandas.DataFrame
+        Containing the transactions to insert. Columns not in the expenditures table are ignored
+        and missing columns are inserted as NULL.
+    db: sqlalchemy.engine
+        The database for the application
+    batch_size: int default 5000
+        Amount of rows per executemany call for dialects without COPY.
+
+    --------
+    Returns
+    dict
+        Containing the amount of inserted 'rows', the amount of 'skipped' rows that already existed,
+        the time it took in 'seconds' and the 'method' used.
+    """
+
+    started = time.perf_counter()
+
+    columns = [column for column in EXPENDITURE_COLUMNS if column in df.columns]
+    df = df[columns]
+
+    if len(df) == 0:
+        return {"rows": 0, "skipped": 0, "seconds": 0.0, "method": "none"}
+
+    #COPY is reached through the cursor of psycopg2, which is the driver the application is deployed with.
+    if db.dialect.name == "postgresql" and db.dialect.driver == "psycopg2":
+        method = "copy"
+
+        #Writes the rows as CSV in memory. NULL is written as \N so that empty texts stay empty strings.
+        buffer = io.StringIO()
+        df.to_csv(buffer, index=False, header=False, na_rep="\\N")
+        buffer.seek(0)
+
+        quoted_columns = ", ".join(f'"{column}"' for column in columns)
+
+        #COPY can not skip conflicting rows, so the rows are copied into a staging table first.
+        raw_connection = db.raw_connection()
+        try:
+            with raw_connection.cursor() as cursor:
+                cursor.execute(f"CREATE TEMP TABLE expenditures_staging ON COMMIT DROP AS "
+                               f"SELECT {quoted_columns} FROM expenditures WITH NO DATA")
+                cursor.copy_expert(
+                    f"COPY expenditures_staging ({quoted_columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer)
+                cursor.execute(f"INSERT INTO expenditures ({quoted_columns}) SELECT {quoted_columns} "
+                               f"FROM expenditures_staging ON CONFLICT DO NOTHING")
+                inserted = cursor.rowcount
+            raw_connection.commit()
+        finally:
+            raw_connection.close()
+
+    else:
+        method = "executemany"
+
+        #The table of models.py gives typed binds for the dates. models.py imports this module, so it is imported here.
+        import models
+        table = models.Expenditures.__table__
+        if db.dialect.name in ("postgresql", "sqlite"):
+            query = DIALECT_INSERTS[db.dialect.name](table).on_conflict_do_nothing()
+        else:
+            query = insert(table)
+
+        #NaN and NaT are not understood by the database drivers, so they are sent as NULL.
+        records = df.astype(object).where(df.notna(), None).to_dict(orient="records")
+
+        inserted = 0
+        with db.begin() as db_connection:
+            for start in range(0, len(records), batch_size):
+                inserted += db_connection.execute(query, records[start:start + batch_size]).rowcount
+
+    #Keeps the monthly rollups of the affected users and months up to date, which also invalidates their cached queries.
+    dates = pd.to_datetime(df["Transaktionsdatum"])
+    for user_id, user_dates in dates.groupby(df["user_id"]):
+        start, end = _month_range(user_dates.min(), user_dates.max())
+        refresh_monthly_rollups(user_id=int(user_id), start=start, end=end, db=db)
+
+    return {"rows": inserted, "skipped": len(df) - inserted, "seconds": time.perf_counter() - started, "method": method}
+
+
+def _month_start(dialect: str, column: str = '"Transaktionsdatum"') -> str:
+    #Truncates a date column to the first day of its month in the given SQL dialect.
+    if dialect == "postgresql":
+        return f"date_trunc('month', {column})"
+
+    return f"strftime('%Y-%m-01 00:00:00', {column})"
+
+
+def _month_range(first: datetime, last: datetime) -> tuple:
+    #Returns the first day of the month of 'first' and the first day of the month after 'last'.
+    start = pd.Timestamp(first).to_period("M").to_timestamp()
+    end = (pd.Timestamp(last).to_period("M") + 1).to_timestamp()
+
+    return start.to_pydatetime(), end.to_pydatetime()
+
+
+@lru_cache(maxsize=None)
+def _rollup_queries(dialect: str, by_user: bool, by_start: bool, by_end: bool) -> tuple:
+    #Builds the statements refreshing the monthly rollups once for every dialect and combination of filters.
+    month = _month_start(dialect)
+
+    #Builds the same filter for the rollups and for the expenditures they are computed from.
+    rollup_filter, expenditure_filter = ["1 = 1"], ["1 = 1"]
+    if by_user:
+        rollup_filter.append("user_id = :user_id")
+        expenditure_filter.append("user_id = :user_id")
+    if by_start:
+        rollup_filter.append("month >= :start")
+        expenditure_filter.append('"Transaktionsdatum" >= :start')
+    if by_end:
+        rollup_filter.append("month < :end")
+        expenditure_filter.append('"Transaktionsdatum" < :end')
+
+    delete_query = f'''
+    DELETE FROM monthly_rollups
+    WHERE {" AND ".join(rollup_filter)}
+    '''
+
+    #The balance of a group is the balance of its latest transaction, skipping transactions without a balance.
+    #last_date is the date of that same transaction, since the balances of the months are ordered by it.
+    insert_query = f'''
+    INSERT INTO monthly_rollups (user_id, month, "Kategori", "Typ", "Belopp", "Occurances", "Saldo", last_date)
+    SELECT user_id, month, "Kategori", "Typ", SUM("Belopp"), COUNT(*),
+        MAX(CASE WHEN position = 1 THEN "Saldo" END), MAX(CASE WHEN position = 1 THEN "Transaktionsdatum" END)
+    FROM (
+        SELECT user_id, {month} AS month, COALESCE("Kategori", '') AS "Kategori", COALESCE("Typ", '') AS "Typ",
+            "Belopp", "Saldo", "Transaktionsdatum",
+            ROW_NUMBER() OVER (
+                PARTITION BY user_id, {month}, COALESCE("Kategori", ''), COALESCE("Typ", '')
+                ORDER BY CASE WHEN "Saldo" IS NULL THEN 1 ELSE 0 END, "Transaktionsdatum" DESC, expenditure_id DESC
+            ) AS position
+        FROM expenditures
+        WHERE {" AND ".join(expenditure_filter)}
+    ) AS transactions
+    GROUP BY user_id, month, "Kategori", "Typ"
+    '''
+
+    return text(delete_query), text(insert_query)
+
+
+@instrumented
+def refresh_monthly_rollups(user_id: Optional[int] = None, start: Optional[datetime] = None, end: Optional[datetime] = None, db = engine) -> None:
+    """
+    Recomputes the monthly rollups from the expenditures table.
+    Only the rollups of the given user and months are replaced, so a write only costs as much as the months it touched.
+
+    --------
+    Parameters
+    user_id: int default None
+        The user to refresh the rollups for. None refreshes every user.
+    start: datetime default None
+        First day of the first month to refresh. None refreshes from the earliest month.
+    end: datetime default None
+        First day of the month after the last month to refresh. None refreshes up to the latest month.
+    db: sqlalchemy.engine
+        The database for the application
+    """
+
+    params = {"user_id": user_id, "start": start, "end": end}
+    delete_query, insert_query = _rollup_queries(db.dialect.name, user_id is not None, start is not None, end is not None)
+
+    #Both statements run in one transaction so the dashboard never reads half refreshed rollups.
+    with db.begin() as db_connection:
+        db_connection.execute(delete_query, params)
+        db_connection.execute(insert_query, params)
+
+    bump_data_version(user_id)
+
+
+@instrumented
+@cached_query
+def get_monthly_rollups(user_id: int, start_month: datetime, db = engine) -> pd.DataFrame:
+    """
+    Gets the monthly sums per category and type for the given user from the given month and onwards.
+
+    --------
+    Parameters
+    user_id: int
+        int of the current user within the application
+    start_month: datetime
+        datetime formated as %Y-%m-%d
+    db: sqlalchemy.engine
+        The database for the application
+
+    --------
+    Returns
+    pandas.DataFrame
+        Containing month, Kategori, Typ, Belopp (sum), Occurances, Saldo (last balance) and last_date (date of the last balance).
+        Kategori is an empty string for transactions without a category.
+    """
+
+    db_connection = db.connect()
+
+    df = read_frame(MONTHLY_ROLLUPS_QUERY, db_connection, params={"user_id": user_id, "start_month": start_month},
+                    parse_dates=["month", "last_date"])
+
+    db_connection.close()
+
+    return df
+
+
+@instrumented
+@cached_query
+def get_category_summary(user_id: int, start_month: datetime, category: str, db = engine) -> pd.DataFrame:
+    """
+    Gets the summed amount and the amount of transactions per text within one category, grouped in the database.
+
+    --------
+    Parameters
+    user_id: int
+        int of the current user within the application
+    start_month: datetime
+        datetime formated as %Y-%m-%d
+    category: str
+        The category to summarize.
+    db: sqlalchemy.engine
+        The database for the application
+
+    --------
+    Returns
+    pandas.DataFrame
+        Indexed by Text and containing Amount and Occurance, sorted by Amount.
+    """
+
+    db_connection = db.connect()
+
+    df = read_frame(CATEGORY_SUMMARY_QUERY, db_connection, params={"user_id": user_id, "start_month": start_month, "category": category})
+
+    db_connection.close()
+
+    return df.set_index("Text")
@@ -0,0 +1,469 @@
+"""Background ingest of statement files, so that uploads never block the Streamlit script thread"""
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+from sqlalchemy import bindparam, text
+import multiprocessing
+import pandas as pd
+import threading
+import logging
+import io
+import os
+from database import engine, connect_db, bulk_insert_expenditures, get_fingerprints
+from query_cache import clear
+from instrumentation import instrumented
+import migrations
+import models
+
+
+#Amount of statement files parsed at the same time, each in its own process.
+INGEST_WORKERS = int(connect_db("ingest_workers") or os.cpu_count() or 1)
+
+#Seconds between the checks for new jobs in the queue.
+POLL_SECONDS = float(connect_db("ingest_poll_seconds") or 1)
+
+#A running batch without a heartbeat for longer than this is assumed to belong to a worker that died, and is run again.
+STALE_SECONDS = float(connect_db("ingest_stale_seconds") or 900)
+
+#Seconds between the heartbeats of the jobs a worker is running, sent until their batch is stored.
+HEARTBEAT_SECONDS = STALE_SECONDS / 3
+
+#Whether the web process runs the worker itself. Set ingest_inline_worker=false when 'python ingest.py' runs separately.
+INLINE_WORKER = (connect_db("ingest_inline_worker") or "true").lower() == "true"
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+logger = logging.getLogger(__name__)
+
+#The columns reported by get_jobs. The file itself is never read back by the page.
+JOB_COLUMNS = ["job_id", "batch_id", "filename", "status", "progress", "parsed", "categorized", "duplicates", "rows", "skipped",
+               "rejected", "error", "created_at", "finished_at"]
+
+
+def submit_batch(files: List[Tuple[str, bytes]], user_id: int, db = engine) -> List[int]:
+    """
+    Puts statement files uploaded together in the ingest queue as one batch, and makes sure a worker is running
+    in this process, if it should. The files of a batch are parsed in parallel and inserted together.
+
+    --------
+    Parameters
+    files: list of tuple
+        Containing the (filename, content) of every file, e.g. from streamlit.file_uploader(...).getvalue()
+    user_id: int
+        The id of the user the transactions belong to.
+    db: sqlalchemy.engine
+        The database for the application
+
+    --------
+    Returns
+    list of int
+        The ids of the jobs, one per file, in the order of the files.
+    """
+
+    table = models.IngestJobs.__table__
+    job_ids: List[int] = []
+
+    #The jobs are queued in one transaction, so a worker never claims part of a batch.
+    with db.begin() as db_connection:
+        for filename, content in files:
+            job_ids.append(db_connection.execute(table.insert().values(
+                user_id=user_id, batch_id=job_ids[0] if job_ids else None, filename=filename, content=content,
+                status=QUEUED, progress=0.0, created_at=datetime.now())).inserted_primary_key[0])
+
+        #The batch is identified by its first job.
+        if job_ids:
+            db_connection.execute(table.update().where(table.c.job_id == job_ids[0]).values(batch_id=job_ids[0]))
+
+    if INLINE_WORKER:
+        start_worker()
+
+    return job_ids
+
+
+def _update_job(job_id: int, db, **values) -> None:
+    #Every update is also a heartbeat, which tells other workers that the job is still being worked on.
+    with db.begin() as db_connection:
+        db_connection.execute(models.IngestJobs.__table__.update().where(models.IngestJobs.job_id == job_id)
+                              .values(heartbeat_at=datetime.now(), **values))
+
+
+def _heartbeat(job_ids: List[int], db) -> None:
+    query = text("UPDATE ingest_jobs SET heartbeat_at = :now WHERE status = :running AND job_id IN :job_ids")
+
+    with db.begin() as db_connection:
+        db_connection.execute(query.bindparams(bindparam("job_ids", expanding=True)),
+                              {"now": datetime.now(), "running": RUNNING, "job_ids": job_ids})
+
+
+@contextmanager
+def _heartbeats(job_ids: List[int], db) -> Iterator[None]:
+    #Sends the heartbeats of the running jobs of a batch from a thread of its own until the batch is stored,
+    #so files waiting for a free process and slow merges or inserts do not look like a worker that died.
+    stopped = threading.Event()
+
+    def send() -> None:
+        while not stopped.wait(HEARTBEAT_SECONDS):
+            try:
+                _heartbeat(job_ids, db)
+            except Exception:
+                logger.exception("Could not send the heartbeat of ingest batch %s", job_ids)
+
+    thread = threading.Thread(target=send, daemon=True, name="ingest-heartbeat")
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def claim_batch(db = engine) -> List[int]:
+    """
+    Takes the oldest queued batch, or a batch whose worker stopped sending heartbeats, and marks its jobs as running.
+    Several workers can claim batches from the same queue, since a job is only claimed by the worker whose update changed it.
+
+    --------
+    Parameters
+    db: sqlalchemy.engine
+        The database for the application
+
+    --------
+    Returns
+    list of int
+        The ids of the claimed jobs, empty if there is nothing to do.
+    """
+
+    params = {"queued": QUEUED, "running": RUNNING, "stale": datetime.now() - timedelta(seconds=STALE_SECONDS)}
+
+    #A running job is only taken over when no job of its batch has a recent heartbeat, since the worker sends the
+    #heartbeats of the whole batch until it is stored. Jobs queued before batches existed are batches of their own.
+    claimable = '''(status = :queued OR (status = :running AND NOT EXISTS (
+        SELECT 1 FROM ingest_jobs recent
+        WHERE COALESCE(recent.batch_id, recent.job_id) = COALESCE(ingest_jobs.batch_id, ingest_jobs.job_id)
+            AND COALESCE(recent.heartbeat_at, recent.started_at) >= :stale)))'''
+
+    while True:
+        with db.begin() as db_connection:
+            job = db_connection.execute(text(f'''
+            SELECT job_id, batch_id FROM ingest_jobs
+            WHERE job_id = (SELECT MIN(job_id) FROM ingest_jobs WHERE {claimable})
+            '''), params).first()
+
+            if job is None:
+                return []
+
+            claimed = db_connection.execute(text(f'''
+            UPDATE ingest_jobs SET status = :running, started_at = :now, heartbeat_at = :now, progress = 0
+            WHERE (job_id = :job_id OR batch_id = :batch_id) AND {claimable}
+            RETURNING job_id
+            '''), {**params, "job_id": job.job_id, "batch_id": job.batch_id, "now": datetime.now()}).scalars().all()
+
+        #Another worker claimed the batch in between, so the next one is tried.
+        if claimed:
+            return sorted(claimed)
+
+
+def parse_job(job_id: int, db = None) -> Tuple[int, pd.DataFrame]:
+    """
+    Parses and categorizes the statement of a claimed job, reporting the progress in the job.
+    Runs in a worker process, which is why the application is imported here and not in the web process.
+
+    --------
+    Parameters
+    job_id: int
+        The id of a job claimed by claim_batch.
+    db: sqlalchemy.engine default engine
+        The database for the application
+
+    --------
+    Returns
+    tuple
+        Containing the id of the user and the categorized transactions with their fingerprints.
+    """
+
+    import utils
+
+    db = db or engine
+
+    #The versions are bumped in the web process, so the worker process reads the user's categories again for every file.
+    #The other cached results of the process are kept.
+    clear("categories")
+
+    with db.connect() as db_connection:
+        job = db_connection.execute(text("SELECT user_id, content FROM ingest_jobs WHERE job_id = :job_id"),
+                                    {"job_id": job_id}).one()
+
+    file = io.BytesIO(job.content)
+
+    #Reading the file is most of the work, so the progress follows how much of the file has been read.
+    def progress(rows: int) -> None:
+        _update_job(job_id, db, progress=round(0.9 * file.tell() / max(len(job.content), 1), 3), rows=rows)
+
+    df, rejected = utils.read_statement(file, user_id=job.user_id, progress=progress)
+    df["user_id"] = job.user_id
+
+    _update_job(job_id, db, progress=0.9, parsed=len(df), rejected=len(rejected),
+                categorized=int(((df["Typ"] == "Kostnad") & (df["Kategori"] != "Other")).sum()))
+
+    return job.user_id, df
+
+
+def merge_statements(frames: Dict[int, pd.DataFrame], user_id: int, db = engine) -> Tuple[pd.DataFrame, Dict[int, Dict[str, int]]]:
+    """
+    Merges the parsed statements of a batch into the transactions to insert.
+    Statements covering overlapping dates contain the same transactions with the same fingerprints.
+    Such a transaction is kept in the first statement of the batch and counted as a duplicate in the others,
+    and transactions the user already has are counted as skipped.
+
+    --------
+    Parameters
+    frames: dict
+        Containing the parsed transactions of every job, by job_id in the order of the batch.
+    user_id: int
+        The id of the user the transactions belong to.
+    db: sqlalchemy.engine
+        The database for the application
+
+    --------
+    Returns
+    frame: pandas.DataFrame
+        Containing the transactions of the batch that are not in the database yet.
+    summary: dict
+        Containing the amount of new 'rows', 'duplicates' and 'skipped' transactions of every job.
+    """
+
+    merged = pd.concat(frames.values(), keys=list(frames), names=["job_id", None]).reset_index(level="job_id")
+
+    existing = set()
+    if len(merged) != 0:
+        dates = pd.to_datetime(merged["Transaktionsdatum"])
+        existing = get_fingerprints(user_id=user_id, start=dates.min().normalize().to_pydatetime(),
+                                    end=(dates.max().normalize() + timedelta(days=1)).to_pydatetime(), db=db)
+
+    duplicates = merged["fingerprint"].duplicated()
+    skipped = ~duplicates & merged["fingerprint"].isin(existing)
+    new = ~duplicates & ~skipped
+
+    counts = pd.DataFrame({"rows": new, "duplicates": duplicates, "skipped": skipped}).groupby(merged["job_id"]).sum()
+    summary = {job_id: {column: int(counts.at[job_id, column]) if job_id in counts.index else 0 for column in counts.columns}
+               for job_id in frames}
+
+    return merged.loc[new].drop(columns="job_id").reset_index(drop=True), summary
+
+
+@instrumented
+def run_batch(job_ids: List[int], pool: Executor, db = engine) -> Dict[str, Union[int, str, List[int]]]:
+    """
+    Parses the files of a claimed batch in parallel in the pool, merges them and inserts the new transactions
+    in one bulk transaction. A file that can not be parsed fails on its own, the other files are still inserted.
+
+    --------
+    Parameters
+    job_ids: list of int
+        The ids of the jobs claimed by claim_batch.
+    pool: concurrent.futures.Executor
+        The pool of processes parsing the files.
+    db: sqlalchemy.engine
+        The database for the application
+
+    --------
+    Returns
+    dict
+        Containing the 'job_ids', the 'user_id' and the 'status' the batch ended with, done if any file was inserted.
+    """
+
+    with _heartbeats(job_ids, db):
+        return _run_batch(job_ids, pool, db)
+
+
+def _run_batch(job_ids: List[int], pool: Executor, db) -> Dict[str, Union[int, str, List[int]]]:
+    futures = {job_id: pool.submit(parse_job, job_id) for job_id in job_ids}
+    wait(futures.values())
+
+    #A failed job is never run again, the user uploads the file again instead, so its file is dropped as well.
+    frames, user_id = {}, None
+    for job_id, future in futures.items():
+        try:
+            user_id, frames[job_id] = future.result()
+        except Exception as error:
+            _update_job(job_id, db, status=FAILED, error=f"{type(error).__name__}: {error}", content=None, finished_at=datetime.now())
+
+    if not frames:
+        return {"job_ids": job_ids, "user_id": user_id, "status": FAILED}
+
+    try:
+        df, summary = merge_statements(frames, user_id=user_id, db=db)
+        bulk_insert_expenditures(df, db=db)
+
+    except Exception as error:
+        for job_id in frames:
+            _update_job(job_id, db, status=FAILED, error=f"{type(error).__name__}: {error}", content=None, finished_at=datetime.now())
+
+        return {"job_ids": job_ids, "user_id": user_id, "status": FAILED}
+
+    #The files are dropped once their transactions are stored.
+    for job_id, counts in summary.items():
+        _update_job(job_id, db, status=DONE, progress=1.0, content=None, finished_at=datetime.now(), **counts)
+
+    return {"job_ids": job_ids, "user_id": user_id, "status": DONE}
+
+
+def get_jobs(user_id: int, db = engine, limit: int = 10) -> pd.DataFrame:
+    """
+    Gets the latest ingest jobs of the user, used by the page to poll their status.
+
+    --------
+    Parameters
+    user_id: int
+        int of the current user within the application
+    db: sqlalchemy.engine
+        The database for the application
+    limit: int default 10
+        Maximum amount of jobs to return.
+
+    --------
+    Returns
+    pandas.DataFrame
+        Containing the JOB_COLUMNS of the latest jobs, newest first.
+    """
+
+    query = text(f'''
+    SELECT {", ".join(JOB_COLUMNS)} FROM ingest_jobs
+    WHERE user_id = :user_id
+    ORDER BY job_id DESC
+    LIMIT :limit
+    ''')
+
+    with db.connect() as db_connection:
+        return pd.read_sql(sql=query, con=db_connection, params={"user_id": user_id, "limit": limit})
+
+
+class Worker:
+    """
+    Claims batches from the queue and parses their files in a pool of processes, so the parsing never uses the CPU of the web process.
+    A dispatcher thread polls the queue and keeps at most 'workers' files parsing, and every batch is merged
+    and inserted by its own thread once its files are parsed.
+
+    --------
+    Parameters
+    workers: int default INGEST_WORKERS
+        Amount of files parsed at the same time.
+    db: sqlalchemy.engine
+        The database for the application
+    """
+
+    def __init__(self, workers: int = INGEST_WORKERS, db = engine) -> None:
+        self.workers = workers
+        self.db = db
+
+        #Processes are spawned instead of forked, so they do not inherit the threads and connections of the web server.
+        self._pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        self._batches = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest-batch")
+        self._running: Dict[Future, List[int]] = {}
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _finished(self, future: Future) -> None:
+        job_ids = self._running.pop(future, None)
+
+        #An error the batch could not record in its job rows, e.g. when the database went away.
+        #The cached queries of every process are invalidated by bulk_insert_expenditures when the transactions are stored.
+        if future.exception() is not None:
+            logger.error("Ingest batch %s failed", job_ids, exc_info=future.exception())
+
+    def poll(self) -> int:
+        """
+        Starts queued batches while there are idle workers. A batch is started as a whole, even if it has more files than idle workers.
+
+        --------
+        Returns
+        int
+            The amount of jobs started.
+        """
+
+        started = 0
+        while sum(len(job_ids) for job_ids in list(self._running.values())) < self.workers:
+            job_ids = claim_batch(db=self.db)
+            if not job_ids:
+                break
+
+            future = self._batches.submit(run_batch, job_ids, self._pool, self.db)
+            self._running[future] = job_ids
+            future.add_done_callback(self._finished)
+            started += len(job_ids)
+
+        return started
+
+    def run_forever(self) -> None:
+        """
+        Polls the queue until the worker is stopped.
+        """
+
+        while not self._stopped.is_set():
+            try:
+                self.poll()
+            except Exception:
+                #A database hiccup must not stop the worker for the lifetime of the process.
+                logger.exception("Ingest worker could not poll the queue")
+
+            self._stopped.wait(POLL_SECONDS)
+
+    def start(self) -> "Worker":
+        """
+        Runs the worker in a background thread.
+        """
+
+        self._thread = threading.Thread(target=self.run_forever, daemon=True, name="ingest-worker")
+        self._thread.start()
+
+        return self
+
+    def stop(self) -> None:
+        """
+        Stops polling the queue and waits for the running jobs to finish.
+        """
+
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._batches.shutdown(wait=True)
+        self._pool.shutdown(wait=True)
+
+
+_worker: Optional[Worker] = None
+_worker_lock = threading.Lock()
+
+
+def start_worker() -> Worker:
+    """
+    Starts the worker of this process in the background. Only the first call starts it.
+
+    --------
+    Returns
+    Worker
+        The worker of the process.
+    """
+
+    global _worker
+
+    with _worker_lock:
+        if _worker is None:
+            _worker = Worker().start()
+
+    return _worker
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    #A worker can be the first process to use a new database.
+    migrations.initialize()
+
+    logger.info("Ingest worker running with %s process(es), polling every %s s", INGEST_WORKERS, POLL_SECONDS)
+
+    worker = Worker()
+    try:
+        worker.run_forever()
+    except KeyboardInterrupt:
+        worker.stop()
@@ -0,0 +1,304 @@
+"""Timing of the hot paths: database queries, categorization and chart creation. Does nothing unless enabled"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+from collections import deque
+import pandas as pd
+import functools
+import threading
+import bisect
+import time
+import os
+from config import connect_db
+
+
+#Set instrumentation=true in the enviroment (or .env) to record timings. When disabled the decorated functions are
+#returned unchanged, so the instrumentation costs nothing. It can not be turned on without restarting the process.
+ENABLED = (connect_db("instrumentation") or "false").lower() == "true"
+
+#Calls slower than this are counted per user, to find the users with slow pages.
+SLOW_MS = float(connect_db("instrumentation_slow_ms") or 500)
+
+#The aggregated histograms are written to this file in the Prometheus text format after every rerun, if set.
+METRICS_FILE = connect_db("metrics_file")
+
+#The aggregated histograms are served on this port at /metrics, if set.
+METRICS_PORT = connect_db("metrics_port")
+
+#Maximum amount of calls kept for the current rerun, for pages that stop before the timing panel is shown.
+MAX_CALLS = 1000
+
+#Upper bounds in seconds of the histogram buckets.
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+
+#The calls of the current rerun. Streamlit runs every session's script in its own thread.
+_local = threading.local()
+
+#Per function: the count per bucket (the last bucket is +Inf), the total seconds, the total rows and the total bytes.
+_histograms: Dict[str, dict] = {}
+
+#Amount of slow calls per (function, user_id).
+_slow_calls: Dict[Tuple[str, Any], int] = {}
+
+
+def _size(result: Any) -> Tuple[Optional[int], Optional[int]]:
+    #Returns the rows and the bytes of a result. Only frames have a size in bytes, estimated without inspecting the strings.
+    if isinstance(result, tuple) and result and isinstance(result[0], pd.DataFrame):
+        result = result[0]
+    if isinstance(result, (pd.DataFrame, pd.Series)):
+        return len(result), int(result.memory_usage(index=True, deep=False).sum())
+    if isinstance(result, dict) and isinstance(result.get("rows"), int):
+        return result["rows"], None
+    if hasattr(result, "data") and hasattr(result, "layout"):
+        #Plotly figures are sized by the amount of points in their traces.
+        return sum(len(trace.x) for trace in result.data if getattr(trace, "x", None) is not None), None
+
+    return None, None
+
+
+def record(name: str, seconds: float, rows: Optional[int] = None, size: Optional[int] = None, user_id: Any = None) -> None:
+    """
+    Records one call in the current rerun and in the aggregated histograms.
+
+    --------
+    Parameters
+    name: str
+        The name of the measured function or block.
+    seconds: float
+        The duration of the call.
+    rows: int default None
+        The amount of rows returned or written, if known.
+    size: int default None
+        The size in bytes of the result, if known.
+    user_id: int default None
+        The user the call was made for, if known.
+    """
+
+    calls = getattr(_local, "calls", None)
+    if calls is None:
+        calls = _local.calls = deque(maxlen=MAX_CALLS)
+    calls.append({"name": name, "ms": round(seconds * 1000, 3), "rows": rows, "bytes": size, "user_id": user_id})
+
+    with _lock:
+        histogram = _histograms.setdefault(name, {"buckets": [0] * (len(BUCKETS) + 1), "seconds": 0.0, "rows": 0, "bytes": 0})
+        histogram["buckets"][bisect.bisect_left(BUCKETS, seconds)] += 1
+        histogram["seconds"] += seconds
+        histogram["rows"] += rows or 0
+        histogram["bytes"] += size or 0
+
+        if seconds * 1000 >= SLOW_MS:
+            _slow_calls[(name, user_id)] = _slow_calls.get((name, user_id), 0) + 1
+
+
+def instrumented(function: Callable) -> Callable:
+    """
+    Decorator recording the duration, the rows and the bytes of every call of the function.
+    Returns the function unchanged when the instrumentation is disabled.
+
+    --------
+    Parameters
+    function: Callable
+        The function to measure.
+
+    --------
+    Returns
+    Callable
+        The measured function.
+    """
+
+    if not ENABLED:
+        return function
+
+    name = f"{function.__module__}.{function.__name__}"
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        result = function(*args, **kwargs)
+        seconds = time.perf_counter() - started
+
+        rows, size = _size(result)
+        record(name, seconds, rows=rows, size=size, user_id=kwargs.get("user_id"))
+
+        return result
+
+    return wrapper
+
+
+@contextmanager
+def measure(name: str, user_id: Any = None) -> Iterator[None]:
+    """
+    Context manager recording the duration of the block, for code that is not a single function call.
+
+    --------
+    Parameters
+    name: str
+        The name of the measured block.
+    user_id: int default None
+        The user the block runs for, if known.
+    """
+
+    if not ENABLED:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started, user_id=user_id)
+
+
+def rerun_calls(clear: bool = True) -> pd.DataFrame:
+    """
+    Returns the calls recorded in the current rerun, in the order they were made.
+
+    --------
+    Parameters
+    clear: bool default True
+        Starts a new rerun after returning the calls.
+
+    --------
+    Returns
+    pandas.DataFrame
+        Containing the name, the duration in ms, the rows, the bytes and the user_id of every call.
+    """
+
+    calls = list(getattr(_local, "calls", None) or [])
+    if clear:
+        _local.calls = deque(maxlen=MAX_CALLS)
+
+    return pd.DataFrame(calls, columns=["name", "ms", "rows", "bytes", "user_id"])
+
+
+def prometheus_text() -> str:
+    """
+    Returns the aggregated histograms and the slow calls in the Prometheus text format.
+
+    --------
+    Returns
+    str
+        The metrics of every measured function since the process started.
+    """
+
+    lines = [
+        "# HELP expenditure_call_seconds Duration of the measured functions.",
+        "# TYPE expenditure_call_seconds histogram",
+    ]
+
+    with _lock:
+        histograms = {name: dict(histogram, buckets=list(histogram["buckets"])) for name, histogram in _histograms.items()}
+        slow_calls = dict(_slow_calls)
+
+    for name, histogram in sorted(histograms.items()):
+        cumulative = 0
+        for bound, count in zip(BUCKETS + (float("inf"),), histogram["buckets"]):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'expenditure_call_seconds_bucket{{function="{name}",le="{le}"}} {cumulative}')
+        lines.append(f'expenditure_call_seconds_sum{{function="{name}"}} {histogram["seconds"]:.6f}')
+        lines.append(f'expenditure_call_seconds_count{{function="{name}"}} {cumulative}')
+
+    lines += ["# HELP expenditure_call_rows_total Rows returned or written by the measured functions.",
+              "# TYPE expenditure_call_rows_total counter"]
+    lines += [f'expenditure_call_rows_total{{function="{name}"}} {histogram["rows"]}' for name, histogram in sorted(histograms.items())]
+
+    lines += ["# HELP expenditure_call_bytes_total Bytes of the frames returned by the measured functions.",
+              "# TYPE expenditure_call_bytes_total counter"]
+    lines += [f'expenditure_call_bytes_total{{function="{name}"}} {histogram["bytes"]}' for name, histogram in sorted(histograms.items())]
+
+    lines += [f"# HELP expenditure_slow_calls_total Calls slower than {SLOW_MS:g} ms per user.",
+              "# TYPE expenditure_slow_calls_total counter"]
+    lines += [f'expenditure_slow_calls_total{{function="{name}",user_id="{user_id}"}} {count}'
+              for (name, user_id), count in sorted(slow_calls.items(), key=str)]
+
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(path: Optional[str] = None) -> None:
+    """
+    Writes the metrics in the Prometheus text format, e.g. for the textfile collector of the node exporter.
+
+    --------
+    Parameters
+    path: str default METRICS_FILE
+        The file to write. Nothing is written if there is no file.
+    """
+
+    path = path or METRICS_FILE
+    if not ENABLED or not path:
+        return
+
+    #The file is replaced in one step, so it is never read half written.
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "w") as file:
+        file.write(prometheus_text())
+    os.replace(temporary, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+
+        body = prometheus_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+_server: Optional[ThreadingHTTPServer] = None
+
+
+def serve_metrics(port: Optional[int] = None) -> None:
+    """
+    Serves the metrics at /metrics on the given port from a background thread. Only the first call starts the server.
+
+    --------
+    Parameters
+    port: int default METRICS_PORT
+        The port to listen on. Nothing is served if there is no port.
+    """
+
+    global _server
+
+    port = port or METRICS_PORT
+    if not ENABLED or not port:
+        return
+
+    with _lock:
+        if _server is not None:
+            return
+        _server = ThreadingHTTPServer(("", int(port)), _MetricsHandler)
+
+    threading.Thread(target=_server.serve_forever, daemon=True, name="metrics").start()
+
+
+def timing_panel() -> None:
+    """
+    Shows the calls of the current rerun in a Streamlit expander at the bottom of the page and publishes the metrics.
+    Must be called last on the page. Shows nothing when the instrumentation is disabled.
+    """
+
+    if not ENABLED:
+        return
+
+    import streamlit as st
+
+    calls = rerun_calls()
+
+    with st.expander(f"Timings: {len(calls)} calls, {calls['ms'].sum():.1f} ms"):
+        st.dataframe(calls)
+        st.dataframe(calls.groupby("name").agg(calls=("ms", "count"), total_ms=("ms", "sum"), rows=("rows", "sum"))
+                          .sort_values(by="total_ms", ascending=False))
+
+    write_metrics()
+    serve_metrics()
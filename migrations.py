@@ -0,0 +1,415 @@
+"""Versioned schema migrations for indexes and tables that create_all can not add to an existing database"""
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+from typing import Callable, List, Set, Tuple, Union
+from database import engine, connect_db, refresh_monthly_rollups
+import pandas as pd
+import threading
+import models
+import re
+
+
+#Whether the application creates and migrates the tables when a process serves its first page.
+#Set schema_init=false when 'python migrations.py' runs as a step of the deploy instead.
+SCHEMA_INIT = (connect_db("schema_init") or "true").lower() == "true"
+
+#The databases initialized by this process, by URL.
+_initialized: Set[str] = set()
+_initialize_lock = threading.Lock()
+
+#Finds the name of the index a migration statement creates.
+INDEX_NAME = re.compile(r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+\{concurrently\}\s+IF\s+NOT\s+EXISTS\s+(\w+)", flags=re.IGNORECASE)
+
+#Characters that gave an identifying text a different meaning when every text was matched as a regular expression.
+REGEX_METACHARACTERS = set(".^$*+?{}[]\\|()")
+
+
+#Every migration has a unique increasing version, a description and the statements it runs.
+#Statements must be safe to run again, since a migration can be interrupted before its version is recorded.
+#'{concurrently}' is replaced with CONCURRENTLY on PostgreSQL, so indexes are built without locking the table.
+#An index a failed concurrent build left invalid is dropped before the statement runs again.
+#A statement can also be a function taking the engine, for data migrations that depend on the dialect.
+MIGRATIONS: List[Tuple[int, str, List[Union[str, Callable]]]] = [
+    (1, "Composite indexes on user_id for expenditures and categories", [
+        'CREATE INDEX {concurrently} IF NOT EXISTS ix_expenditures_user_id_transaktionsdatum ON expenditures (user_id, "Transaktionsdatum")',
+        'CREATE INDEX {concurrently} IF NOT EXISTS ix_expenditures_user_id_kategori_text ON expenditures (user_id, "Kategori", "Text")',
+        'CREATE INDEX {concurrently} IF NOT EXISTS ix_categories_user_id_name ON categories (user_id, name)',
+    ]),
+    (2, "Monthly rollups table, backfilled from the existing expenditures", [
+        lambda db: models.MonthlyRollups.__table__.create(bind=db, checkfirst=True),
+        lambda db: refresh_monthly_rollups(db=db),
+    ]),
+    (3, "Fingerprints for deduplicated statement uploads", [
+        lambda db: add_fingerprint_column(db),
+        lambda db: backfill_fingerprints(db),
+        'CREATE UNIQUE INDEX {concurrently} IF NOT EXISTS ux_expenditures_user_id_fingerprint ON expenditures (user_id, fingerprint)',
+    ]),
+    (4, "Job queue of the background ingest worker", [
+        lambda db: models.IngestJobs.__table__.create(bind=db, checkfirst=True),
+    ]),
+    (5, "Batches of statement files uploaded together, with a summary per file", [
+        lambda db: add_ingest_batch_columns(db),
+        'CREATE INDEX {concurrently} IF NOT EXISTS ix_ingest_jobs_batch_id ON ingest_jobs (batch_id)',
+    ]),
+    (6, "Regex prefix for identifying texts that were matched as regular expressions", [
+        lambda db: prefix_regex_texts(db),
+    ]),
+    (7, "Query cache versions shared by every process", [
+        lambda db: models.CacheVersions.__table__.create(bind=db, checkfirst=True),
+    ]),
+    (8, "Heartbeat of running ingest jobs", [
+        lambda db: add_ingest_heartbeat_column(db),
+    ]),
+    (9, "Monthly rollups dated by the transaction of their balance", [
+        lambda db: refresh_monthly_rollups(db=db),
+    ]),
+    (10, "Statement files of failed ingest jobs dropped", [
+        "UPDATE ingest_jobs SET content = NULL WHERE status = 'failed'",
+    ]),
+]
+
+
+def add_fingerprint_column(db = engine) -> None:
+    """
+    Adds the fingerprint column to an existing expenditures table.
+
+    --------
+    Parameters
+    db: sqlalchemy.engine
+        The database for the application
+    """
+
+    if "fingerprint" in [column["name"] for column in inspect(db).get_columns("expenditures")]:
+        return
+
+    with db.begin() as db_connection:
+        db_connection.execute(text("ALTER TABLE expenditures ADD COLUMN fingerprint VARCHAR"))
+
+
+def add_ingest_batch_columns(db = engine) -> None:
+    """
+    Adds the batch and the per file summary columns to an ingest_jobs table created by migration 4.
+
+    --------
+    Parameters
+    db: sqlalchemy.engine
+        The database for the application
+    """
+
+    existing = [column["name"] for column in inspect(db).get_columns("ingest_jobs")]
+
+    with db.begin() as db_connection:
+        for column in ["batch_id", "parsed", "categorized", "duplicates"]:
+            if column not in existing:
+                db_connection.execute(text(f"ALTER TABLE ingest_jobs ADD COLUMN {column} INTEGER"))
+
+
+def add_ingest_heartbeat_column(db = engine) -> None:
+    """
+    Adds the heartbeat column to an ingest_jobs table created by migration 4.
+
+    --------
+    Parameters
+    db: sqlalchemy.engine
+        The database for the application
+    """
+
+    if "heartbeat_at" in [column["name"] for column in inspect(db).get_columns("ingest_jobs")]:
+        return
+
+    with db.begin() as db_connection:
+        db_connection.execute(text("ALTER TABLE ingest_jobs ADD COLUMN heartbeat_at TIMESTAMP"))
+
+
+def legacy_balances(frame: pd.DataFrame) -> Tuple[pd.Series, pd.Series]:
+    """
+    Corrects the balances of one user's transactions uploaded before utils.parse_amount existed.
+    Those balances were stored as pandas.read_html returned them, so every balance below 1 000 kr lost its decimal comma
+    and is 100 times too large. A stored balance with decimals, or of 100 000 kr or more, was stored correctly,
+    and a whole balance below 1 000 kr is always one of the wrong ones.
+
+    A whole balance from 1 000 to 100 000 kr can be either, e.g. 52 345 is 523,45 kr or 52 345,00 kr.
+    Such a balance is settled by the transactions stored right before and after it: the balance of one of them
+    plus the amount of the later one must give the other balance. The balances that fit no neighbour, or fit
+    one whichever way they are read, are left unsettled.
+
+    --------
+    Parameters
+    frame: pandas.DataFrame
+        Containing the Belopp and Saldo of the user's transactions, ordered by expenditure_id.
+
+    --------
+    Returns
+    saldo: pandas.Series
+        Containing the corrected balance of every transaction.
+    settled: pandas.Series
+        Whether the balance of the transaction could be settled.
+    """
+
+    amounts = frame["Belopp"].tolist()
+    candidates = []
+    for saldo in frame["Saldo"].tolist():
+        if saldo != round(saldo) or abs(saldo) >= 100000:
+            candidates.append({saldo})
+        elif abs(saldo) < 1000:
+            candidates.append({saldo / 100})
+        else:
+            candidates.append({saldo, saldo / 100})
+
+    def fits(index: int, saldo: float) -> bool:
+        #The transactions are stored in the order of the statement, which can be newest or oldest first,
+        #so the balance fits a neighbour if either of them is the other plus its own amount.
+        for neighbour in (index - 1, index + 1):
+            if not 0 <= neighbour < len(candidates):
+                continue
+            for other in candidates[neighbour]:
+                if abs(saldo - (other + amounts[index])) < 0.005 or abs(other - (saldo + amounts[neighbour])) < 0.005:
+                    return True
+        return False
+
+    #A settled balance can settle its neighbours, so the ambiguous balances are checked until none changes.
+    changed = True
+    while changed:
+        changed = False
+        for index, options in enumerate(candidates):
+            if len(options) == 1:
+                continue
+
+            fitting = {saldo for saldo in options if fits(index, saldo)}
+
+            if len(fitting) == 1:
+                candidates[index] = fitting
+                changed = True
+
+    saldo = pd.Series([min(options) if len(options) == 1 else frame["Saldo"].iloc[index] for index, options in enumerate(candidates)],
+                      index=frame.index, dtype="float64")
+    settled = pd.Series([len(options) == 1 for options in candidates], index=frame.index)
+
+    return saldo, settled
+
+
+def backfill_fingerprints(db = engine) -> None:
+    """
+    Computes the fingerprints of transactions uploaded by file before fingerprints existed,
+    so that uploading an overlapping statement again does not duplicate them.
+    Their balances are corrected by legacy_balances first, since the fingerprints of a new upload use the correct balance.
+    Transactions whose balance can not be settled are left without a fingerprint, so they are uploaded again
+    if they are in a later statement. Manually added transactions have no balance and are left without a fingerprint.
+
+    --------
+    Parameters
+    db: sqlalchemy.engine
+        The database for the application
+    """
+
+    #Imported here, since only this migration parses statements and the application imports this module on every start.
+    from utils.parsing import fingerprint_transactions
+
+    query = text('''
+    SELECT expenditure_id, user_id, "Transaktionsdatum", "Text", "Belopp", "Saldo" FROM expenditures
+    WHERE fingerprint IS NULL AND "Saldo" IS NOT NULL
+    ORDER BY user_id, expenditure_id
+    ''')
+
+    with db.connect() as db_connection:
+        df = pd.read_sql(sql=query, con=db_connection)
+
+    if len(df) == 0:
+        return
+
+    stored = df["Saldo"].copy()
+    settled = []
+    for _, user_df in df.groupby("user_id"):
+        df.loc[user_df.index, "Saldo"], user_settled = legacy_balances(user_df)
+        settled.append(user_settled)
+
+    df = df[pd.concat(settled)]
+
+    #Occurrences are numbered per user, in the order the transactions were uploaded.
+    df["fingerprint"] = pd.concat([fingerprint_transactions(user_df) for _, user_df in df.groupby("user_id")])
+
+    with db.begin() as db_connection:
+        db_connection.execute(
+            text('UPDATE expenditures SET "Saldo" = :Saldo, fingerprint = :fingerprint WHERE expenditure_id = :expenditure_id'),
+            df[["Saldo", "fingerprint", "expenditure_id"]].astype(object).to_dict(orient="records"))
+
+    #The monthly rollups hold the balances, and were backfilled from the uncorrected ones by migration 2.
+    if (df["Saldo"] != stored[df.index]).any():
+        refresh_monthly_rollups(db=db)
+
+
+def prefix_regex_texts(db = engine) -> None:
+    """
+    Keeps the meaning of the identifying texts added before the 're:' prefix existed.
+    Every text used to be matched as a case insensitive regular expression, so texts like 'ica|coop' are prefixed
+    with 're:' to stay regular expressions. Texts without regex characters, or that do not compile, match the same
+    as literals and are left as they are.
+
+    --------
+    Parameters
+    db: sqlalchemy.engine
+        The database for the application
+    """
+
+    #Imported here, since only this migration compiles identifying texts.
+    from utils.matching import REGEX, REGEX_PREFIX, rule_type
+
+    with db.connect() as db_connection:
+        categories = db_connection.execute(text("SELECT category_id, text FROM categories WHERE text IS NOT NULL")).all()
+
+    prefixed = [{"category_id": category_id, "text": REGEX_PREFIX + category_text} for category_id, category_text in categories
+                if not category_text.startswith(REGEX_PREFIX) and REGEX_METACHARACTERS & set(category_text)
+                and rule_type(REGEX_PREFIX + category_text) == REGEX]
+
+    if prefixed:
+        with db.begin() as db_connection:
+            db_connection.execute(text("UPDATE categories SET text = :text WHERE category_id = :category_id"), prefixed)
+
+
+def drop_invalid_index(name: str, db_connection) -> bool:
+    """
+    Drops an index left invalid by a CREATE INDEX CONCURRENTLY that failed or was interrupted on PostgreSQL.
+    Such an index exists but is never used, and IF NOT EXISTS would skip building it again.
+
+    --------
+    Parameters
+    name: str
+        The name of the index.
+    db_connection: sqlalchemy.engine.Connection
+        An autocommitted connection to a PostgreSQL database, since DROP INDEX CONCURRENTLY can not run in a transaction.
+
+    --------
+    Returns
+    bool
+        True if the index was invalid and dropped.
+    """
+
+    valid = db_connection.execute(text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"),
+                                  {"name": name}).scalar()
+
+    if valid is None or valid:
+        return False
+
+    db_connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+    return True
+
+
+def current_version(db = engine) -> int:
+    """
+    Returns the latest migration version applied to the database.
+
+    --------
+    Parameters
+    db: sqlalchemy.engine
+        The database for the application
+
+    --------
+    Returns
+    int
+        The latest applied version, 0 if no migration has been applied.
+    """
+
+    with db.begin() as db_connection:
+        db_connection.execute(text('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description VARCHAR NOT NULL
+        )
+        '''))
+
+        version = db_connection.execute(text("SELECT MAX(version) FROM schema_migrations")).scalar()
+
+    return version or 0
+
+
+def migrate(db = engine) -> List[int]:
+    """
+    Applies every migration newer than the current version of the database, in order.
+    Running it again when the database is up to date does nothing.
+
+    --------
+    Parameters
+    db: sqlalchemy.engine
+        The database for the application
+
+    --------
+    Returns
+    applied: list of int
+        The versions that were applied.
+    """
+
+    applied = []
+    version = current_version(db=db)
+    concurrently = "CONCURRENTLY" if db.dialect.name == "postgresql" else ""
+
+    for migration_version, description, statements in MIGRATIONS:
+        if migration_version <= version:
+            continue
+
+        for statement in statements:
+            if callable(statement):
+                statement(db)
+                continue
+
+            #CREATE INDEX CONCURRENTLY can not run inside a transaction, which is why every statement is autocommitted.
+            with db.connect().execution_options(isolation_level="AUTOCOMMIT") as db_connection:
+                index = INDEX_NAME.search(statement)
+                if index and concurrently:
+                    drop_invalid_index(index.group(1), db_connection)
+
+                db_connection.execute(text(statement.format(concurrently=concurrently)))
+
+        #Another process may have applied the same migration at the same time.
+        try:
+            with db.begin() as db_connection:
+                db_connection.execute(
+                    text("INSERT INTO schema_migrations (version, description) VALUES (:version, :description)"),
+                    {"version": migration_version, "description": description})
+        except IntegrityError:
+            pass
+
+        applied.append(migration_version)
+
+    return applied
+
+
+def initialize(db = engine) -> bool:
+    """
+    Creates the tables and applies the migrations the first time it is called in the process.
+    Later calls return without touching the database, so every page and 'python ingest.py' call it on every start or rerun.
+    Does nothing but remember the database when schema_init=false.
+
+    --------
+    Parameters
+    db: sqlalchemy.engine
+        The database for the application
+
+    --------
+    Returns
+    bool
+        True if this call initialized the database.
+    """
+
+    url = str(db.url)
+    if url in _initialized:
+        return False
+
+    #Sessions rerun concurrently, so only the first of them initializes and the others wait for it.
+    with _initialize_lock:
+        if url in _initialized:
+            return False
+
+        if SCHEMA_INIT:
+            models.Base.metadata.create_all(bind=db)
+            migrate(db=db)
+
+        _initialized.add(url)
+
+    return True
+
+
+if __name__ == "__main__":
+    models.Base.metadata.create_all(bind=engine)
+
+    print(f"Applied migrations: {migrate() or 'none, the database is up to date'}")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, Float, ForeignKey, CheckConstraint, DateTime
+from sqlalchemy import Column, String, Integer, Float, ForeignKey, CheckConstraint, DateTime, Index, LargeBinary
 from sqlalchemy.orm import relationship
 from database import Base
 
@@ -31,9 +31,17 @@ class Expenditures(Base):
     Typ = Column(String)
     Kategori = Column(String, index=True)
     user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
+    fingerprint = Column(String, nullable=True)
 
     user_expenditure = relationship("Users", back_populates="expenditure")
 
+    #Every query filters on user_id first. Existing databases get these through migrations.py
+    __table_args__ = (
+        Index("ix_expenditures_user_id_transaktionsdatum", "user_id", "Transaktionsdatum"),
+        Index("ix_expenditures_user_id_kategori_text", "user_id", "Kategori", "Text"),
+        Index("ux_expenditures_user_id_fingerprint", "user_id", "fingerprint", unique=True),
+    )
+
 
 class Categories(Base):
 
@@ -45,3 +53,63 @@ class Categories(Base):
     user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
 
     user_category = relationship("Users", back_populates="category")
+
+    __table_args__ = (
+        Index("ix_categories_user_id_name", "user_id", "name"),
+    )
+
+
+class MonthlyRollups(Base):
+
+    #Monthly sums per category and type. Kept up to date by database.refresh_monthly_rollups
+    __tablename__ = "monthly_rollups"
+
+    user_id = Column(Integer, ForeignKey("users.user_id"), primary_key=True)
+    month = Column(DateTime, primary_key=True)
+    Kategori = Column(String, primary_key=True)
+    Typ = Column(String, primary_key=True)
+    Belopp = Column(Float)
+    Occurances = Column(Integer)
+    Saldo = Column(Float)
+    last_date = Column(DateTime)
+
+
+class IngestJobs(Base):
+
+    #Statement files waiting for or processed by the background ingest worker in ingest.py
+    __tablename__ = "ingest_jobs"
+
+    job_id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
+    batch_id = Column(Integer)
+    filename = Column(String)
+    content = Column(LargeBinary)
+    status = Column(String, nullable=False)
+    progress = Column(Float)
+    parsed = Column(Integer)
+    categorized = Column(Integer)
+    duplicates = Column(Integer)
+    rows = Column(Integer)
+    skipped = Column(Integer)
+    rejected = Column(Integer)
+    error = Column(String)
+    created_at = Column(DateTime)
+    started_at = Column(DateTime)
+    heartbeat_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_ingest_jobs_status_job_id", "status", "job_id"),
+        Index("ix_ingest_jobs_user_id_job_id", "user_id", "job_id"),
+        Index("ix_ingest_jobs_batch_id", "batch_id"),
+    )
+
+
+class CacheVersions(Base):
+
+    #The versions of every user's cached query results, shared by every process serving the application. See query_cache.py
+    __tablename__ = "cache_versions"
+
+    user_id = Column(Integer, ForeignKey("users.user_id"), primary_key=True)
+    data = Column(Integer, nullable=False, default=0)
+    categories = Column(Integer, nullable=False, default=0)
@@ -1,9 +1,14 @@
 import streamlit as st
+import instrumentation
 import utils
 import database
+import migrations
 import pandas as pd
 from datetime import datetime
 
+#Creates and migrates the tables once per process, in case this page is the first one the process serves.
+migrations.initialize()
+
 
 if "current_user" in st.session_state:
     #Setting the title for the page as well as the icon displayed in the browser tab
@@ -15,11 +20,13 @@ if "current_user" in st.session_state:
     #<<<----Initial Section of the page where the user can set their date range>>>----
     
     #Checking the earliest and the latest date in the db in order to give the user a date range from the prompt
-    START_DATE = database.check_earliest_date(user_id=st.session_state["user_id"])
-    END_DATE = database.check_latest_date(user_id=st.session_state["user_id"])
+    date_bounds = database.get_date_bounds(user_id=st.session_state["user_id"])
+    START_DATE, END_DATE = date_bounds["earliest"], date_bounds["latest"]
 
     if START_DATE is None:
         st.warning("You need to add some data first!")
+        #The panel is shown before stopping, since the rest of the page does not run.
+        instrumentation.timing_panel()
         st.stop()
     
     st.markdown("Select a starting month to start the analysis from.")
@@ -37,8 +44,14 @@ if "current_user" in st.session_state:
                                 index=len(datelist) - 6 if len(datelist) > 6 else len(datelist)-1)
 
 
-    #Pulls data from the database given the date input from the user
-    df = database.get_cash_data(user_id=st.session_state["user_id"], start_month=datetime.strptime(starting_month, "%b-%Y"))
+    #Prepares the monthly views shared by every chart on the page, given the date input from the user.
+    #Only rebuilt when the user's data has changed.
+    start_month = datetime.strptime(starting_month, "%b-%Y")
+    analytics = utils.get_analytics(user_id=st.session_state["user_id"], start_month=start_month)
+
+    #Every figure is cached on its parameters, so a widget change only rebuilds the figure depending on it.
+    def chart(name: str, **params):
+        return utils.get_chart(user_id=st.session_state["user_id"], start_month=start_month, chart=name, **params)
 
     ##<<<----Overview Section of the Page>>>----
     st.subheader("Overview Level")
@@ -54,22 +67,20 @@ if "current_user" in st.session_state:
 
     #Plots the profit/loss per month
     with monthly_result:
-        st.plotly_chart(utils.bar_plot(df))
+        st.plotly_chart(chart("bar_plot"))
 
     #Plots the ending balance per month
     with balace_over_time:
         st.caption(":red[Note:] :pencil: This is only available if you uploaded data via file. Otherwise, use the 'Monthly Savings/Loss' tab.")
-        st.plotly_chart(utils.monthly_balance(df))
+        st.plotly_chart(chart("monthly_balance"))
 
     #Allows the user to select a specific month to analyze the cost per category for the given month.
     with detailed_month:
 
-        df["month"] = df["Transaktionsdatum"].dt.strftime("%b-%Y")
-
         selected_month = st.selectbox(label="Select which month to analyze",
-                                        options=df["month"].unique(), key="selected_month")
+                                        options=analytics.month_labels(), key="selected_month")
 
-        st.plotly_chart(utils.horizontal_barplot(df, selected_month=selected_month))
+        st.plotly_chart(chart("horizontal_barplot", selected_month=selected_month))
 
     #<<<----Detailed Category Level section>>>----
     st.subheader("Category Level")
@@ -84,18 +95,21 @@ if "current_user" in st.session_state:
     #Allows the user to multi-select categories to show costs over time.
     with categories_over_time:
         selected_cats = st.multiselect(label="Select which categories you want to visualize",
-                    options=df[df["Typ"] == "Kostnad"]["Kategori"].unique(), key="selected_categories")
+                    options=analytics.cost_categories, key="selected_categories")
         
-        st.plotly_chart(utils.line_plot(df, selected_cats))
+        st.plotly_chart(chart("line_plot", selected_categories=selected_cats))
 
     #Allows the user to get detailed transaction information for all transactions within a specified category.
     with detailed_category:
         single_category = st.selectbox(label="Select category to analyze", 
-                                    options=df[df["Typ"] == "Kostnad"]["Kategori"].unique(), key="single_category")
+                                    options=analytics.cost_categories, key="single_category")
 
-        single_df = df[df["Kategori"] == single_category]
-
-        st.write(single_df.groupby("Text").agg(Amount=("Belopp", "sum"), Occurance=("Text","count")).sort_values(by="Amount"))
+        #The transactions within the selected category are summarized per text in the database.
+        st.write(database.get_category_summary(user_id=st.session_state["user_id"], start_month=start_month,
+                                                category=single_category))
 
 else:
-    st.warning("Log in to your account to view this section")
\ No newline at end of file
+    st.warning("Log in to your account to view this section")
+
+#Shows where the rerun spent its time, if the instrumentation is enabled.
+instrumentation.timing_panel()
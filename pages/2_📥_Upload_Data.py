@@ -1,8 +1,13 @@
 import streamlit as st
+import instrumentation
 import pandas as pd
+import ingest
 import utils
 import database
-import models
+import migrations
+
+#Creates and migrates the tables once per process, in case this page is the first one the process serves.
+migrations.initialize()
 
 if "current_user" in st.session_state:
     #Setting the title for the page as well as the icon displayed in the browser tab
@@ -16,43 +21,73 @@ if "current_user" in st.session_state:
 
     st.caption(":red[Note:] :pencil: File upload currently only works with files from Handelsbanken")
     
-    #File upload functionality. Restricted to .xls.
-    chosen_file = st.file_uploader(label="Choose a file", help="Select a transactionfile from Handelsbanken",
-                                    type="xls")
+    #File upload functionality. Restricted to .xls. Several statements can be uploaded at once, e.g. to backfill years of history.
+    chosen_files = st.file_uploader(label="Choose files", help="Select one or more transactionfiles from Handelsbanken",
+                                    type="xls", accept_multiple_files=True)
+
+    #If upload is selected the files are put in the ingest queue as one batch. The files are parsed and categorized
+    #in parallel in the background, so the page stays responsive, and uploaded together. Transactions in more than one
+    #of the files, or already in the database, are recognized by their fingerprint and only uploaded once.
+    if chosen_files:
+        #Shows sample data from the first rows of every chosen file, categorized with the user's current categories.
+        for chosen_file in chosen_files:
+            try:
+                sample = next(utils.read_statement_chunks(chosen_file, chunk_size=5), None)
+            except ValueError as error:
+                st.warning(f"{chosen_file.name}: {error}")
+                continue
+            finally:
+                chosen_file.seek(0)
+
+            if sample is None:
+                st.warning(f"No transactions were found in {chosen_file.name}")
+            else:
+                sample, _ = utils.parse_statement(sample, header_row=False)
+                st.write(f"Sample from the data to upload ({chosen_file.name}):",
+                         utils.categorization(sample, user_id=st.session_state["user_id"]))
 
-    #If file is uploaded it will read it, categorize it given the current user's categories
-    if chosen_file:
-        #Reads the user provided xls.
-        df = pd.read_html(chosen_file)[3] 
+        upload_prompt = st.button("Upload to database?", key="file_upload")
 
-        #Categorizes the costs based on the parameters in the categorization function
-        df = utils.categorization(df, user_id=st.session_state["user_id"])
+        if upload_prompt:
+            job_ids = ingest.submit_batch([(file.name, file.getvalue()) for file in chosen_files], user_id=st.session_state["user_id"])
+            st.session_state.setdefault("ingest_submitted", []).extend(job_ids)
 
-        #Shows sample data from the provided xls.
-        st.write("Sample from the data to upload:", df.head())
+    #Picks up jobs that were queued while no worker was running in this process.
+    if ingest.INLINE_WORKER:
+        ingest.start_worker()
 
-        #Sets a column for the current user's id. Will be used later for the database upload.
-        df["user_id"] = st.session_state["user_id"]
+    #Shows the status of the user's latest uploads.
+    jobs = ingest.get_jobs(user_id=st.session_state["user_id"], limit=50)
+    active = jobs[jobs["status"].isin([ingest.QUEUED, ingest.RUNNING])]
 
-        #Prompts the user whether they want to upload the data to the database
-        upload_prompt = st.button("Upload to database?", key="file_upload")
+    for job in active.itertuples():
+        st.caption(f"{job.filename}: {job.status}")
+        st.progress(float(job.progress or 0))
 
-    #If upload is selected it checks db for the latest provided date and masks
-    #the provided file from that date.
-        if upload_prompt:
+    #The status is read again on every rerun. The page does not rerun by itself, so it never blocks the session.
+    if len(active) != 0:
+        st.button("Refresh upload status", key="refresh_uploads")
 
-            date_checker = database.check_latest_date(user_id=st.session_state["user_id"])
-            
-            df = df[df["Transaktionsdatum"] > date_checker]
+    submitted = jobs[jobs["job_id"].isin(st.session_state.get("ingest_submitted", []))].sort_values(by="job_id")
+    done = submitted[submitted["status"] == ingest.DONE]
 
-            if len(df) > 1:
-                df.to_sql(con=database.engine, name=models.Expenditures.__tablename__, if_exists="append", index=False)
-                st.success("Data was uploaded", icon="✔")
-            else:
-                st.error("All that data is already in the database") #If the mask gives an empty dataframe it does not upload anything.
-            
+    #Summarizes every uploaded file. Duplicates were also in an earlier file of the same upload.
+    if len(done) != 0:
+        #The total is the one of the latest upload, even if several were made from this session.
+        latest = done[done["batch_id"] == done["batch_id"].max()]
 
+        if latest["rows"].sum() != 0:
+            st.success(f"{latest['rows'].sum()} transactions were uploaded", icon="✔")
+        else:
+            st.error("All that data is already in the database") #If every fingerprint already exists nothing is uploaded.
 
+        st.dataframe(done[["filename", "parsed", "categorized", "rows", "duplicates", "skipped", "rejected"]]
+                     .set_index("filename")
+                     .rename(columns={"parsed": "Parsed", "categorized": "Categorized", "rows": "Uploaded", "duplicates": "Duplicates",
+                                      "skipped": "Already uploaded", "rejected": "Unreadable"}))
+
+    for job in submitted[submitted["status"] == ingest.FAILED].itertuples():
+        st.error(f"{job.filename} could not be uploaded: {job.error}")
 
     st.subheader("Upload manually")
     st.markdown("Add and label your expenditures/income manually.  \n"
@@ -70,7 +105,7 @@ if "current_user" in st.session_state:
         
         expenditure_form.subheader("Add expenditure")
         expenditure_amount = expenditure_form.number_input("Amount", step=int(1), min_value=1)
-        expenditure_category = expenditure_form.selectbox("Category", options=database.get_user_categories(st.session_state["user_id"], usage="display")["Name"].unique())
+        expenditure_category = expenditure_form.selectbox("Category", options=utils.get_category_catalog(user_id=st.session_state["user_id"]).names)
         expenditure_date = expenditure_form.date_input("Date")
         expenditure_text = expenditure_form.text_input("Add text (Optional)")
 
@@ -115,11 +150,14 @@ if "current_user" in st.session_state:
         manual_upload = st.button("Upload to database?", key="manual_expenditure")
 
         if manual_upload:
-            st.session_state["expend_df"].to_sql(con=database.engine,name=models.Expenditures.__tablename__, if_exists="append", index=False)
+            database.bulk_insert_expenditures(st.session_state["expend_df"])
             
             del st.session_state["expend_df"]
             st.success("Data was uploaded!")
                 
 
 else:
-    st.warning("Log in to your account to view this section")
\ No newline at end of file
+    st.warning("Log in to your account to view this section")
+
+#Shows where the rerun spent its time, if the instrumentation is enabled.
+instrumentation.timing_panel()
@@ -1,7 +1,12 @@
 import streamlit as st
+import instrumentation
 import database
+import migrations
 import utils
 
+#Creates and migrates the tables once per process, in case this page is the first one the process serves.
+migrations.initialize()
+
 #Sets the page configuration so that the browser shows the page name and icon.
 st.set_page_config("💰 Categories Setup", page_icon="💰")
 
@@ -13,15 +18,15 @@ if "current_user" in st.session_state:
                 "* **Identify Category by Text** - This is used if you are using file upload for your expenditures. It automatically categorizes your expenditures based on the text.  \n"
                 "* **Delete Category** - Here you can delete your categories.")
 
-    #Retrieves the user's categories from the database.
-    user_categories = database.get_user_categories(user_id=st.session_state["user_id"], usage="display")
+    #Retrieves the user's categories, prepared once per change of the categories.
+    catalog = utils.get_category_catalog(user_id=st.session_state["user_id"])
 
     #<<<----Expander to show the user's categories>>>----
     with st.expander("Show my categories"):
-        if len(user_categories) != 0:
+        if len(catalog.display) != 0:
             st.caption(":red[Note:] :pencil: A category will appear multiple times if you are using different texts to identify it.  \n"
                     "The different identifying texts are used for automatic categorization via file upload")
-            st.dataframe(user_categories, use_container_width=True)
+            st.dataframe(catalog.display, use_container_width=True)
         else:
             st.warning("You do not have any categories yet!")
 
@@ -49,14 +54,26 @@ if "current_user" in st.session_state:
         with col1:
             st.caption(":red[Note:] :pencil: This functionality is for when you upload your expenditures via file upload.  \n"
                     "The expenditures will be automatically categorized given the identifying text you provide.")
-            existing_category = st.selectbox("Category", options=user_categories["Name"].unique())
+            existing_category = st.selectbox("Category", options=catalog.names)
             identifying_text = st.text_input("Text that identifies your category")
             customize_category = st.button(
                 "Update Category",
                 key="update_category",
                 on_click=utils.update_category,
                 kwargs={"user_id": st.session_state["user_id"], "category_name": existing_category, "category_text": identifying_text})
-        
+
+            #Updating a category only matches the uncategorized expenditures and those of the category again.
+            #Matching all of them again can move expenditures between other categories, so it has to be confirmed.
+            st.caption("Your uploaded expenditures in other categories keep their category when you update a category.  \n"
+                    "To match all of them against your current identifying texts again, confirm and press **:blue[Recategorize All]**.")
+            confirm_recategorize = st.checkbox("I understand that my uploaded expenditures can change category", key="confirm_recategorize")
+            st.button(
+                "Recategorize All",
+                key="recategorize_all",
+                disabled=not confirm_recategorize,
+                on_click=utils.recategorize_all,
+                kwargs={"user_id": st.session_state["user_id"]})
+
         #Retrieves all the uncategorized expenditures for the given user.
         with col2:
             st.caption("Here are your expenditures which could not be categorized automatically.  \n"
@@ -66,11 +83,11 @@ if "current_user" in st.session_state:
 
     #Deletes the category for the given user and puts all the expenditures within that category as uncategorized.
     with delete_tab:
-        st.caption(":red[Note:] :pencil: All your expenditures within the deleted category will be put as uncategorized.  \n"
+        st.caption(":red[Note:] :pencil: All your expenditures within the deleted category will be matched against your other identifying texts, or put as uncategorized.  \n"
                     "You can choose to recategorize them in the :blue['Identify Category by Text'] tab.")
         category_to_delete = st.selectbox(
             "Category to delete",
-            options=user_categories["Name"].unique(),
+            options=catalog.names,
             key="select_delete")
         st.button("Delete Category",
             key="category_delete",
@@ -79,3 +96,6 @@ if "current_user" in st.session_state:
 
 else:
     st.warning("Log in to your account to view this section")
+
+#Shows where the rerun spent its time, if the instrumentation is enabled.
+instrumentation.timing_panel()
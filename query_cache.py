@@ -0,0 +1,289 @@
+"""In-process read cache for the database queries, invalidated per user whenever the user's data is written by any process"""
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+import pandas as pd
+import functools
+import threading
+import inspect
+import time
+from config import connect_db
+
+
+#Maximum amount of query results held in memory. The least recently used result is evicted first.
+CACHE_SIZE = int(connect_db("query_cache_size") or 256)
+
+_lock = threading.Lock()
+_results: "OrderedDict[Hashable, Any]" = OrderedDict()
+
+#The versions of every user per kind: 'data' changes with every write to the user's data,
+#'categories' only when the user's categories change, so uploads do not invalidate what only depends on the categories.
+#Every process counts its own writes, and the shared versions count the writes of every process, see share_versions.
+_versions: Dict[str, Dict[int, int]] = {"data": {}, "categories": {}}
+_shared_versions: Dict[str, Dict[int, int]] = {"data": {}, "categories": {}}
+
+#Every store of results per kind of version, the shared one and those of functions cached with their own size.
+_stores: Dict[str, List["OrderedDict[Hashable, Any]"]] = {"data": [_results], "categories": []}
+
+#Bumped when every user is invalidated at once.
+_generation = 0
+
+#Seconds a process serves a user's cached results before checking whether another process has bumped the user's versions.
+VERSION_TTL = float(connect_db("query_cache_version_ttl") or 1)
+
+#Reads and bumps the versions shared by every process, see share_versions. None keeps the versions in this process only.
+_shared_load: Optional[Callable[[int], Dict[str, int]]] = None
+_shared_bump: Optional[Callable[[int, str], int]] = None
+
+#When the versions of every user were last read from the shared store.
+_checked: Dict[int, float] = {}
+
+
+def _version(user_id: int, kind: str = "data") -> tuple:
+    return _generation, _versions[kind].get(user_id, 0), _shared_versions[kind].get(user_id, 0)
+
+
+def data_version(user_id: int) -> tuple:
+    """
+    Returns the current data version of the user. The version changes every time the user's data is written.
+
+    --------
+    Parameters
+    user_id: int
+        The id of the user.
+
+    --------
+    Returns
+    tuple
+        The data version of the user.
+    """
+
+    _refresh(user_id)
+
+    with _lock:
+        return _version(user_id)
+
+
+def category_version(user_id: int) -> tuple:
+    """
+    Returns the current category version of the user. The version changes every time the user's categories are written.
+
+    --------
+    Parameters
+    user_id: int
+        The id of the user.
+
+    --------
+    Returns
+    tuple
+        The category version of the user.
+    """
+
+    _refresh(user_id)
+
+    with _lock:
+        return _version(user_id, "categories")
+
+
+def share_versions(load: Callable[[int], Dict[str, int]], bump: Callable[[int, str], int]) -> None:
+    """
+    Keeps the versions of every user in a store shared by every process, e.g. a table in the database,
+    so a write in one process, like the ingest worker, invalidates the cached results of the others.
+    A process reads a user's versions at most once every query_cache_version_ttl seconds (default 1),
+    so other processes can serve results that old after a write. Without a shared store, or when it fails,
+    the versions only invalidate the results of this process.
+
+    --------
+    Parameters
+    load: Callable
+        Returns the shared 'data' and 'categories' versions of a user.
+    bump: Callable
+        Increments the shared version of the given kind of a user and returns the new version.
+    """
+
+    global _shared_load, _shared_bump
+
+    with _lock:
+        _shared_load, _shared_bump = load, bump
+        _checked.clear()
+
+
+def _drop(kind: str, user_id: int) -> None:
+    #Results for an old version can never be read again, so they are dropped right away. Called with the lock held.
+    for store in _stores[kind]:
+        for key in [key for key in store if key[1] == user_id]:
+            del store[key]
+
+
+def _refresh(user_id: int) -> None:
+    #Reads the shared versions of the user, unless they were read less than VERSION_TTL seconds ago.
+    load = _shared_load
+    if load is None or time.monotonic() - _checked.get(user_id, float("-inf")) < VERSION_TTL:
+        return
+
+    _checked[user_id] = time.monotonic()
+
+    try:
+        versions = load(user_id)
+    except Exception:
+        return
+
+    with _lock:
+        for kind, version in versions.items():
+            if _shared_versions[kind].get(user_id, 0) != version:
+                _shared_versions[kind][user_id] = version
+                _drop(kind, user_id)
+
+
+def _bump(kind: str, user_id: Optional[int]) -> None:
+    global _generation
+
+    if user_id is None:
+        with _lock:
+            _generation += 1
+            for store in [store for stores in _stores.values() for store in stores]:
+                store.clear()
+        return
+
+    version = None
+    if _shared_bump is not None:
+        try:
+            version = _shared_bump(user_id, kind)
+        except Exception:
+            pass
+
+    with _lock:
+        #The version of this process is bumped even if the shared store fails, but then other processes do not see it.
+        _versions[kind][user_id] = _versions[kind].get(user_id, 0) + 1
+        if version is not None:
+            _shared_versions[kind][user_id] = version
+        _drop(kind, user_id)
+
+
+def bump_data_version(user_id: Optional[int] = None) -> None:
+    """
+    Invalidates the cached query results of a user. Must be called after every write to the user's data.
+
+    --------
+    Parameters
+    user_id: int default None
+        The id of the user whose data was written. None invalidates every user, in this process only.
+    """
+
+    _bump("data", user_id)
+
+
+def bump_category_version(user_id: Optional[int] = None) -> None:
+    """
+    Invalidates the cached results depending on the categories of a user. Must be called after every write to the user's categories,
+    together with bump_data_version when expenditures were recategorized.
+
+    --------
+    Parameters
+    user_id: int default None
+        The id of the user whose categories were written. None invalidates every user, in this process only.
+    """
+
+    _bump("categories", user_id)
+
+
+def clear(kind: Optional[str] = None) -> None:
+    """
+    Empties the cache.
+
+    --------
+    Parameters
+    kind: str {'data' or 'categories'} default None
+        Only empties the results cached on this kind of version. None empties every result.
+    """
+
+    with _lock:
+        for store in [store for stores_kind, stores in _stores.items() if kind in (None, stores_kind) for store in stores]:
+            store.clear()
+
+
+def _freeze(value: Any) -> Hashable:
+    #Lists and sets of arguments, e.g. column names, are turned into tuples so they can be part of the key.
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+
+    return value
+
+
+def _copy(value: Any) -> Any:
+    #Callers are free to modify what they get back, without changing the cached result.
+    #Frames, dicts and the results defining a copy() of their own, e.g. utils.analytics.AnalyticsFrame, are copied.
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy()
+    if isinstance(value, dict):
+        return dict(value)
+    if callable(getattr(value, "copy", None)):
+        return value.copy()
+
+    return value
+
+
+def cached_query(function: Optional[Callable] = None, *, size: Optional[int] = None, version: str = "data") -> Callable:
+    """
+    Decorator caching the result of a database query function taking a 'user_id' and a 'db' argument.
+    The result is cached on the function, the database, the user, the user's version and the remaining arguments.
+
+    --------
+    Parameters
+    function: Callable
+        The query function to cache.
+    size: int default None
+        Gives the function a store of its own, holding at most this many results.
+        None shares the store of CACHE_SIZE results with the other query functions.
+    version: str {'data' or 'categories'} default 'data'
+        The version of the user the results are cached on. 'categories' is for functions reading nothing but the categories.
+
+    --------
+    Returns
+    Callable
+        The cached query function.
+    """
+
+    if function is None:
+        return functools.partial(cached_query, size=size, version=version)
+
+    signature = inspect.signature(function)
+
+    if size is None and version == "data":
+        store, max_size = _results, CACHE_SIZE
+    else:
+        store, max_size = OrderedDict(), size or CACHE_SIZE
+        with _lock:
+            _stores[version].append(store)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+
+        arguments = dict(bound.arguments)
+        db = arguments.pop("db")
+        user_id = arguments.pop("user_id")
+
+        _refresh(user_id)
+
+        with _lock:
+            key = (function.__name__, user_id, _version(user_id, version), id(db), _freeze(tuple(sorted(arguments.items()))))
+
+            if key in store:
+                store.move_to_end(key)
+                return _copy(store[key])
+
+        result = function(*args, **kwargs)
+
+        with _lock:
+            #The data may have been written while the query ran, in which case the result is not stored.
+            if key[2] == _version(user_id, version):
+                store[key] = result
+                while len(store) > max_size:
+                    store.popitem(last=False)
+
+        return _copy(result)
+
+    return wrapper
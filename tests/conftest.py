@@ -0,0 +1,79 @@
+"""Runs the tests against a temporary SQLite database. db_url is set before the application modules read it"""
+from sqlalchemy import text
+import pandas as pd
+import tempfile
+import pytest
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ["db_url"] = f"sqlite:///{tempfile.mkdtemp()}/tests.db"
+os.environ["db_fetch_backend"] = "pandas"
+os.environ["schema_init"] = "true"
+#The tests claim and run the ingest jobs themselves.
+os.environ["ingest_inline_worker"] = "false"
+
+import database
+import migrations
+import query_cache
+
+#Emptied before every test, in an order the foreign keys allow.
+TABLES = ["expenditures", "categories", "monthly_rollups", "ingest_jobs", "cache_versions", "users"]
+
+USER_ID = 1
+
+
+@pytest.fixture(scope="session")
+def db():
+    migrations.initialize(db=database.engine)
+
+    return database.engine
+
+
+@pytest.fixture(autouse=True)
+def user_id(db) -> int:
+    #Every test starts with an empty database holding one user, and an empty query cache.
+    with db.begin() as db_connection:
+        for table in TABLES:
+            db_connection.execute(text(f"DELETE FROM {table}"))
+        db_connection.execute(text("INSERT INTO users (user_id, username, email) VALUES (:user_id, 'tester', 'tester@example.com')"),
+                              {"user_id": USER_ID})
+
+    query_cache.clear()
+
+    return USER_ID
+
+
+def add_categories(db, user_id: int, rules) -> None:
+    #Stores (category, identifying text) pairs in the order given, like the Categories page does one by one.
+    with db.begin() as db_connection:
+        db_connection.execute(text("INSERT INTO categories (name, text, user_id) VALUES (:name, :text, :user_id)"),
+                              [{"name": name, "text": category_text, "user_id": user_id} for name, category_text in rules])
+
+    query_cache.bump_category_version(user_id)
+
+
+#The columns of the transaction table of a Handelsbanken statement.
+HEADER = ["Reskontradatum", "Transaktionsdatum", "Text", "Belopp", "Saldo"]
+
+
+def statement(rows) -> bytes:
+    #A statement file with the transactions in the fourth table, like the bank's.
+    table = lambda cells: "<table>" + "".join("<tr>" + "".join(f"<td>{cell}</td>" for cell in row) + "</tr>" for row in cells) + "</table>"
+
+    return ("<html><body>" + table([["Kontoutdrag"]]) * 3 + table([HEADER] + rows) + "</body></html>").encode("utf-8")
+
+
+def transactions(rows, user_id: int = USER_ID) -> pd.DataFrame:
+    #Builds uploaded transactions from (date, text, amount, balance, category) rows, with their fingerprints.
+    from utils.parsing import fingerprint_transactions
+
+    frame = pd.DataFrame(rows, columns=["Transaktionsdatum", "Text", "Belopp", "Saldo", "Kategori"])
+    frame["Transaktionsdatum"] = pd.to_datetime(frame["Transaktionsdatum"])
+    frame["Typ"] = ["Kostnad" if amount < 0 else "Inkomst" for amount in frame["Belopp"]]
+    frame["user_id"] = user_id
+    frame["fingerprint"] = fingerprint_transactions(frame)
+
+    return frame
@@ -0,0 +1,43 @@
+import pytest
+import query_cache
+import utils.catalog
+from utils import get_category_catalog
+from conftest import add_categories
+
+
+def test_catalog_holds_the_categories_in_every_form(db, user_id):
+    add_categories(db, user_id, [("Food", "ica"), ("Food", "coop"), ("Savings", ""), ("Fuel", "re:^shell")])
+
+    catalog = get_category_catalog(user_id=user_id, db=db)
+
+    assert catalog.names == ["Food", "Savings", "Fuel"]
+    assert catalog.rules == (("Food", "ica"), ("Food", "coop"), ("Fuel", "re:^shell"))
+    assert catalog.texts == {"Food": ["ica", "coop"], "Fuel": ["re:^shell"]}
+    assert catalog.matcher.match("SHELL E4") == "Fuel"
+
+
+def test_catalog_is_built_once_per_category_version(db, user_id):
+    add_categories(db, user_id, [("Food", "ica")])
+    catalog = get_category_catalog(user_id=user_id, db=db)
+
+    #Uploads bump the data version, which the catalog does not depend on.
+    query_cache.bump_data_version(user_id)
+    assert get_category_catalog(user_id=user_id, db=db) is catalog
+
+    add_categories(db, user_id, [("Fuel", "shell")])
+    assert get_category_catalog(user_id=user_id, db=db).names == ["Food", "Fuel"]
+
+
+def test_catalog_can_be_shown_when_the_rules_do_not_compile(db, user_id, monkeypatch):
+    def fail(rules):
+        raise ValueError("the rules do not compile")
+
+    monkeypatch.setattr(utils.catalog, "compile_rules", fail)
+    add_categories(db, user_id, [("Food", "ica")])
+
+    catalog = get_category_catalog(user_id=user_id, db=db)
+
+    assert catalog.names == ["Food"]
+    assert len(catalog.display) == 1
+    with pytest.raises(ValueError):
+        catalog.matcher
@@ -0,0 +1,154 @@
+from contextlib import contextmanager
+import datetime
+import pandas as pd
+from sqlalchemy import create_engine, exc, text
+import pytest
+import database
+import query_cache
+import utils
+from conftest import transactions
+
+
+ROWS = [("2023-01-02", "ICA NARA", -12.5, 987.5, "Food"),
+        ("2023-01-02", "ICA NARA", -12.5, 975.0, "Food"),
+        ("2023-01-03", "LON", 25000.0, 25975.0, None)]
+
+
+def count(db, user_id: int) -> int:
+    with db.connect() as db_connection:
+        return db_connection.execute(text("SELECT COUNT(*) FROM expenditures WHERE user_id = :user_id"), {"user_id": user_id}).scalar()
+
+
+def test_uploaded_transactions_are_only_inserted_once(db, user_id):
+    first = database.bulk_insert_expenditures(transactions(ROWS), db=db)
+    again = database.bulk_insert_expenditures(transactions(ROWS), db=db)
+
+    assert (first["rows"], first["skipped"]) == (3, 0)
+    assert (again["rows"], again["skipped"]) == (0, 3)
+    assert count(db, user_id) == 3
+
+
+def test_overlapping_statement_only_inserts_new_transactions(db, user_id):
+    database.bulk_insert_expenditures(transactions(ROWS[:2]), db=db)
+
+    result = database.bulk_insert_expenditures(transactions(ROWS), db=db)
+
+    assert (result["rows"], result["skipped"]) == (1, 2)
+
+
+def test_manual_transactions_have_no_fingerprint_and_are_always_inserted(db, user_id):
+    manual = utils.add_expenditure(date=datetime.date(2023, 1, 2), category="Food", amount=10, user_id=user_id, text="ICA")
+
+    database.bulk_insert_expenditures(manual, db=db)
+    database.bulk_insert_expenditures(manual, db=db)
+
+    assert count(db, user_id) == 2
+
+
+def test_get_fingerprints_within_date_range(db, user_id):
+    frame = transactions(ROWS)
+    database.bulk_insert_expenditures(frame, db=db)
+
+    fingerprints = database.get_fingerprints(user_id=user_id, start=datetime.datetime(2023, 1, 2), end=datetime.datetime(2023, 1, 3), db=db)
+
+    assert fingerprints == set(frame["fingerprint"].iloc[:2])
+
+
+def test_monthly_rollups_follow_the_inserts(db, user_id):
+    database.bulk_insert_expenditures(transactions(ROWS), db=db)
+
+    rollups = database.get_monthly_rollups(user_id=user_id, start_month=datetime.datetime(2023, 1, 1), db=db)
+    food = rollups[rollups["Kategori"] == "Food"].iloc[0]
+
+    assert food["Belopp"] == -25.0
+    assert food["Occurances"] == 2
+    assert food["Saldo"] == 975.0
+    assert pd.Timestamp(food["last_date"]) == pd.Timestamp("2023-01-02")
+
+
+def test_monthly_rollups_date_the_balance_they_report(db, user_id):
+    #The latest transaction of the month has no balance, so the balance and its date come from the one before.
+    database.bulk_insert_expenditures(transactions(ROWS[:2] + [("2023-01-05", "ICA NARA", -5.0, None, "Food")]), db=db)
+
+    rollups = database.get_monthly_rollups(user_id=user_id, start_month=datetime.datetime(2023, 1, 1), db=db)
+    food = rollups[rollups["Kategori"] == "Food"].iloc[0]
+
+    assert food["Saldo"] == 975.0
+    assert pd.Timestamp(food["last_date"]) == pd.Timestamp("2023-01-02")
+
+
+def test_with_session_finds_a_session_passed_positionally():
+    @database.with_session
+    def session_of(user_id, db=None):
+        return db
+
+    assert session_of(1, "session") == "session"
+    assert isinstance(session_of(1), database.Session)
+
+
+def test_pool_metrics_only_count_handed_out_connections(tmp_path):
+    db = create_engine(f"sqlite:///{tmp_path}/pool.db", poolclass=database.MeteredQueuePool, pool_size=1, max_overflow=0, pool_timeout=0.1)
+
+    with db.connect():
+        with pytest.raises(exc.TimeoutError):
+            db.connect()
+
+    #The metrics are kept when the pool is recreated.
+    db.dispose()
+    with db.connect():
+        pass
+
+    metrics = database.pool_metrics(db)
+    assert (metrics["checkouts"], metrics["timeouts"], metrics["max_checked_out"]) == (2, 1, 1)
+
+
+def test_category_summary_sums_the_texts_of_the_category(db, user_id):
+    database.bulk_insert_expenditures(transactions(ROWS), db=db)
+
+    summary = database.get_category_summary(user_id=user_id, start_month=datetime.datetime(2023, 1, 1), category="Food", db=db)
+
+    assert summary.to_dict(orient="index") == {"ICA NARA": {"Amount": -25.0, "Occurance": 2}}
+
+
+def cash_data_of_every_backend(db, user_id: int, monkeypatch) -> tuple:
+    database.bulk_insert_expenditures(transactions(ROWS), db=db)
+    database.bulk_insert_expenditures(utils.add_expenditure(date=datetime.date(2023, 1, 4), category="Food", amount=10,
+                                                            user_id=user_id, text="ICA"), db=db)
+    start_month = datetime.datetime(2023, 1, 1)
+
+    default = database.get_cash_data(user_id=user_id, start_month=start_month, db=db)
+
+    query_cache.clear()
+    monkeypatch.setattr(database, "FETCH_BACKEND", "arrow")
+    arrow = database.get_cash_data(user_id=user_id, start_month=start_month, db=db)
+
+    return default, arrow
+
+
+def test_arrow_backend_returns_the_same_cash_data(db, user_id, monkeypatch):
+    pytest.importorskip("adbc_driver_sqlite")
+
+    #Records whether the reads got an ADBC connection.
+    adbc_connection, connections = database._adbc_connection, []
+
+    @contextmanager
+    def recorded(engine):
+        with adbc_connection(engine) as connection:
+            connections.append(connection is not None)
+            yield connection
+
+    monkeypatch.setattr(database, "_adbc_connection", recorded)
+
+    default, arrow = cash_data_of_every_backend(db, user_id, monkeypatch)
+
+    assert connections == [True]
+    pd.testing.assert_frame_equal(arrow, default)
+
+
+def test_arrow_backend_falls_back_to_pandas_without_driver(db, user_id, monkeypatch):
+    monkeypatch.setattr(database, "_adbc_driver", lambda url: None)
+    monkeypatch.setattr(database, "_adbc_pools", {})
+
+    default, arrow = cash_data_of_every_backend(db, user_id, monkeypatch)
+
+    pd.testing.assert_frame_equal(arrow, default)
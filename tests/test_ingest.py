@@ -0,0 +1,109 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import text
+import pandas as pd
+import time
+import database
+import ingest
+from conftest import transactions
+
+
+JANUARY = [("2023-01-02", "ICA NARA", -12.5, 987.5, "Food"),
+           ("2023-01-03", "COOP", -20.0, 967.5, "Food")]
+
+FEBRUARY = [("2023-02-01", "SHELL", -500.0, 467.5, "Other")]
+
+
+def test_merge_counts_duplicates_between_the_files_of_a_batch(db, user_id):
+    frames = {1: transactions(JANUARY), 2: transactions(JANUARY + FEBRUARY)}
+
+    merged, summary = ingest.merge_statements(frames, user_id=user_id, db=db)
+
+    assert merged["Text"].tolist() == ["ICA NARA", "COOP", "SHELL"]
+    assert summary == {1: {"rows": 2, "duplicates": 0, "skipped": 0},
+                       2: {"rows": 1, "duplicates": 2, "skipped": 0}}
+
+
+def test_merge_skips_transactions_already_uploaded(db, user_id):
+    database.bulk_insert_expenditures(transactions(JANUARY), db=db)
+
+    merged, summary = ingest.merge_statements({3: transactions(JANUARY + FEBRUARY)}, user_id=user_id, db=db)
+
+    assert merged["Text"].tolist() == ["SHELL"]
+    assert summary == {3: {"rows": 1, "duplicates": 0, "skipped": 2}}
+
+
+def test_merge_of_empty_statements(db, user_id):
+    empty = transactions([])
+
+    merged, summary = ingest.merge_statements({4: empty, 5: empty}, user_id=user_id, db=db)
+
+    assert len(merged) == 0
+    assert summary == {4: {"rows": 0, "duplicates": 0, "skipped": 0}, 5: {"rows": 0, "duplicates": 0, "skipped": 0}}
+
+
+def test_claim_batch_skips_running_batches_with_a_recent_heartbeat(db, user_id):
+    batch = ingest.submit_batch([("a.xls", b""), ("b.xls", b"")], user_id=user_id, db=db)
+    later = ingest.submit_batch([("c.xls", b"")], user_id=user_id, db=db)
+
+    assert ingest.claim_batch(db=db) == batch
+    assert ingest.claim_batch(db=db) == later
+    assert ingest.claim_batch(db=db) == []
+
+
+def test_claim_batch_takes_over_batches_without_heartbeat(db, user_id):
+    batch = ingest.submit_batch([("a.xls", b""), ("b.xls", b"")], user_id=user_id, db=db)
+    ingest.claim_batch(db=db)
+
+    with db.begin() as db_connection:
+        db_connection.execute(text("UPDATE ingest_jobs SET started_at = :old, heartbeat_at = :old"),
+                              {"old": datetime.now() - timedelta(seconds=ingest.STALE_SECONDS + 1)})
+
+    assert ingest.claim_batch(db=db) == batch
+
+
+def test_claim_batch_skips_batches_with_one_recent_heartbeat(db, user_id):
+    batch = ingest.submit_batch([("a.xls", b""), ("b.xls", b"")], user_id=user_id, db=db)
+    ingest.claim_batch(db=db)
+
+    with db.begin() as db_connection:
+        db_connection.execute(text("UPDATE ingest_jobs SET started_at = :old, heartbeat_at = :old"),
+                              {"old": datetime.now() - timedelta(seconds=ingest.STALE_SECONDS + 1)})
+
+    #A heartbeat of one job shows that the worker is alive, so none of the jobs of the batch is taken over.
+    ingest._update_job(batch[1], db, progress=0.5)
+    assert ingest.claim_batch(db=db) == []
+
+
+def test_heartbeats_are_sent_for_every_job_until_the_batch_is_stored(db, user_id, monkeypatch):
+    batch = ingest.submit_batch([("a.xls", b""), ("b.xls", b"")], user_id=user_id, db=db)
+    ingest.claim_batch(db=db)
+    old = datetime.now() - timedelta(seconds=ingest.STALE_SECONDS + 1)
+
+    with db.begin() as db_connection:
+        db_connection.execute(text("UPDATE ingest_jobs SET started_at = :old, heartbeat_at = :old"), {"old": old})
+
+    monkeypatch.setattr(ingest, "HEARTBEAT_SECONDS", 0.01)
+    with ingest._heartbeats(batch, db):
+        time.sleep(0.1)
+
+    with db.connect() as db_connection:
+        heartbeats = db_connection.execute(text("SELECT heartbeat_at FROM ingest_jobs")).scalars().all()
+
+    assert len(heartbeats) == 2 and all(pd.Timestamp(heartbeat) > pd.Timestamp(old) for heartbeat in heartbeats)
+
+
+def test_unreadable_file_fails_its_job(db, user_id):
+    job_ids = ingest.submit_batch([("garbage.xls", b"garbage")], user_id=user_id, db=db)
+    ingest.claim_batch(db=db)
+
+    result = ingest.run_batch(job_ids, ThreadPoolExecutor(max_workers=1), db=db)
+
+    job = ingest.get_jobs(user_id=user_id, db=db).iloc[0]
+    assert result["status"] == ingest.FAILED
+    assert job["status"] == ingest.FAILED and "transaction table" in job["error"]
+
+
+    #The uploaded statement is not kept for a failed job either.
+    with db.connect() as db_connection:
+        assert db_connection.execute(text("SELECT content FROM ingest_jobs")).scalar() is None
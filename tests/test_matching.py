@@ -0,0 +1,70 @@
+import pandas as pd
+from utils.matching import LITERAL, REGEX, CategoryMatcher, compile_rules, rule_type
+
+
+def test_literal_rules_win_over_regex_rules():
+    matcher = CategoryMatcher([("Regex", "re:ica"), ("Literal", "ica")])
+
+    assert matcher.match("ICA NARA") == "Literal"
+
+
+def test_longest_literal_wins():
+    matcher = CategoryMatcher([("Short", "ica"), ("Long", "ica maxi")])
+
+    assert matcher.match("ICA MAXI LINKOPING") == "Long"
+    assert matcher.match("ICA NARA") == "Short"
+
+
+def test_earliest_rule_wins_between_equal_rules():
+    assert CategoryMatcher([("First", "coop"), ("Second", "coop")]).match("COOP") == "First"
+    assert CategoryMatcher([("First", "re:co+p"), ("Second", "re:coop")]).match("COOP") == "First"
+
+
+def test_earliest_regex_wins_over_leftmost_match():
+    matcher = CategoryMatcher([("Later in text", "re:nara"), ("Earlier in text", "re:ica")])
+
+    assert matcher.match("ICA NARA") == "Later in text"
+
+
+def test_matching_is_case_insensitive():
+    matcher = CategoryMatcher([("Food", "Åhléns"), ("Fuel", "re:^shell")])
+
+    assert matcher.match("ÅHLÉNS CITY") == "Food"
+    assert matcher.match("SHELL E4") == "Fuel"
+    assert matcher.match("OKQ8") is None
+
+
+def test_texts_without_prefix_are_literals():
+    matcher = CategoryMatcher([("Food", "ica|coop")])
+
+    assert matcher.match("ICA") is None
+    assert matcher.match("ICA|COOP") == "Food"
+
+
+def test_rules_that_do_not_compile_are_literals():
+    assert rule_type("re:[") == LITERAL
+    assert rule_type("re:a{2,1}") == LITERAL
+    assert rule_type("re:ica") == REGEX
+
+    matcher = CategoryMatcher([("Broken", "re:["), ("Food", "ica")])
+
+    assert matcher.match("ICA") == "Food"
+    assert matcher.match("PRICE RE:[1]") == "Broken"
+
+
+def test_patterns_that_only_compile_on_their_own():
+    #Backreferences and named groups broke the combined pattern the regex rules were once joined into.
+    matcher = compile_rules((("Rent", r"re:(hyra)\1"), ("Named", "re:(?P<r0>bank)"), ("Food", "re:ica")))
+
+    assert matcher.match("HYRAHYRA") == "Rent"
+    assert matcher.match("BANKGIRO") == "Named"
+    assert matcher.match("ICA") == "Food"
+
+
+def test_categorize_keeps_the_index_and_returns_empty_strings():
+    texts = pd.Series(["ICA NARA", None, "OKQ8", "ICA NARA"], index=[10, 11, 12, 13])
+
+    categories = CategoryMatcher([("Food", "ica")]).categorize(texts)
+
+    assert categories.tolist() == ["Food", "", "", "Food"]
+    assert categories.index.tolist() == [10, 11, 12, 13]
@@ -0,0 +1,87 @@
+import io
+import pandas as pd
+import pytest
+from sqlalchemy import text
+import database
+import migrations
+from utils.parsing import fingerprint_transactions, parse_statement, read_statement_chunks
+from conftest import statement
+
+
+def legacy(rows) -> pd.DataFrame:
+    #Stored (Belopp, Saldo) pairs, in the order they were uploaded.
+    return pd.DataFrame(rows, columns=["Belopp", "Saldo"])
+
+
+def test_whole_balances_below_1000_were_stored_100_times_too_large():
+    saldo, settled = migrations.legacy_balances(legacy([(-10.0, 98750.0), (-5.0, 450.0)]))
+
+    assert saldo[1] == 4.5 and settled[1]
+
+
+@pytest.mark.parametrize("stored", [1234.5, 150000.0, -250000.0])
+def test_balances_with_decimals_or_of_100000_or_more_were_stored_correctly(stored):
+    saldo, settled = migrations.legacy_balances(legacy([(-10.0, stored)]))
+
+    assert saldo.tolist() == [stored] and settled.tolist() == [True]
+
+
+#The real balances are 1 500,00, 1 000,00 and 4,50 kr. The first two are whole and from 1 000 to 100 000,
+#so they can also be read as 15,00 and 10,00 kr, while 4,50 kr was stored as 450.
+OLDEST_FIRST = [(-200.0, 1500.0), (-500.0, 1000.0), (-995.5, 450.0)]
+
+
+def test_ambiguous_balances_are_settled_by_their_neighbours_oldest_first():
+    saldo, settled = migrations.legacy_balances(legacy(OLDEST_FIRST))
+
+    assert saldo.tolist() == [1500.0, 1000.0, 4.5]
+    assert settled.all()
+
+
+def test_ambiguous_balances_are_settled_by_their_neighbours_newest_first():
+    #A newest-first statement has the amount of a transaction leading to its own balance from the one after it.
+    newest_first = [(-995.5, 450.0), (-500.0, 1000.0), (-200.0, 1500.0), (-300.0, 1700.0)]
+
+    saldo, settled = migrations.legacy_balances(legacy(newest_first))
+
+    assert saldo.tolist() == [4.5, 1000.0, 1500.0, 1700.0]
+    assert settled.all()
+
+
+def test_balances_that_can_not_be_settled_are_kept_as_stored():
+    saldo, settled = migrations.legacy_balances(legacy([(-3.0, 5000.0)]))
+
+    assert saldo.tolist() == [5000.0]
+    assert settled.tolist() == [False]
+
+
+def read_html_upload(content: bytes, user_id: int) -> pd.DataFrame:
+    #The transactions the way read_statement stored them before utils.parsing existed.
+    frame = pd.read_html(io.BytesIO(content))[3]
+    frame = frame.iloc[1:].set_axis(frame.iloc[0].tolist(), axis=1)
+
+    frame["Belopp"] = frame["Belopp"].apply(lambda x: int(x) / 100 if (" " not in x) else x.replace(",", ".").replace(" ", "")).astype(float)
+    frame["Saldo"] = frame["Saldo"].str.replace(" ", "").str.replace(",", ".").astype(float)
+
+    return pd.DataFrame({"Transaktionsdatum": pd.to_datetime(frame["Transaktionsdatum"]), "Text": frame["Text"],
+                         "Belopp": frame["Belopp"], "Saldo": frame["Saldo"],
+                         "Typ": ["Kostnad" if amount < 0 else "Inkomst" for amount in frame["Belopp"]],
+                         "Kategori": "Other", "user_id": user_id})
+
+
+def test_backfilled_fingerprints_match_those_of_a_new_upload(db, user_id):
+    content = statement([["2023-01-02", "2023-01-02", "Kortköp  ICA\n NARA", "-200,00", "1 500,00"],
+                         ["2023-01-03", "2023-01-03", "COOP", "-500,00", "1 000,00"],
+                         ["2023-01-04", "2023-01-04", "SHELL", "-995,50", "4,50"],
+                         ["2023-01-04", "2023-01-04", "SHELL", "-995,50", "4,50"],
+                         ["2023-01-05", "2023-01-05", "LÖN", "25 000,00", "25 004,50"]])
+    database.bulk_insert_expenditures(read_html_upload(content, user_id), db=db)
+
+    migrations.backfill_fingerprints(db=db)
+
+    parsed, _ = parse_statement(next(read_statement_chunks(io.BytesIO(content))), header_row=False)
+    with db.connect() as db_connection:
+        stored = pd.read_sql(text('SELECT "Saldo", fingerprint FROM expenditures ORDER BY expenditure_id'), db_connection)
+
+    assert stored["Saldo"].tolist() == parsed["Saldo"].tolist()
+    assert stored["fingerprint"].tolist() == fingerprint_transactions(parsed).tolist()
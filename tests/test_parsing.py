@@ -0,0 +1,80 @@
+import io
+import pandas as pd
+import pytest
+from utils.parsing import fingerprint_transactions, parse_amount, parse_statement, read_statement_chunks
+from conftest import HEADER, statement
+
+
+@pytest.mark.parametrize("raw, amount", [
+    ("123,45", 123.45),
+    ("-1 234,56", -1234.56),
+    ("1\xa0234,56", 1234.56),
+    ("12345", 123.45),
+    ("-12345", -123.45),
+])
+def test_parse_amount(raw, amount):
+    assert parse_amount(pd.Series([raw])).iloc[0] == pytest.approx(amount)
+
+
+def test_parse_amount_gives_nan_for_what_is_not_an_amount():
+    assert parse_amount(pd.Series(["abc", ""])).isna().all()
+
+
+def test_parse_statement_rejects_rows_without_date_or_amount():
+    frame = pd.DataFrame([HEADER,
+                          ["2023-01-02", "2023-01-02", " ICA NARA ", "-12,50", "987,50"],
+                          ["2023-01-03", "not a date", "COOP", "-10,00", "977,50"],
+                          ["2023-01-04", "2023-01-04", "SHELL", "abc", "977,50"],
+                          ["2023-01-05", "2023-01-05", "LON", "25 000,00", None]])
+
+    parsed, rejected = parse_statement(frame)
+
+    assert parsed["Text"].tolist() == ["ICA NARA", "LON"]
+    assert parsed["Belopp"].tolist() == [-12.5, 25000.0]
+    assert parsed["Saldo"].iloc[0] == 987.5 and pd.isna(parsed["Saldo"].iloc[1])
+    assert rejected["Text"].tolist() == ["COOP", "SHELL"]
+
+
+def test_read_statement_chunks_streams_the_transaction_table():
+    rows = [[f"2023-01-{day:02d}", f"2023-01-{day:02d}", f"SHOP {day}", "-1,00", f"{100 - day},00"] for day in range(1, 6)]
+
+    chunks = list(read_statement_chunks(io.BytesIO(statement(rows)), chunk_size=2))
+
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert chunks[0].columns.tolist() == HEADER
+    assert pd.concat(chunks)["Text"].tolist() == [f"SHOP {day}" for day in range(1, 6)]
+
+
+def test_read_statement_chunks_reads_the_cells_like_read_html():
+    rows = [["2023-01-02", "2023-01-02", "Kortköp  ICA\n NARA", "-12,50", "987,50"],
+            ["2023-01-03", "2023-01-03", " Lön\r\n\tmars ", "25 000,00", "25 987,50"],
+            ["2023-01-04", "2023-01-04", "SHELL\tE4", "-1\xa0234,56", "24 752,94"]]
+    content = statement(rows)
+
+    chunk = next(read_statement_chunks(io.BytesIO(content)))
+    table = pd.read_html(io.BytesIO(content))[3]
+
+    #Texts stored from read_html, and the fingerprints computed from them, have to match those of new uploads.
+    assert chunk["Text"].tolist() == table[2].iloc[1:].tolist()
+    assert not chunk["Text"].str.contains("[\r\n]").any()
+    assert chunk["Transaktionsdatum"].tolist() == table[1].iloc[1:].tolist()
+
+
+def test_fingerprints_tell_identical_transactions_apart():
+    frame = pd.DataFrame({"Transaktionsdatum": pd.to_datetime(["2023-01-02"] * 3), "Text": ["ICA", "ICA", "COOP"],
+                          "Belopp": [-10.0, -10.0, -10.0], "Saldo": [None, None, None]})
+
+    fingerprints = fingerprint_transactions(frame)
+
+    assert fingerprints.nunique() == 3
+    #The same transactions in an overlapping statement get the same fingerprints.
+    assert fingerprints.tolist()[:2] == fingerprint_transactions(frame.iloc[:2]).tolist()
+
+
+def test_read_statement_chunks_rejects_files_without_transaction_table():
+    with pytest.raises(ValueError):
+        list(read_statement_chunks(io.BytesIO(b"garbage")))
+
+
+def test_read_statement_chunks_of_a_statement_without_transactions():
+    assert list(read_statement_chunks(io.BytesIO(statement([])))) == []
@@ -0,0 +1,120 @@
+import datetime
+from sqlalchemy import text
+import pandas as pd
+import database
+import query_cache
+import utils
+from query_cache import cached_query
+from conftest import transactions
+
+
+calls = []
+
+
+@cached_query
+def read_data(user_id: int, value: int, db=None) -> pd.DataFrame:
+    calls.append(("data", user_id, value))
+    return pd.DataFrame({"value": [value]})
+
+
+@cached_query(version="categories")
+def read_categories(user_id: int, db=None) -> list:
+    calls.append(("categories", user_id))
+    return ["Food"]
+
+
+def test_results_are_cached_per_user_and_arguments(user_id):
+    calls.clear()
+
+    read_data(user_id, 1)
+    read_data(user_id, 1)
+    read_data(user_id, 2)
+    read_data(user_id + 1, 1)
+
+    assert calls == [("data", user_id, 1), ("data", user_id, 2), ("data", user_id + 1, 1)]
+
+
+def test_callers_can_modify_what_they_get(user_id):
+    read_data(user_id, 1)["value"] = 100
+
+    assert read_data(user_id, 1)["value"].tolist() == [1]
+
+
+def test_callers_can_modify_the_analytics(db, user_id):
+    database.bulk_insert_expenditures(transactions([("2023-01-02", "ICA", -10.0, 990.0, "Food")]), db=db)
+    start_month = datetime.datetime(2023, 1, 1)
+
+    analytics = utils.get_analytics(user_id=user_id, start_month=start_month, db=db)
+    analytics.monthly_net[:] = 0
+    analytics.cost_categories.clear()
+
+    cached = utils.get_analytics(user_id=user_id, start_month=start_month, db=db)
+    assert cached.monthly_net.tolist() == [-10.0]
+    assert cached.cost_categories == ["Food"]
+
+
+def test_bumping_the_data_version_invalidates_the_user(user_id):
+    read_data(user_id, 1)
+    read_data(user_id + 1, 1)
+    calls.clear()
+
+    query_cache.bump_data_version(user_id)
+    read_data(user_id, 1)
+    read_data(user_id + 1, 1)
+
+    assert calls == [("data", user_id, 1)]
+
+
+def test_data_and_category_versions_are_independent(user_id):
+    read_data(user_id, 1)
+    read_categories(user_id)
+    calls.clear()
+
+    query_cache.bump_data_version(user_id)
+    read_categories(user_id)
+    assert calls == []
+
+    query_cache.bump_category_version(user_id)
+    read_categories(user_id)
+    read_data(user_id, 1)
+    assert calls == [("categories", user_id), ("data", user_id, 1)]
+
+
+def test_clear_only_empties_the_given_kind(user_id):
+    read_data(user_id, 1)
+    read_categories(user_id)
+    calls.clear()
+
+    query_cache.clear("categories")
+    read_data(user_id, 1)
+    read_categories(user_id)
+
+    assert calls == [("categories", user_id)]
+
+
+def test_writes_of_other_processes_invalidate_the_cache(db, user_id, monkeypatch):
+    monkeypatch.setattr(query_cache, "VERSION_TTL", 0)
+    read_data(user_id, 1)
+    calls.clear()
+
+    #Another process, e.g. the ingest worker, bumps the shared version of the user.
+    with db.begin() as db_connection:
+        db_connection.execute(text("INSERT INTO cache_versions (user_id, data, categories) VALUES (:user_id, 100, 0)"),
+                              {"user_id": user_id})
+
+    read_data(user_id, 1)
+    read_data(user_id, 1)
+
+    assert calls == [("data", user_id, 1)]
+
+
+def test_bumps_are_shared_with_other_processes(db, user_id):
+    query_cache.bump_data_version(user_id)
+    query_cache.bump_data_version(user_id)
+    query_cache.bump_category_version(user_id)
+
+    with db.connect() as db_connection:
+        versions = db_connection.execute(text("SELECT data, categories FROM cache_versions WHERE user_id = :user_id"),
+                                         {"user_id": user_id}).one()
+
+    assert tuple(versions) == (2, 1)
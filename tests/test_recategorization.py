@@ -0,0 +1,73 @@
+import datetime
+import pandas as pd
+from sqlalchemy import text
+import database
+import utils
+from utils import recategorize_expenditures
+from conftest import add_categories, transactions
+
+
+ROWS = [("2023-01-02", "ICA SHELL", -10.0, 990.0, "Food"),
+        ("2023-01-03", "COOP", -20.0, 970.0, "Food"),
+        ("2023-01-04", "SHELL E4", -500.0, 470.0, "Other"),
+        ("2023-01-05", "OKQ8", -300.0, 170.0, "Other")]
+
+
+def categories(db, user_id: int) -> dict:
+    with db.connect() as db_connection:
+        rows = db_connection.execute(text('SELECT "Text", "Kategori" FROM expenditures WHERE user_id = :user_id'), {"user_id": user_id})
+        return dict(rows.all())
+
+
+def test_only_uncategorized_and_edited_categories_are_matched(db, user_id):
+    add_categories(db, user_id, [("Food", "ica"), ("Food", "coop"), ("Fuel", "shell")])
+    database.bulk_insert_expenditures(transactions(ROWS), db=db)
+
+    result = recategorize_expenditures(user_id=user_id, db=db, categories=["Fuel"])
+
+    #'ICA SHELL' stays in Food, although the longer text 'shell' of Fuel matches it too.
+    assert categories(db, user_id) == {"ICA SHELL": "Food", "COOP": "Food", "SHELL E4": "Fuel", "OKQ8": "Other"}
+    assert (result["rows"], result["updated"]) == (2, 1)
+
+
+def test_full_recategorization_matches_every_uploaded_cost(db, user_id):
+    add_categories(db, user_id, [("Food", "ica"), ("Fuel", "shell")])
+    database.bulk_insert_expenditures(transactions(ROWS), db=db)
+
+    result = recategorize_expenditures(user_id=user_id, db=db, full=True)
+
+    #Literal rules are prioritized by length, so 'shell' wins over 'ica', and COOP no longer matches any rule.
+    assert categories(db, user_id) == {"ICA SHELL": "Fuel", "COOP": "Other", "SHELL E4": "Fuel", "OKQ8": "Other"}
+    assert (result["rows"], result["updated"]) == (4, 3)
+
+
+def test_earliest_regex_rule_wins(db, user_id):
+    add_categories(db, user_id, [("Fuel", "re:e4$"), ("Cars", "re:^shell")])
+    database.bulk_insert_expenditures(transactions(ROWS), db=db)
+
+    recategorize_expenditures(user_id=user_id, db=db)
+
+    assert categories(db, user_id)["SHELL E4"] == "Fuel"
+
+
+def test_manual_expenditures_keep_their_category(db, user_id):
+    add_categories(db, user_id, [("Fuel", "shell")])
+    manual = utils.add_expenditure(date=datetime.date(2023, 1, 6), category="Other", amount=100, user_id=user_id, text="SHELL")
+    database.bulk_insert_expenditures(manual, db=db)
+
+    recategorize_expenditures(user_id=user_id, db=db, full=True)
+
+    assert categories(db, user_id) == {"SHELL": "Other"}
+
+
+def test_recategorization_refreshes_the_rollups(db, user_id):
+    add_categories(db, user_id, [("Fuel", "shell")])
+    database.bulk_insert_expenditures(transactions(ROWS), db=db)
+
+    recategorize_expenditures(user_id=user_id, db=db, batch_size=1)
+
+    rollups = database.get_monthly_rollups(user_id=user_id, start_month=datetime.datetime(2023, 1, 1), db=db)
+    fuel = rollups[rollups["Kategori"] == "Fuel"]
+
+    assert fuel["Belopp"].tolist() == [-500.0]
+    assert pd.Timestamp(fuel["last_date"].iloc[0]) == pd.Timestamp("2023-01-04")
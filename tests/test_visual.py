@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+from utils.analytics import AnalyticsFrame
+from utils.visual import WEBGL_THRESHOLD, _downsample, line_plot, lttb
+
+
+def line(points: int) -> tuple:
+    #A noisy line over evenly spaced x-values.
+    generator = np.random.default_rng(0)
+    return np.arange(points, dtype="float64"), generator.normal(size=points).cumsum()
+
+
+def rollups(categories: int, months: int) -> pd.DataFrame:
+    #Monthly costs in every category for every month.
+    month = np.repeat(pd.date_range("1990-01-01", periods=months, freq="MS"), categories)
+    return pd.DataFrame({"month": month, "Kategori": [f"Category {index}" for index in range(categories)] * months,
+                         "Typ": "Kostnad", "Belopp": -100.0, "Occurances": 1, "Saldo": np.nan, "last_date": month})
+
+
+def test_lttb_keeps_the_first_and_the_last_point():
+    x, y = line(1000)
+
+    kept = lttb(x, y, 50)
+
+    assert kept[0] == 0 and kept[-1] == 999
+
+
+def test_lttb_keeps_the_threshold_amount_of_points_in_order():
+    x, y = line(1000)
+
+    kept = lttb(x, y, 50)
+
+    assert len(kept) == 50
+    assert (np.diff(kept) > 0).all()
+
+
+def test_lttb_returns_lines_under_the_threshold_unchanged():
+    x, y = line(30)
+
+    assert lttb(x, y, 50).tolist() == list(range(30))
+
+
+def test_downsample_keeps_the_rows_of_the_kept_points():
+    x, y = line(500)
+    df = pd.DataFrame({"Transaktionsdatum": pd.date_range("1990-01-01", periods=500, freq="D"), "Saldo": y})
+
+    downsampled = _downsample(df, "Saldo", 100)
+
+    assert len(downsampled) == 100
+    assert downsampled.iloc[[0, -1]].equals(df.iloc[[0, -1]])
+
+
+def test_line_plot_draws_with_webgl_above_the_threshold():
+    #6 lines of 200 months are 1 200 points without the high volume mode.
+    many = line_plot(AnalyticsFrame(rollups(6, 200)), [f"Category {index}" for index in range(6)], high_volume=False)
+    few = line_plot(AnalyticsFrame(rollups(2, 200)), ["Category 0", "Category 1"], high_volume=False)
+
+    assert 6 * 200 > WEBGL_THRESHOLD
+    assert {trace.type for trace in many.data} == {"scattergl"}
+    assert {trace.type for trace in few.data} == {"scatter"}
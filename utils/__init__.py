@@ -1,3 +1,34 @@
-from utils.visual import line_plot, bar_plot, horizontal_barplot, monthly_balance
-from utils.manipulation import categorization, add_expenditure, add_income, add_category, update_category,categories_dict, delete_category
-from utils.auth import register_user, login
\ No newline at end of file
+import importlib
+
+#The functions of the package by the module defining them. A module is imported the first time one of its functions
+#is used, so every page only imports what it uses, e.g. plotly is only imported by the Visualization page.
+_EXPORTS = {
+    "utils.visual": ["line_plot", "bar_plot", "horizontal_barplot", "monthly_balance"],
+    "utils.analytics": ["AnalyticsFrame", "build_analytics", "get_analytics"],
+    "utils.charts": ["get_chart"],
+    "utils.catalog": ["CategoryCatalog", "get_category_catalog"],
+    "utils.manipulation": ["categorization", "add_expenditure", "add_income", "add_category", "update_category", "categories_dict",
+                           "delete_category", "recategorize_all", "category_rules", "read_statement"],
+    "utils.parsing": ["parse_statement", "read_statement_chunks", "fingerprint_transactions"],
+    "utils.recategorization": ["recategorize_expenditures"],
+    "utils.auth": ["register_user", "login"],
+}
+
+_MODULES = {name: module for module, names in _EXPORTS.items() for name in names}
+
+__all__ = list(_MODULES)
+
+
+def __getattr__(name: str):
+    if name not in _MODULES:
+        raise AttributeError(f"module 'utils' has no attribute '{name}'")
+
+    #Stored on the package, so later lookups do not go through this function.
+    value = getattr(importlib.import_module(_MODULES[name]), name)
+    globals()[name] = value
+
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_MODULES))
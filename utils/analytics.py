@@ -0,0 +1,123 @@
+"""Module preparing the monthly views shared by all the visualization tools"""
+import pandas as pd
+import copy
+from datetime import datetime
+from typing import List
+from database import engine, get_monthly_rollups
+from query_cache import cached_query
+from instrumentation import instrumented
+
+
+class AnalyticsFrame:
+    """
+    The monthly views of a user's transactions, computed in one pass over the monthly rollups.
+    All the functions in utils.visual take this object, so the charts on a page share the same grouping work.
+    Months are pandas Periods and every monthly view covers all months in the range, including months without transactions.
+
+    --------
+    Parameters
+    rollups: pandas.DataFrame
+        Containing monthly rollups from database.get_monthly_rollups
+
+    --------
+    Attributes
+    rollups: pandas.DataFrame
+        The rollups with an added monthly 'period' column.
+    months: pandas.PeriodIndex
+        Every month from the first to the last month in the rollups.
+    monthly_net: pandas.Series
+        Income minus costs per month. 0 for months without transactions.
+    monthly_balance: pandas.Series
+        The balance of the latest transaction per month. NaN for months without a balance.
+    category_costs: pandas.DataFrame
+        The summed costs (as negative amounts) per month (rows) and category (columns).
+    cost_categories: list of str
+        The categories that have costs, ordered by their total cost.
+    """
+
+    def __init__(self, rollups: pd.DataFrame) -> None:
+        rollups = rollups.copy()
+        rollups["period"] = pd.PeriodIndex(pd.to_datetime(rollups["month"]), freq="M")
+        self.rollups = rollups
+
+        if len(rollups):
+            self.months = pd.period_range(rollups["period"].min(), rollups["period"].max(), freq="M")
+        else:
+            self.months = pd.PeriodIndex([], freq="M")
+
+        self.monthly_net = rollups.groupby("period")["Belopp"].sum().reindex(self.months, fill_value=0)
+
+        #The balance of a month is the balance of the rollup group with the latest transaction in it.
+        balances = rollups.dropna(subset=["Saldo"]).sort_values(by="last_date")
+        self.monthly_balance = balances.groupby("period")["Saldo"].last().reindex(self.months)
+
+        costs = rollups[rollups["Typ"] == "Kostnad"]
+        self.category_costs = (costs.pivot_table(index="period", columns="Kategori", values="Belopp", aggfunc="sum")
+                                    .reindex(self.months))
+
+        self.cost_categories: List[str] = self.category_costs.sum().sort_values().index.tolist()
+
+    def copy(self) -> "AnalyticsFrame":
+        """
+        Returns a copy of the monthly views, which can be modified without changing this object.
+        """
+
+        analytics = copy.copy(self)
+        analytics.rollups = self.rollups.copy()
+        analytics.monthly_net = self.monthly_net.copy()
+        analytics.monthly_balance = self.monthly_balance.copy()
+        analytics.category_costs = self.category_costs.copy()
+        analytics.cost_categories = list(self.cost_categories)
+
+        return analytics
+
+    def month_labels(self) -> List[str]:
+        """
+        Returns the months with transactions as '%b-%Y', e.g. Mar-2023, in chronological order.
+        """
+
+        return self.rollups["period"].drop_duplicates().sort_values().dt.strftime("%b-%Y").tolist()
+
+
+@instrumented
+def build_analytics(rollups: pd.DataFrame) -> AnalyticsFrame:
+    """
+    Prepares the monthly views used by the visualization tools.
+
+    --------
+    Parameters
+    rollups: pandas.DataFrame
+        Containing monthly rollups from database.get_monthly_rollups
+
+    --------
+    Returns
+    AnalyticsFrame
+        The prepared monthly views.
+    """
+
+    return AnalyticsFrame(rollups)
+
+
+@cached_query
+def get_analytics(user_id: int, start_month: datetime, db = engine) -> AnalyticsFrame:
+    """
+    Gets the prepared monthly views for the given user from the given month and onwards.
+    Built once per data version of the user, so reruns of the page reuse the same views.
+    Every call returns a copy of the cached views, which the caller is free to modify.
+
+    --------
+    Parameters
+    user_id: int
+        int of the current user within the application
+    start_month: datetime
+        datetime formated as %Y-%m-%d
+    db: sqlalchemy.engine
+        The database for the application
+
+    --------
+    Returns
+    AnalyticsFrame
+        The prepared monthly views.
+    """
+
+    return build_analytics(get_monthly_rollups(user_id=user_id, start_month=start_month, db=db))
@@ -1,19 +1,22 @@
-from database import engine, SessionLocal
+from database import Session, with_session, connect_db
 from passlib.context import CryptContext
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple, Union
 import models
 import streamlit as st
+import os
 
-models.Base.metadata.create_all(bind=engine)
+#Cost factor of new password hashes, read from the enviroment like db_url. Every step up doubles the time of a login.
+#Existing hashes with another cost factor are rehashed the next time the user logs in.
+BCRYPT_ROUNDS = int(connect_db("bcrypt_rounds") or 12)
 
+#Maximum amount of passwords hashed or verified at the same time. bcrypt releases the GIL, so the hashing runs
+#in parallel on these threads while the amount of CPU a burst of logins can take is bounded.
+BCRYPT_WORKERS = int(connect_db("bcrypt_workers") or os.cpu_count() or 2)
 
-def get_db():
-    try:
-        db = SessionLocal()
-        yield db
-    finally: 
-        db.close()
+bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 
-bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+hashing_pool = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix="bcrypt")
 
 def encrypt_password(password: str) -> str:
     """
@@ -28,8 +31,9 @@ def encrypt_password(password: str) -> str:
     Returns
         str containing the new encrypted password
     """
-    return bcrypt_context.hash(password)
+    return hashing_pool.submit(bcrypt_context.hash, password).result()
 
+@with_session
 def register_user(
     username: str,
     password: str,
@@ -37,7 +41,7 @@ def register_user(
     first_name: str,
     last_name: str,
     e_mail: str,
-    db: SessionLocal = next(get_db())) -> None:
+    db: Session = None) -> None:
 
     """
     Takes the user provided information and sends it to the database as a registered user
@@ -56,8 +60,9 @@ def register_user(
         Containing the user's last name (provided by the user)
     e_mail: str
         Containing the user's email (provided by the user)
-    db: sqlalchemy.orm.sessionmaker
-        Session which will be commited to the database containg the user provided information
+    db: sqlalchemy.orm.Session default None
+        Session which will be commited to the database containg the user provided information.
+        A new session is created for every call if None.
     """
 
     #Validates that no entry is empty
@@ -112,9 +117,29 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     Boolean if password matches or not
     """
 
-    return bcrypt_context.verify(plain_password, hashed_password)
+    return verify_and_update_password(plain_password, hashed_password)[0]
 
-def authenticate_user(username: str , password: str, db: SessionLocal) -> dict:
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Union[str, None]]:
+    """
+    Helper function to authenticate_user()
+    Checks whether the plain text password matches the encrypted password and whether the encrypted password
+    needs to be rehashed because the cost factor (BCRYPT_ROUNDS) or the scheme has changed.
+    
+    --------
+    Parameters
+    plain_password: str
+        Plain text password
+    hashed_password: str
+        Encrypted password
+    
+    --------
+    Returns
+    Tuple of the boolean if password matches or not, and the new encrypted password if it needs to be replaced, else None
+    """
+
+    return hashing_pool.submit(bcrypt_context.verify_and_update, plain_password, hashed_password).result()
+
+def authenticate_user(username: str , password: str, db: Session) -> dict:
     """
     Helper function to login()
     Authenticates the user provided information in the login section.
@@ -125,7 +150,7 @@ def authenticate_user(username: str , password: str, db: SessionLocal) -> dict:
         Containing the username (provided by the user).
     password: str
         Containing the plain text passwword (provided by the user).
-    db: sqlalchemy.orm.sessionmaker
+    db: sqlalchemy.orm.Session
         Containing the session from which the database will be called.
     
     --------
@@ -137,13 +162,24 @@ def authenticate_user(username: str , password: str, db: SessionLocal) -> dict:
     #Checks that username exists in database.
     user = db.query(models.Users).filter(models.Users.username == username).first()
 
+    if not user:
+        return None
+
+    verified, new_hash = verify_and_update_password(password, user.hashed_password)
+
+    if not verified:
+        return None
+
+    #Rehashes the password transparently when the hashing policy has changed.
+    if new_hash:
+        user.hashed_password = new_hash
+        db.commit()
+
     #Returns the user if encrypted password matches the plain textpassword
-    if user and verify_password(password, user.hashed_password):
-        return user
-    
-    return None
+    return user
 
-def login(username: str, password: str, db: SessionLocal = next(get_db())) -> st.session_state:
+@with_session
+def login(username: str, password: str, db: Session = None) -> st.session_state:
     """
     Calls the database and validates the provided login information.
     Used to achieve statefullness within the application
@@ -154,8 +190,8 @@ def login(username: str, password: str, db: SessionLocal = next(get_db())) -> st
         Containing the username (provided by the user).
     password: str
         Containing the plain text passwword (provided by the user).
-    db: sqlalchemy.orm.sessionmaker
-        Containing the session from which the database will be called.
+    db: sqlalchemy.orm.Session default None
+        Containing the session from which the database will be called. A new session is created for every call if None.
     
     --------
     Returns
@@ -0,0 +1,74 @@
+"""Module holding the categories of a user in the forms the pages and the categorization use them in"""
+import pandas as pd
+from functools import cached_property
+from typing import Dict, List, Tuple
+from database import engine, get_user_categories
+from query_cache import cached_query
+from instrumentation import instrumented
+from utils.matching import CategoryMatcher, compile_rules
+
+
+class CategoryCatalog:
+    """
+    The categories of a user, prepared once per category version for the pages and the categorization of uploads.
+
+    --------
+    Parameters
+    categories: pandas.DataFrame
+        Containing every category and identifying text of the user, from database.get_user_categories with usage 'display'.
+
+    --------
+    Attributes
+    display: pandas.DataFrame
+        Every category and identifying text with capitalized columns, as shown to the user.
+    names: list of str
+        The names of the categories, once each, in the order they were added.
+    rules: tuple of tuple
+        Containing the (category, identifying text) pairs used for the categorization, in the order they were added.
+    texts: dict
+        Key-value pair of every category with identifying texts (key) and its identifying texts (values).
+    matcher: utils.matching.CategoryMatcher
+        The compiled rules. Compiled when first used, so a rule that can not be compiled
+        does not keep the other attributes from being shown, e.g. to delete the rule.
+    """
+
+    def __init__(self, categories: pd.DataFrame) -> None:
+        self.display = categories
+
+        self.names: List[str] = categories["Name"].drop_duplicates().tolist()
+
+        #Categories without an identifying text are not used for the categorization.
+        with_text = categories[categories["Text"].fillna("") != ""]
+        self.rules: Tuple[Tuple[str, str], ...] = tuple(zip(with_text["Name"], with_text["Text"]))
+
+        self.texts: Dict[str, List[str]] = {}
+        for name, text in self.rules:
+            self.texts.setdefault(name, []).append(text)
+
+    @cached_property
+    def matcher(self) -> CategoryMatcher:
+        return compile_rules(self.rules)
+
+
+@instrumented
+@cached_query(version="categories")
+def get_category_catalog(user_id: int, db = engine) -> CategoryCatalog:
+    """
+    Gets the prepared categories of the given user.
+    Built once per category version of the user, which add_category, update_category and delete_category bump,
+    so reruns and uploads reuse the same object. The object is shared between reruns and must not be modified.
+
+    --------
+    Parameters
+    user_id: int
+        int of the current user within the application
+    db: sqlalchemy.engine
+        The database for the application
+
+    --------
+    Returns
+    CategoryCatalog
+        The prepared categories.
+    """
+
+    return CategoryCatalog(get_user_categories(user_id=user_id, db=db, usage="display"))
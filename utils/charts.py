@@ -0,0 +1,55 @@
+"""Module building the figures of the Visualization page on demand and caching them between reruns"""
+import plotly.graph_objects as go
+from datetime import datetime
+from typing import Callable, Dict
+from database import engine, connect_db
+from query_cache import cached_query
+from instrumentation import instrumented
+from utils.analytics import get_analytics
+from utils.visual import line_plot, bar_plot, horizontal_barplot, monthly_balance
+
+
+#Maximum amount of figures held in memory. Figures are much larger than query results, which is why they have their own bound.
+CHART_CACHE_SIZE = int(connect_db("chart_cache_size") or 32)
+
+#The charts that can be built, by name. Every chart takes the prepared analytics and its own parameters.
+CHARTS: Dict[str, Callable[..., go.Figure]] = {
+    "bar_plot": bar_plot,
+    "monthly_balance": monthly_balance,
+    "horizontal_barplot": horizontal_barplot,
+    "line_plot": line_plot,
+}
+
+
+@instrumented
+@cached_query(size=CHART_CACHE_SIZE)
+def get_chart(user_id: int, start_month: datetime, chart: str, db = engine, **params) -> go.Figure:
+    """
+    Gets a figure of the Visualization page for the given user from the given month and onwards.
+    The figure is only built the first time it is requested for the user's current data version and the given parameters,
+    so changing one widget only rebuilds the figure depending on it.
+    The figure is shared between reruns and must not be modified.
+
+    --------
+    Parameters
+    user_id: int
+        int of the current user within the application
+    start_month: datetime
+        datetime formated as %Y-%m-%d
+    chart: str {'bar_plot', 'monthly_balance', 'horizontal_barplot' or 'line_plot'}
+        The name of the chart to build.
+    db: sqlalchemy.engine
+        The database for the application
+    **params
+        The parameters of the chart, e.g. selected_month for horizontal_barplot.
+
+    --------
+    Returns
+    plotly.graph_objects.Figure
+        The figure of the chart.
+    """
+
+    if chart not in CHARTS:
+        raise ValueError(f"Unknown chart: {chart}")
+
+    return CHARTS[chart](get_analytics(user_id=user_id, start_month=start_month, db=db), **params)
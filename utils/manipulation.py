@@ -1,22 +1,28 @@
 """Module for cleaning and categorizing data"""
 import pandas as pd
 import numpy as np
-import regex as re
 import streamlit as st
 import models
 import datetime
-from typing import Union, Dict, List
-from database import get_db, SessionLocal, get_user_categories
+from typing import IO, Callable, Dict, List, Optional, Tuple, Union
+from database import Session, with_session, refresh_monthly_rollups
+from utils.catalog import get_category_catalog
+from utils.recategorization import recategorize_expenditures
+from query_cache import bump_data_version, bump_category_version
+from instrumentation import instrumented
+from utils.parsing import CHUNK_SIZE, STATEMENT_DTYPES, fingerprint_transactions, parse_statement, read_statement_chunks
 
 
+@instrumented
 def categorization(frame: pd.DataFrame, user_id: int) -> pd.DataFrame:
     """
-    Cleans the data and places transactions in provided categories
+    Places the transactions of a parsed statement in the provided categories.
+    The statement is expected to be parsed by utils.parse_statement first.
 
     --------
     Parameters
     frame: pd.DataFrame
-        The provided DataFrame to clean and perform categorization on.
+        The parsed DataFrame to perform categorization on.
     user_id: int
         The user_id to retrieve the categories for.
 
@@ -26,38 +32,17 @@ def categorization(frame: pd.DataFrame, user_id: int) -> pd.DataFrame:
         Containing the transactions with it's assigned categories.
     """
 
-    #Cleans the DataFrame and puts the first entry as the column names.
-    frame.rename(columns=frame.iloc[0], inplace=True)
-    frame.drop(frame.index[0], inplace=True)
-
-    #Drops uneccessary columns
-    frame.drop(columns="Reskontradatum", inplace=True)
-    frame.dropna(axis=1, inplace=True)
-
-
-    #Data cleaning. Some values contain "," and " ". While others are incremented by 100.
-    frame["Belopp"] = (frame["Belopp"].apply(lambda x: int(x)/100 if (" " not in x)
-                        else (x.replace(",", ".").replace(" ", ""))
-                                            )
-                    )
-    frame["Saldo"] = frame["Saldo"].str.replace(" ", "").str.replace(",", ".").astype(float)
-    
-
-    #Setting the d-types for the columns
-    frame["Belopp"] = frame["Belopp"].astype(float)
-    frame["Transaktionsdatum"] = frame["Transaktionsdatum"].apply(pd.to_datetime)
+    frame = frame.copy()
 
     #Sets a new column based on whether the transaction is income or cost.
     frame["Typ"] = np.where(frame["Belopp"] > 0, "Inkomst", "Kostnad")
 
-    #Creating a dictionary containing the categories as keys.
-    categories = categories_dict(user_id=user_id)
+    #Matches all the user's identifying texts at once with the matcher compiled for the user's current categories.
+    matcher = get_category_catalog(user_id=user_id).matcher
 
-    #Sets a new column for the categorization of the transactions.
+    costs = frame["Typ"] == "Kostnad"
     frame["Kategori"] = ""
-    for key, value in categories.items():
-        frame["Kategori"] = np.where((frame["Typ"] == "Kostnad") & (frame["Text"].str.contains("|".join(value), regex=True, flags=re.IGNORECASE)),
-                            str(key), frame["Kategori"])
+    frame.loc[costs, "Kategori"] = matcher.categorize(frame.loc[costs, "Text"])
 
     #Sets the category column to "Other" if cost could not be categorized.
     frame["Kategori"] = np.where((frame["Typ"] == "Kostnad") & (frame["Kategori"] == ""), "Other", frame["Kategori"])
@@ -65,6 +50,56 @@ def categorization(frame: pd.DataFrame, user_id: int) -> pd.DataFrame:
     return frame
 
 
+@instrumented
+def read_statement(file: IO[bytes], user_id: int, chunk_size: int = CHUNK_SIZE,
+                   progress: Optional[Callable[[int], None]] = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Streams the transactions out of a statement file, parses and categorizes them chunk by chunk.
+    Only one chunk of raw rows is held in memory at a time.
+
+    --------
+    Parameters
+    file: file-like object
+        The statement file provided by the user.
+    user_id: int
+        The user_id to retrieve the categories for.
+    chunk_size: int default 5000
+        Amount of rows parsed and categorized at a time.
+    progress: Callable default None
+        Called with the amount of rows read so far after every chunk.
+
+    --------
+    Returns
+    frame: pd.DataFrame
+        Containing the parsed transactions with their assigned categories and fingerprints.
+    rejected: pd.DataFrame
+        Containing the raw rows that could not be parsed.
+    """
+
+    parsed_chunks, rejected_chunks = [], []
+
+    for chunk in read_statement_chunks(file, chunk_size=chunk_size):
+        parsed, rejected = parse_statement(chunk, header_row=False)
+
+        parsed_chunks.append(categorization(parsed, user_id=user_id))
+        rejected_chunks.append(rejected)
+
+        if progress is not None:
+            progress(sum(len(chunk) for chunk in parsed_chunks) + sum(len(chunk) for chunk in rejected_chunks))
+
+    #An empty statement still returns the expected columns.
+    if not parsed_chunks:
+        parsed_chunks = [categorization(pd.DataFrame(columns=list(STATEMENT_DTYPES)).astype(STATEMENT_DTYPES), user_id=user_id)]
+        rejected_chunks = [pd.DataFrame(columns=list(STATEMENT_DTYPES))]
+
+    frame = pd.concat(parsed_chunks, ignore_index=True)
+
+    #The fingerprints are computed over the whole statement, since identical transactions are numbered across chunks.
+    frame["fingerprint"] = fingerprint_transactions(frame)
+
+    return frame, pd.concat(rejected_chunks, ignore_index=True)
+
+
 def add_expenditure(date: datetime.datetime, category: str, amount: float, user_id: int, text: Union[str, None] = None) -> pd.DataFrame:
     """
     Creates a dataframe of the user provided data and places it in the correct columns so that it can be uploaded to the database.
@@ -129,7 +164,8 @@ def add_income(date: datetime.date, amount: float, user_id: int) -> pd.DataFrame
 
     return pd.DataFrame([data])
 
-def add_category(category_name: str, category_text: str, user_id: int, db: SessionLocal = next(get_db())) -> None:
+@with_session
+def add_category(category_name: str, category_text: str, user_id: int, db: Session = None) -> None:
     """
     Function to add category for the given user
     
@@ -141,8 +177,8 @@ def add_category(category_name: str, category_text: str, user_id: int, db: Sessi
         Is an optional parameter in the application (provided by the user)
     user_id: int
         The id of the current user
-    db: sqlalchemy.orm.sessionmaker
-        Connects to the database and sets up a session.
+    db: sqlalchemy.orm.Session default None
+        Session for the database. A new session is created for every call if None.
     """
 
     #Removes whitespace leading and trailing whitespace
@@ -168,9 +204,17 @@ def add_category(category_name: str, category_text: str, user_id: int, db: Sessi
 
     db.commit()
 
+    bump_category_version(user_id)
+    bump_data_version(user_id)
+
+    #Applies the new identifying text to the uncategorized expenditures that are already stored.
+    if category_text:
+        _recategorize(user_id=user_id, db=db, categories=[category_name])
+
     return st.success("Category was added!")
 
-def update_category(category_name: str, category_text: str, user_id: int, db: SessionLocal = next(get_db())) -> None:
+@with_session
+def update_category(category_name: str, category_text: str, user_id: int, db: Session = None) -> None:
     """
     Updates a current category with texts (in the transaction file) that can identify it.
     This is only used for users who utilize the File Upload functionality.
@@ -183,8 +227,8 @@ def update_category(category_name: str, category_text: str, user_id: int, db: Se
         The text that can identify the given category (provided by the user)
     user_id: int
         The id of the current user.
-    db: sqlalchemy.orm.sessionmaker
-        Connects to the database and sets up a session.
+    db: sqlalchemy.orm.Session default None
+        Session for the database. A new session is created for every call if None.
     """
 
     #Removes leading and trailing whitespace.
@@ -193,19 +237,6 @@ def update_category(category_name: str, category_text: str, user_id: int, db: Se
     if category_name == None:
         return st.error("You need to add a category first.")
 
-    #Checks if the current text already exists within the database for the given user.
-    existing_text = db.query(models.Expenditures).filter(models.Expenditures.user_id == user_id, models.Expenditures.Text == category_text).all()
-
-    #If the texts already exists it will update and place all the transactions (with this text) to the given category.
-    if existing_text:
-        db.query(models.Expenditures).filter(
-            models.Expenditures.user_id == user_id, models.Expenditures.Text == category_text).update(
-            {models.Expenditures.Kategori:category_name}, synchronize_session = False)
-        
-        db.commit()
-        
-        st.success(f"{len(existing_text)} expenditure(s) containing {category_text} were updated to {category_name}")
-    
     category_model = models.Categories()
 
     category_model.name = category_name
@@ -216,10 +247,18 @@ def update_category(category_name: str, category_text: str, user_id: int, db: Se
 
     db.commit()
 
+    bump_category_version(user_id)
+    bump_data_version(user_id)
+
+    #Applies the new identifying text, together with the user's other texts, to the stored expenditures
+    #that are uncategorized or within the edited category.
+    _recategorize(user_id=user_id, db=db, categories=[category_name])
+
     return st.success("Category was successfully edited")
 
 
-def delete_category(category_name: str, user_id: int, db: SessionLocal = next(get_db())) -> None:
+@with_session
+def delete_category(category_name: str, user_id: int, db: Session = None) -> None:
     """
     Firstly it changes the existing expenditures (if any) to the category 'Other' from the category that is
     being deleted for the given user.
@@ -231,8 +270,8 @@ def delete_category(category_name: str, user_id: int, db: SessionLocal = next(ge
         The category that is being deleted.
     user_id:
         The id of the current user.
-     db: sqlalchemy.orm.sessionmaker
-        Connects to the database and sets up a session.
+     db: sqlalchemy.orm.Session default None
+        Session for the database. A new session is created for every call if None.
     """
     
     #Recategorizes the expenditures currently within 'category_name' to 'Other' for the given user
@@ -250,10 +289,53 @@ def delete_category(category_name: str, user_id: int, db: SessionLocal = next(ge
     #Commits both the actions above
     db.commit()
 
+    bump_category_version(user_id)
+    bump_data_version(user_id)
+
+    #The expenditures of the deleted category, now in 'Other', are matched against the user's remaining identifying texts.
+    if not _recategorize(user_id=user_id, db=db)["updated"]:
+        refresh_monthly_rollups(user_id=user_id)
+
     st.success(f"{category_name} was successfully deleted!")
 
 
 
+@with_session
+def recategorize_all(user_id: int, db: Session = None) -> None:
+    """
+    Matches every expenditure the user uploaded from files against the user's current identifying texts again.
+    Unlike editing a category, this also moves expenditures between categories that were not edited,
+    and puts the expenditures no longer matching any text in 'Other'.
+
+    --------
+    Parameters
+    user_id: int
+        The id of the current user.
+    db: sqlalchemy.orm.Session default None
+        Session for the database. A new session is created for every call if None.
+    """
+
+    if _recategorize(user_id=user_id, db=db, full=True)["updated"]:
+        bump_data_version(user_id)
+    else:
+        st.info("All expenditures already have the category of their identifying texts")
+
+
+def _recategorize(user_id: int, db: Session, categories: List[str] = (), full: bool = False) -> Dict[str, Union[int, float]]:
+    #Recategorizes the user's stored expenditures while showing the progress, and reports how many were changed.
+    bar = st.progress(0.0)
+
+    result = recategorize_expenditures(user_id=user_id, db=db.get_bind(), categories=categories, full=full,
+                                       progress=lambda done, total: bar.progress(done / total))
+    bar.empty()
+
+    if result["updated"]:
+        st.success(f"{result['updated']} expenditure(s) were recategorized")
+
+    return result
+
+
+@instrumented
 def categories_dict(user_id: int) -> Dict[str, List[str]]:
     """
     Helper function used for the categorization of expenditures provided by a file.
@@ -272,16 +354,25 @@ def categories_dict(user_id: int) -> Dict[str, List[str]]:
         Key-value pair of the user's category (key) and each category's identifying texts (values).
     """
 
-    #Calls the database and gets all the categories for the given user
-    df = get_user_categories(user_id=user_id, usage="cost_categorization")
+    #The dictionary is prepared once per category version. The lists are copied, so the caller can modify them.
+    return {name: list(texts) for name, texts in get_category_catalog(user_id=user_id).texts.items()}
+
+
+def category_rules(user_id: int) -> Tuple[Tuple[str, str], ...]:
+    """
+    Helper function used for the categorization of expenditures provided by a file.
+    Returns every category and identifying text pair of the user in the order they were added.
+    Identifying texts prefixed with 're:' are used as regular expressions, all other texts are matched literally.
 
-    #Iterates over the dataframe holding all the categories and corresponding texts and adds it to a dictionary.
-    categories_dict = {}
-    for _, row in df.iterrows():
-        if row["name"] not in categories_dict:
-            categories_dict[row["name"]] = [row["text"]]
-        else:
-            categories_dict[row["name"]].append(row["text"])
+    --------
+    Parameters
+    user_id:
+        The id of the current user.
 
-    return categories_dict
+    --------
+    Returns
+    rules: tuple of tuple
+        Containing (category, identifying text) pairs.
+    """
 
+    return get_category_catalog(user_id=user_id).rules
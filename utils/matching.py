@@ -0,0 +1,235 @@
+"""Module containing the multi-pattern matcher used for categorizing transaction texts"""
+import regex as re
+import pandas as pd
+import numpy as np
+from collections import deque
+from functools import lru_cache
+from typing import Dict, List, Tuple, Union
+
+
+#Identifying texts starting with this prefix are treated as regular expressions. All other texts are literals.
+REGEX_PREFIX = "re:"
+
+#Rule types. Literal rules always win over regex rules when both match the same text.
+LITERAL = "literal"
+REGEX = "regex"
+
+#Maximum amount of seconds a single regex search is allowed to run.
+REGEX_TIMEOUT = 0.1
+
+
+def rule_type(text: str) -> str:
+    """
+    Returns whether an identifying text is a literal or a regex rule.
+    Texts with the 're:' prefix that do not compile on their own are treated as literals,
+    so one bad pattern can not break the upload.
+
+    --------
+    Parameters
+    text: str
+        The identifying text of a category.
+
+    --------
+    Returns
+    str {'literal' or 'regex'}
+        The type of the rule.
+    """
+
+    if not text.startswith(REGEX_PREFIX):
+        return LITERAL
+
+    try:
+        re.compile(text[len(REGEX_PREFIX):], flags=re.IGNORECASE)
+    except (re.error, ValueError, OverflowError):
+        return LITERAL
+
+    return REGEX
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton matching any number of literal patterns in a single scan of the text.
+    Patterns and texts are matched case insensitive.
+
+    --------
+    Parameters
+    patterns: list of str
+        The literal patterns to look for. The index of a pattern is what is reported when it matches.
+    """
+
+    def __init__(self, patterns: List[str]) -> None:
+        #Each state holds its outgoing transitions, its failure link and the pattern indices ending in it.
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[int]] = [[]]
+
+        for index, pattern in enumerate(patterns):
+            self._add(pattern.casefold(), index)
+
+        self._build_failure_links()
+
+    def _add(self, pattern: str, index: int) -> None:
+        state = 0
+        for char in pattern:
+            if char not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+                self._goto[state][char] = len(self._goto) - 1
+            state = self._goto[state][char]
+
+        self._output[state].append(index)
+
+    def _build_failure_links(self) -> None:
+        #Breadth first traversal so that the failure link of a parent is always known before its children.
+        queue = deque(self._goto[0].values())
+
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                queue.append(child)
+
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+
+                self._fail[child] = self._goto[fallback].get(char, 0)
+
+                #A state also emits every pattern emitted by the state its failure link points to.
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def search(self, text: str) -> List[int]:
+        """
+        Scans the text once and returns the indices of all patterns occurring in it.
+
+        --------
+        Parameters
+        text: str
+            The text to scan.
+
+        --------
+        Returns
+        matches: list of int
+            Indices of the matching patterns, in the order they were found.
+        """
+
+        matches = []
+        state = 0
+        for char in text.casefold():
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            matches.extend(self._output[state])
+
+        return matches
+
+
+class CategoryMatcher:
+    """
+    Compiled rule set for the automatic categorization of transaction texts.
+
+    Every identifying text of a category is a rule. Texts prefixed with 're:' are regex rules, all other texts are
+    matched literally as substrings. All literal rules share one Aho-Corasick automaton, so a text is scanned once
+    for all of them. Every regex rule is compiled on its own, since patterns like backreferences can not be combined,
+    and the regex rules are only tried when no literal matches.
+
+    When several rules match the same text the conflict is settled in the following order:
+    1. Literal rules win over regex rules.
+    2. The longest matching literal wins.
+    3. The rule that was added first wins, also between regex rules.
+
+    --------
+    Parameters
+    rules: list of tuple
+        Containing (category, identifying text) pairs in the order they were added by the user.
+    """
+
+    def __init__(self, rules: List[Tuple[str, str]]) -> None:
+        self.literals: List[Tuple[str, str]] = []
+        self.regexes: List[Tuple[str, str]] = []
+
+        for category, text in rules:
+            if not text:
+                continue
+            if rule_type(text) == REGEX:
+                self.regexes.append((category, text[len(REGEX_PREFIX):]))
+            else:
+                self.literals.append((category, text))
+
+        self._automaton = AhoCorasick([text for _, text in self.literals])
+
+        self._compiled = [(category, re.compile(pattern, flags=re.IGNORECASE)) for category, pattern in self.regexes]
+
+    def __len__(self) -> int:
+        return len(self.literals) + len(self.regexes)
+
+    def match(self, text: str) -> Union[str, None]:
+        """
+        Returns the category of the highest priority rule matching the text.
+
+        --------
+        Parameters
+        text: str
+            Transaction text to categorize.
+
+        --------
+        Returns
+        str or None
+            The matching category or None if no rule matches.
+        """
+
+        literal_hits = self._automaton.search(text)
+        if literal_hits:
+            best = min(literal_hits, key=lambda index: (-len(self.literals[index][1]), index))
+            return self.literals[best][0]
+
+        #The regex rules are tried in the order they were added, so the earliest matching rule wins.
+        #The timeout guards against user provided patterns with catastrophic backtracking.
+        for category, pattern in self._compiled:
+            try:
+                if pattern.search(text, timeout=REGEX_TIMEOUT):
+                    return category
+            except TimeoutError:
+                continue
+
+        return None
+
+    def categorize(self, texts: pd.Series) -> pd.Series:
+        """
+        Categorizes a whole column of transaction texts. Every distinct text is only matched once.
+
+        --------
+        Parameters
+        texts: pandas.Series
+            Containing the transaction texts.
+
+        --------
+        Returns
+        pandas.Series
+            Containing the matching category for each text, or an empty string if no rule matches.
+        """
+
+        codes, uniques = pd.factorize(texts.fillna("").astype(str))
+        categories = np.array([self.match(text) or "" for text in uniques], dtype=object)
+
+        return pd.Series(categories[codes] if len(codes) else [], index=texts.index, dtype=object)
+
+
+@lru_cache(maxsize=128)
+def compile_rules(rules: Tuple[Tuple[str, str], ...]) -> CategoryMatcher:
+    """
+    Builds the matcher for a user's rules. The result is cached on the rules themselves,
+    so a user uploading several files with unchanged categories only compiles the matcher once.
+
+    --------
+    Parameters
+    rules: tuple of tuple
+        Containing (category, identifying text) pairs in the order they were added by the user.
+
+    --------
+    Returns
+    CategoryMatcher
+        The compiled matcher.
+    """
+
+    return CategoryMatcher(list(rules))
@@ -0,0 +1,211 @@
+"""Module for parsing transaction statement files into typed DataFrames"""
+import pandas as pd
+import hashlib
+import re
+from lxml import etree
+from typing import IO, Iterator, List, Tuple
+
+
+#The columns kept from a Handelsbanken statement and the dtypes they are parsed into.
+STATEMENT_DTYPES = {
+    "Transaktionsdatum": "datetime64[ns]",
+    "Text": "object",
+    "Belopp": "float64",
+    "Saldo": "float64",
+}
+
+#Transaction dates in the statement are always given as ISO dates.
+DATE_FORMAT = "%Y-%m-%d"
+
+#The transaction table is the fourth table in the statement file.
+TRANSACTION_TABLE = 3
+
+#Amount of rows read from the statement file before they are passed on as a DataFrame.
+CHUNK_SIZE = 5000
+
+#Line breaks and runs of whitespace in a cell, which pandas.read_html replaces with a single space.
+WHITESPACE = re.compile(r"[\r\n]+|\s{2,}")
+
+
+def parse_amount(column: pd.Series) -> pd.Series:
+    """
+    Parses a column of amounts from a Handelsbanken statement into floats.
+
+    pandas.read_html treats ',' as the thousands separator, so amounts below 1 000 kr arrive
+    with the decimal comma removed, i.e. incremented by 100. Amounts of 1 000 kr or more contain a
+    space as thousands separator and keep their decimal comma. Amounts read directly from the file
+    by read_statement_chunks always keep their decimal comma.
+
+    --------
+    Parameters
+    column: pandas.Series
+        Containing the raw amounts.
+
+    --------
+    Returns
+    pandas.Series
+        Containing the amounts as float64. Values that could not be parsed are NaN.
+    """
+
+    raw = column.astype(str).str.strip()
+
+    #Non-breaking spaces are used as thousands separator in some exports.
+    has_decimals = raw.str.contains(r"[\s,]", regex=True)
+    cleaned = raw.str.replace(r"\s", "", regex=True).str.replace(",", ".", regex=False)
+
+    amount = pd.to_numeric(cleaned, errors="coerce").astype("float64")
+
+    return amount.where(has_decimals, amount / 100)
+
+
+def parse_statement(frame: pd.DataFrame, header_row: bool = True) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Cleans the transaction table of a Handelsbanken statement and sets the dtypes of its columns.
+    Rows which could not be parsed are returned separately instead of raising.
+
+    --------
+    Parameters
+    frame: pandas.DataFrame
+        The transaction table as read from the statement file.
+    header_row: bool default True
+        Whether the first row of the frame contains the column names.
+
+    --------
+    Returns
+    parsed: pandas.DataFrame
+        Containing Transaktionsdatum, Text, Belopp and Saldo with explicit dtypes.
+    rejected: pandas.DataFrame
+        Containing the raw rows where the date or the amount could not be parsed.
+    """
+
+    #Puts the first entry as the column names.
+    if header_row:
+        frame = frame.iloc[1:].set_axis(frame.iloc[0].astype(str).tolist(), axis=1)
+
+    raw = frame.loc[:, list(STATEMENT_DTYPES)]
+
+    parsed = pd.DataFrame({
+        "Transaktionsdatum": pd.to_datetime(raw["Transaktionsdatum"], format=DATE_FORMAT, errors="coerce"),
+        "Text": raw["Text"].astype(str).str.strip(),
+        "Belopp": parse_amount(raw["Belopp"]),
+        "Saldo": parse_amount(raw["Saldo"]),
+    }, index=raw.index).astype(STATEMENT_DTYPES)
+
+    #A transaction without a date or an amount can not be used. A missing balance is allowed.
+    invalid = parsed["Transaktionsdatum"].isna() | parsed["Belopp"].isna()
+
+    return parsed[~invalid], raw[invalid]
+
+
+def fingerprint_transactions(frame: pd.DataFrame) -> pd.Series:
+    """
+    Computes a fingerprint for every transaction from its date, text, amount and balance.
+    Identical transactions within the frame are told apart by their occurrence index, so two equal payments
+    on the same day get different fingerprints, while the same payment in an overlapping statement gets the same one.
+    Must be computed over a whole statement, since the occurrence index depends on every row in it.
+
+    --------
+    Parameters
+    frame: pandas.DataFrame
+        Containing Transaktionsdatum, Text, Belopp and Saldo.
+
+    --------
+    Returns
+    pandas.Series
+        Containing the hexadecimal sha1 fingerprint of each transaction.
+    """
+
+    content = (pd.to_datetime(frame["Transaktionsdatum"]).dt.strftime("%Y-%m-%d")
+               + "|" + frame["Text"].fillna("").astype(str).str.strip()
+               + "|" + frame["Belopp"].map("{:.2f}".format)
+               + "|" + frame["Saldo"].map(lambda saldo: "" if pd.isna(saldo) else f"{saldo:.2f}"))
+
+    occurrence = content.groupby(content).cumcount().astype(str)
+
+    return pd.Series([hashlib.sha1(key.encode()).hexdigest() for key in content + "|" + occurrence],
+                     index=frame.index, dtype=object)
+
+
+def _cell_texts(row: etree._Element) -> List[str]:
+    #Whitespace is collapsed the way pandas.read_html does it, so texts (and their fingerprints) stay the same
+    #as those of the transactions uploaded before the statements were streamed.
+    return [WHITESPACE.sub(" ", "".join(cell.itertext()).strip()) for cell in row if cell.tag in ("td", "th")]
+
+
+def read_statement_chunks(file: IO[bytes], chunk_size: int = CHUNK_SIZE, table_index: int = TRANSACTION_TABLE) -> Iterator[pd.DataFrame]:
+    """
+    Streams the transaction table out of a Handelsbanken statement file.
+    The file is an HTML document with a .xls extension. Instead of building every table in the document
+    it is parsed incrementally and each row is discarded as soon as it has been read, so the memory used
+    is bounded by chunk_size rather than by the size of the file.
+
+    --------
+    Parameters
+    file: file-like object
+        The statement file, e.g. the file returned by streamlit.file_uploader.
+    chunk_size: int default 5000
+        Maximum amount of rows in each yielded DataFrame.
+    table_index: int default 3
+        Which table in the document, counted from 0, that contains the transactions.
+
+    --------
+    Yields
+    pandas.DataFrame
+        Containing up to chunk_size raw rows, using the first row of the table as column names.
+        The chunks are meant to be passed to parse_statement with header_row=False.
+
+    --------
+    Raises
+    ValueError
+        If the file has no transaction table, i.e. it is not a statement.
+    """
+
+    tables_seen = 0
+    depth = 0
+    found = False
+    columns, rows = None, []
+
+    for event, element in etree.iterparse(file, events=("start", "end"), html=True, recover=True):
+        if element.tag == "table":
+            if event == "start":
+                #Tables nested inside the transaction table are counted but not read.
+                if depth or tables_seen == table_index:
+                    depth += 1
+                    found = True
+                tables_seen += 1
+                continue
+
+            if depth:
+                depth -= 1
+                if depth == 0:
+                    break
+
+            element.clear()
+            continue
+
+        if event != "end" or element.tag != "tr":
+            continue
+
+        if depth == 1:
+            cells = _cell_texts(element)
+
+            if columns is None:
+                columns = cells
+            else:
+                #Short rows are padded and long rows are cut so that every row fits the header.
+                rows.append((cells + [None] * len(columns))[:len(columns)])
+
+            if len(rows) == chunk_size:
+                yield pd.DataFrame(rows, columns=columns)
+                rows = []
+
+        #Frees the row and every row before it that is no longer needed.
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+    if not found:
+        raise ValueError("The file does not contain a transaction table. Only statements from Handelsbanken can be uploaded")
+
+    if rows:
+        yield pd.DataFrame(rows, columns=columns)
@@ -0,0 +1,228 @@
+"""Module applying a user's category rules to the expenditures already stored in the database"""
+import regex as re
+import time
+from sqlalchemy import bindparam, text
+from sqlalchemy.exc import DBAPIError
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+from database import engine, refresh_monthly_rollups
+from instrumentation import instrumented
+from utils.catalog import get_category_catalog
+from utils.matching import REGEX_TIMEOUT, CategoryMatcher
+
+
+#Amount of expenditures recategorized per transaction.
+RECATEGORIZE_BATCH_SIZE = 5000
+
+#How a transaction text is matched against a rule in each dialect. The literal patterns are lowercased (PostgreSQL)
+#or casefolded (SQLite) in Python, so both sides are compared in the same case. PostgreSQL's lower() and ~* follow the
+#character type of the database: under the C ctype only A-Z are folded, so 'ÅHLÉNS' does not match 'åhléns' there.
+_DIALECTS = {
+    "postgresql": {
+        "literal": 'strpos(lower(e."Text"), r.pattern) > 0',
+        "regex": 'e."Text" ~* r.pattern',
+        "distinct": "IS DISTINCT FROM",
+        "fold": str.lower,
+    },
+    "sqlite": {
+        "literal": 'instr(casefold(e."Text"), r.pattern) > 0',
+        "regex": 'regexp_search(r.pattern, e."Text")',
+        "distinct": "IS NOT",
+        "fold": str.casefold,
+    },
+}
+
+
+def _scope(full: bool) -> str:
+    #Only expenditures from uploaded files are matched. Manually added expenditures keep the category the user chose.
+    scope = 'e.user_id = :user_id AND e.fingerprint IS NOT NULL AND e."Typ" = \'Kostnad\''
+
+    #Unless every expenditure is matched again, only the uncategorized ones and those of the edited categories are,
+    #so editing one category never moves expenditures out of another.
+    if not full:
+        scope += ' AND (e."Kategori" = \'Other\' OR e."Kategori" IN :categories)'
+
+    return scope
+
+
+def _queries(dialect: str, full: bool) -> Dict[str, object]:
+    #Builds the statements of a recategorization for the dialect.
+    match = _DIALECTS[dialect]
+    scope = _scope(full)
+
+    queries = {
+        "total": text(f"SELECT COUNT(*) FROM expenditures AS e WHERE {scope}"),
+        "batch_end": text(f'''
+        SELECT MAX(expenditure_id), COUNT(*) FROM (
+            SELECT e.expenditure_id FROM expenditures AS e
+            WHERE {scope} AND e.expenditure_id > :after
+            ORDER BY e.expenditure_id
+            LIMIT :batch_size
+        ) AS batch
+        '''),
+        #Every expenditure gets the category of its highest priority matching rule, or 'Other' if no rule matches.
+        #Only the expenditures whose category changes are written.
+        "update": text(f'''
+        UPDATE expenditures SET "Kategori" = matched.category
+        FROM (
+            SELECT e.expenditure_id, COALESCE((
+                SELECT r.category FROM recategorization_rules AS r
+                WHERE CASE WHEN r.is_regex = 1 THEN {match["regex"]} ELSE {match["literal"]} END
+                ORDER BY r.priority
+                LIMIT 1
+            ), 'Other') AS category
+            FROM expenditures AS e
+            WHERE {scope} AND e.expenditure_id > :after AND e.expenditure_id <= :until
+        ) AS matched
+        WHERE expenditures.expenditure_id = matched.expenditure_id AND expenditures."Kategori" {match["distinct"]} matched.category
+        '''),
+    }
+
+    if not full:
+        queries = {name: query.bindparams(bindparam("categories", expanding=True)) for name, query in queries.items()}
+
+    return queries
+
+
+def _regexp_search(pattern: str, value: Optional[str]) -> int:
+    #The regex rules on SQLite are matched by the same regex module and timeout as during the upload.
+    if value is None:
+        return 0
+    try:
+        return int(re.search(pattern, value, flags=re.IGNORECASE, timeout=REGEX_TIMEOUT) is not None)
+    except (TimeoutError, re.error):
+        return 0
+
+
+def _casefold(value: Optional[str]) -> Optional[str]:
+    return value.casefold() if value is not None else None
+
+
+def rule_priorities(rules: Tuple[Tuple[str, str], ...], fold: Callable[[str], str] = str.casefold) -> List[Dict[str, Union[int, str]]]:
+    """
+    Orders a user's rules by the priorities of utils.matching.CategoryMatcher:
+    literal rules before regex rules, longer literals before shorter ones and earlier rules before later ones.
+    Every expenditure gets the category of the first rule in this order that matches it.
+
+    --------
+    Parameters
+    rules: tuple of tuple
+        Containing (category, identifying text) pairs in the order they were added by the user.
+    fold: Callable default str.casefold
+        Applied to the literal patterns, so that they are matched case insensitive.
+
+    --------
+    Returns
+    list of dict
+        Containing the priority (lowest first), the category, the pattern and whether the pattern is a regex.
+    """
+
+    matcher = CategoryMatcher(list(rules))
+
+    literals = sorted(enumerate(matcher.literals), key=lambda item: (-len(item[1][1]), item[0]))
+    ordered = [(category, fold(pattern), 0) for _, (category, pattern) in literals]
+    ordered += [(category, pattern, 1) for category, pattern in matcher.regexes]
+
+    return [{"priority": priority, "category": category, "pattern": pattern, "is_regex": is_regex}
+            for priority, (category, pattern, is_regex) in enumerate(ordered)]
+
+
+@instrumented
+def recategorize_expenditures(user_id: int, db = engine, categories: Sequence[str] = (), full: bool = False,
+                              batch_size: int = RECATEGORIZE_BATCH_SIZE,
+                              progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, Union[int, float]]:
+    """
+    Applies all of the user's category rules to the expenditures uploaded from files, inside the database.
+    The rules are put in a temporary table and every batch is categorized by one UPDATE joined against it,
+    so no expenditure is sent to Python. The rules are prioritized as in rule_priorities.
+    The result can differ from the upload for the case of non-ASCII letters on PostgreSQL, see _DIALECTS.
+
+    --------
+    Parameters
+    user_id: int
+        The id of the user to recategorize the expenditures of.
+    db: sqlalchemy.engine
+        The database for the application
+    categories: sequence of str default ()
+        The categories that were edited. Only the expenditures in 'Other' or in these categories are matched.
+    full: bool default False
+        Matches every uploaded cost again instead, which also moves costs between categories that were not edited.
+        Costs no longer matching any rule are put in 'Other'.
+    batch_size: int default 5000
+        Amount of expenditures recategorized per transaction, which bounds how long rows are locked.
+    progress: Callable default None
+        Called with the amount of processed expenditures and the total amount after every batch.
+
+    --------
+    Returns
+    dict
+        Containing the amount of matched 'rows', the amount of 'updated' rows, the amount of 'batches' and the 'seconds' it took.
+    """
+
+    started = time.perf_counter()
+    dialect = db.dialect.name
+    queries = _queries(dialect, full)
+    parameters = {"user_id": user_id} if full else {"user_id": user_id, "categories": list(categories)}
+    rules = rule_priorities(get_category_catalog(user_id=user_id, db=db).rules, fold=_DIALECTS[dialect]["fold"])
+
+    processed, updated, batches = 0, 0, 0
+
+    with db.connect() as db_connection:
+        if dialect == "sqlite":
+            driver_connection = db_connection.connection.driver_connection
+            driver_connection.create_function("casefold", 1, _casefold, deterministic=True)
+            driver_connection.create_function("regexp_search", 2, _regexp_search, deterministic=True)
+
+        with db_connection.begin():
+            db_connection.execute(text("DROP TABLE IF EXISTS recategorization_rules"))
+            db_connection.execute(text('''
+            CREATE TEMPORARY TABLE recategorization_rules (
+                priority INTEGER PRIMARY KEY,
+                category VARCHAR NOT NULL,
+                pattern VARCHAR NOT NULL,
+                is_regex INTEGER NOT NULL
+            )
+            '''))
+
+            #PostgreSQL regular expressions are not the same dialect as Python's. Patterns it can not compile are skipped.
+            if dialect == "postgresql":
+                for rule in [rule for rule in rules if rule["is_regex"]]:
+                    try:
+                        with db_connection.begin_nested():
+                            db_connection.execute(text("SELECT '' ~* :pattern"), {"pattern": rule["pattern"]})
+                    except DBAPIError:
+                        rules.remove(rule)
+
+            if rules:
+                db_connection.execute(text('''
+                INSERT INTO recategorization_rules (priority, category, pattern, is_regex)
+                VALUES (:priority, :category, :pattern, :is_regex)
+                '''), rules)
+
+            total = db_connection.execute(queries["total"], parameters).scalar()
+
+        after = 0
+        while True:
+            #Every batch is its own transaction, so a long recategorization never holds the locks of the whole history.
+            with db_connection.begin():
+                until, rows = db_connection.execute(queries["batch_end"], dict(parameters, after=after, batch_size=batch_size)).one()
+                if not rows:
+                    break
+
+                result = db_connection.execute(queries["update"], dict(parameters, after=after, until=until))
+
+            after = until
+            processed += rows
+            updated += max(result.rowcount, 0)
+            batches += 1
+
+            if progress is not None:
+                progress(processed, total)
+
+        with db_connection.begin():
+            db_connection.execute(text("DROP TABLE IF EXISTS recategorization_rules"))
+
+    #The recategorized expenditures can belong to any month.
+    if updated:
+        refresh_monthly_rollups(user_id=user_id, db=db)
+
+    return {"rows": processed, "updated": updated, "batches": batches, "seconds": time.perf_counter() - started}
@@ -2,20 +2,112 @@
 import plotly.express as px
 import pandas as pd
 import numpy as np
-from typing import List
+from typing import List, Optional
+from utils.analytics import AnalyticsFrame
+from instrumentation import instrumented
 
 
-def line_plot(df: pd.DataFrame, selected_categories: List[str]) -> px.line:
+#Maximum amount of points per line in the high volume mode. Lines with more points are downsampled.
+POINT_BUDGET = 240
+
+#Maximum amount of labelled ticks on the x-axis in the high volume mode.
+MAX_TICKS = 24
+
+#Figures with more points than this in total are drawn with WebGL instead of SVG.
+WEBGL_THRESHOLD = 1000
+
+
+def _to_frame(series: pd.Series, name: str) -> pd.DataFrame:
+    #Plotly needs timestamps on the x-axis, so the monthly periods are converted to the first day of each month.
+    return pd.DataFrame({"Transaktionsdatum": series.index.to_timestamp(), name: series.to_numpy()})
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Downsamples a line with the Largest-Triangle-Three-Buckets algorithm, keeping the points that shape the line the most.
+    The first and the last point are always kept.
+
+    --------
+    Parameters
+    x: numpy.ndarray
+        The numeric x-values of the line, sorted in ascending order.
+    y: numpy.ndarray
+        The y-values of the line. Must not contain NaN.
+    threshold: int
+        The amount of points to keep.
+
+    --------
+    Returns
+    numpy.ndarray
+        The positions of the kept points, in ascending order.
+    """
+
+    length = len(x)
+    if threshold >= length or threshold < 3:
+        return np.arange(length)
+
+    x, y = np.asarray(x, dtype="float64"), np.asarray(y, dtype="float64")
+
+    #Every point but the first and the last is put in one of threshold - 2 buckets.
+    edges = np.linspace(1, length - 1, threshold - 1).astype(int)
+    kept = [0]
+
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+
+        #The average of the next bucket, or the last point for the last bucket.
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else length
+        next_x, next_y = x[end:next_end].mean(), y[end:next_end].mean()
+
+        #Keeps the point forming the largest triangle with the previously kept point and the next average.
+        previous = kept[-1]
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        kept.append(start + int(np.argmax(areas)))
+
+    kept.append(length - 1)
+
+    return np.array(kept)
+
+
+def _downsample(df: pd.DataFrame, y: str, point_budget: int) -> pd.DataFrame:
+    #Downsamples a frame with one line, skipping the months without a value.
+    df = df.dropna(subset=[y])
+    positions = lttb(df["Transaktionsdatum"].to_numpy().astype("int64"), df[y].to_numpy(), point_budget)
+
+    return df.iloc[positions]
+
+
+def _ticks(dates: pd.Series, max_ticks: Optional[int] = None) -> dict:
+    #Labels every month once, even when several lines share it. At most max_ticks months are labelled, evenly spread.
+    dates = pd.Series(dates.dropna().unique()).sort_values()
+    if max_ticks is not None and len(dates) > max_ticks:
+        dates = dates.iloc[::-(-len(dates) // max_ticks)]
+
+    return {"tickvals": dates, "ticktext": dates.dt.strftime("%b-%Y")}
+
+
+def _is_high_volume(points: int, high_volume: Optional[bool]) -> bool:
+    #The high volume mode is turned on automatically when a line has more points than the budget.
+    return points > POINT_BUDGET if high_volume is None else high_volume
+
+
+@instrumented
+def line_plot(analytics: AnalyticsFrame, selected_categories: List[str], high_volume: Optional[bool] = None) -> px.line:
     """
-    Masks the provided pandas.DataFrame given the provided categories.
+    Selects the monthly costs of the provided categories from the prepared analytics.
     Plots the costs of the selected categories over time
     
     --------
     Parameters
-    df: pandas.DataFrame
-        Containing transaction data
+    analytics: utils.analytics.AnalyticsFrame
+        The prepared monthly views from utils.analytics.get_analytics
     selected_categories: list of str 
         Containing categories that the user wants to visualize over time..
+    high_volume: bool default None
+        Downsamples every line to POINT_BUDGET points and labels at most MAX_TICKS months.
+        None turns it on for histories longer than POINT_BUDGET months.
+        The lines are drawn with WebGL when there are more than WEBGL_THRESHOLD points in total.
     
     ---------
     Returns
@@ -23,36 +115,45 @@ def line_plot(df: pd.DataFrame, selected_categories: List[str]) -> px.line:
         Line figure showing transactional data over time for given categories.
     """
 
-    #Groups per category and performs monthly-resample on the data
-    df = df.groupby("Kategori").resample(on="Transaktionsdatum", rule="M").sum(numeric_only=True).reset_index()
+    #Takes the monthly costs of the selected categories. Months without costs in a category are left out.
+    costs = analytics.category_costs[[category for category in selected_categories if category in analytics.category_costs]]
+    df = costs.stack().rename("Belopp").rename_axis(["Transaktionsdatum", "Kategori"]).reset_index()
+    df = df[df["Belopp"] < 0]
+    df["Transaktionsdatum"] = pd.PeriodIndex(df["Transaktionsdatum"], freq="M").to_timestamp()
 
-    #Masks the data based on the categories and where belopp is less than 0 (it's costs only)
-    df = df[(df["Kategori"].isin(selected_categories)) & (df["Belopp"] < 0)]
-    
     #For prettifying the line plot all the costs are converted into a positive float.
     df["Belopp"] = df["Belopp"] * -1
 
+    high_volume = _is_high_volume(len(analytics.months), high_volume)
+    if high_volume and len(df):
+        df = df.groupby("Kategori", group_keys=False, sort=False).apply(lambda line: _downsample(line, "Belopp", POINT_BUDGET))
+
     #Dates on x-axis and costs on y-axis
     px_line = px.line(data_frame=df, x="Transaktionsdatum", y="Belopp", 
-                        color="Kategori", markers=True)
+                        color="Kategori", markers=not high_volume,
+                        render_mode="webgl" if len(df) > WEBGL_THRESHOLD else "svg")
 
     #Updates the layout of the plot.
-    px_line.update_layout(xaxis={"title_text": None, "tickvals": df["Transaktionsdatum"], "ticktext": df["Transaktionsdatum"].dt.strftime("%b-%Y")},
+    px_line.update_layout(xaxis={"title_text": None, **_ticks(df["Transaktionsdatum"], MAX_TICKS if high_volume else None)},
                             yaxis={"title_text": "Amount (kr)"},
                             title={"text": "Spending per Category over Time", "font_size": 15.5})
 
     return px_line
 
 
-def monthly_balance(df: pd.DataFrame) -> px.line:
+@instrumented
+def monthly_balance(analytics: AnalyticsFrame, high_volume: Optional[bool] = None) -> px.line:
     """
-    Line plot on the monthly-resample of the provided pandas.DataFrame and takes the latest record of user's balance for each month.
+    Line plot of the latest record of user's balance for each month.
     Only being used for users that have uploaded data via File Upload.
     
     --------
     Parameters
-    df: pandas.DataFrame
-        Containing transaction data
+    analytics: utils.analytics.AnalyticsFrame
+        The prepared monthly views from utils.analytics.get_analytics
+    high_volume: bool default None
+        Downsamples the line to POINT_BUDGET points and labels at most MAX_TICKS months.
+        None turns it on for histories longer than POINT_BUDGET months.
     
     --------
     Returns
@@ -60,28 +161,33 @@ def monthly_balance(df: pd.DataFrame) -> px.line:
         Figure showing the user's balance over time
     """
     
-    #Monthly-resample of the data and takes the latest entry of balance (saldo) for each month in the dataframe.
-    df = df.resample(on="Transaktionsdatum", rule="M").agg({"Saldo": "last"}).reset_index()
+    #The balance (saldo) of the latest transaction for each month.
+    df = _to_frame(analytics.monthly_balance, "Saldo")
+
+    high_volume = _is_high_volume(len(df), high_volume)
+    if high_volume:
+        df = _downsample(df, "Saldo", POINT_BUDGET)
 
     #Date on x-axis and balance on y-axis.
-    px_line = px.line(data_frame=df, x="Transaktionsdatum", y="Saldo", markers=True)
+    px_line = px.line(data_frame=df, x="Transaktionsdatum", y="Saldo", markers=not high_volume)
 
     #Updates the layout of the plot
-    px_line.update_layout(xaxis={"title_text": None, "tickvals": df["Transaktionsdatum"], "ticktext": df["Transaktionsdatum"].dt.strftime("%b-%Y")},
+    px_line.update_layout(xaxis={"title_text": None, **_ticks(df["Transaktionsdatum"], MAX_TICKS if high_volume else None)},
                         yaxis={"title_text": "Savings (kr)"},
                         title={"text": "Total Deposit Savings (kr)","font_size": 15.5},
                         showlegend=False)
 
     return px_line
 
-def bar_plot(df: pd.DataFrame) -> px.bar:
+@instrumented
+def bar_plot(analytics: AnalyticsFrame) -> px.bar:
     """
-    Monthly resamples the data and provides a bar plot of the profit/loss per month.
+    Provides a bar plot of the profit/loss per month.
     
     --------
     Parameters
-    df: pandas.DataFrame
-        Containing transaction data
+    analytics: utils.analytics.AnalyticsFrame
+        The prepared monthly views from utils.analytics.get_analytics
     
     --------
     Returns
@@ -89,8 +195,8 @@ def bar_plot(df: pd.DataFrame) -> px.bar:
         Figure showing whether the user's costs exceeded their income or not.
     """
 
-    #Monthly-resample of the data. Summarizes all the costs and income for each month.
-    df = df.resample(rule="M", on="Transaktionsdatum").sum(numeric_only=True).reset_index()
+    #All the costs and income for each month. Months without transactions are shown as 0.
+    df = _to_frame(analytics.monthly_net, "Belopp")
 
     #Sets a color indicator column for the bar plot. If positive = green, else red.
     df["color"] = np.where(df["Belopp"] > 0, "green", "red")
@@ -115,14 +221,15 @@ def bar_plot(df: pd.DataFrame) -> px.bar:
     return px_bar
 
 
-def horizontal_barplot(df: pd.DataFrame, selected_month: str) -> px.bar:
+@instrumented
+def horizontal_barplot(analytics: AnalyticsFrame, selected_month: str) -> px.bar:
     """
-    Masks the data on a specific month and provides an horizontal bar plot of the costs
+    Selects a specific month of the prepared analytics and provides an horizontal bar plot of the costs
     
     --------
     Parameters
-    df: pandas.DataFrame
-        Containing transaction data
+    analytics: utils.analytics.AnalyticsFrame
+        The prepared monthly views from utils.analytics.get_analytics
     selected_month: str
         Containing the selected month as '%b-%Y', e.g. Mar-2023.
     
@@ -132,11 +239,13 @@ def horizontal_barplot(df: pd.DataFrame, selected_month: str) -> px.bar:
         Figure showing the costs for each category, where each category is represented as a bar.
     """
 
-    #Masks the df based on the provided month and only including costs.
-    df = df[(df["month"] == selected_month) & (df["Typ"] == "Kostnad")]
-
-    #Groups the df based on category and sums the values and sorts them.
-    df = df.groupby("Kategori").sum(numeric_only=True).sort_values(by="Belopp", ascending=False)
+    #Looks up the costs per category of the provided month and sorts them.
+    period = pd.Period(pd.to_datetime(selected_month, format="%b-%Y"), freq="M")
+    if period in analytics.category_costs.index:
+        costs = analytics.category_costs.loc[period].dropna()
+    else:
+        costs = pd.Series(dtype="float64")
+    df = costs.rename("Belopp").rename_axis("Kategori").to_frame().sort_values(by="Belopp", ascending=False)
 
     #For prettifying the plot it puts the costs as positives instead
     df["Belopp"] = df["Belopp"] * -1